@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+# Columns of an open conversation kept in the cache
+_CONVERSATION_FIELDS = ("id", "topic", "summary", "summary_through")
+
+
+class TTLCache:
+    """
+    A small bounded LRU cache whose entries also expire after `ttl` seconds.
+    Not thread-safe: it is meant to be used from the event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        item = self._data.get(key, _MISSING)
+        return item is not _MISSING and item[1] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class UserCache:
+    """
+    Hot lookups for the webhook path: phone → user id, user id → profile row,
+    and user id → open conversations (most recent first). Filled write-through
+    from the repository's own reads and writes, and invalidated from Supabase
+    Realtime events when rows change elsewhere.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.user_ids = TTLCache(maxsize, ttl)
+        self.profiles = TTLCache(maxsize, ttl)
+        self.conversations = TTLCache(maxsize, ttl)
+        # conversation id → user id, so DELETE events (which only carry the id) can be routed
+        self._conversation_owner = TTLCache(maxsize * 4, ttl)
+        self.invalidations = 0
+
+    # --- Users ---
+
+    def get_user(self, user_id) -> dict | None:
+        return self.profiles.get(user_id)
+
+    def get_user_by_phone(self, phone: str) -> dict | None:
+        user_id = self.user_ids.get(phone)
+        return None if user_id is None else self.profiles.get(user_id)
+
+    def put_user(self, user: dict):
+        self.profiles.set(user["id"], user)
+        if user.get("phone"):
+            self.user_ids.set(user["phone"], user["id"])
+
+    def invalidate_user(self, user_id):
+        user = self.profiles.pop(user_id)
+        if user and user.get("phone"):
+            self.user_ids.pop(user["phone"])
+        self.invalidations += 1
+
+    # --- Conversations ---
+
+    def open_conversations(self, user_id) -> list[dict] | None:
+        return self.conversations.get(user_id)
+
+    def set_open_conversations(self, user_id, conversations: list[dict]):
+        self.conversations.set(user_id, [_conversation(c) for c in conversations])
+        for c in conversations:
+            self._conversation_owner.set(c["id"], user_id)
+
+    def add_conversation(self, user_id, conversation: dict):
+        """Records a newly opened conversation, if the user's list is cached."""
+        self._conversation_owner.set(conversation["id"], user_id)
+        cached = self.conversations.get(user_id)
+        if cached is None:
+            return
+        if any(c["id"] == conversation["id"] for c in cached):
+            return
+        self.conversations.set(user_id, [_conversation(conversation)] + cached)
+
+    def update_conversation(self, user_id, conversation: dict):
+        """Replaces a cached open conversation in place (e.g. a new topic or summary)."""
+        cached = self.conversations.get(user_id)
+        if cached is None:
+            return
+        changes = {k: v for k, v in conversation.items() if k in _CONVERSATION_FIELDS}
+        self.conversations.set(
+            user_id,
+            [{**c, **changes} if c["id"] == conversation["id"] else c for c in cached],
+        )
+
+    def invalidate_conversation(self, conversation_id, user_id=None):
+        if user_id is None:
+            user_id = self._conversation_owner.pop(conversation_id)
+        if user_id is not None:
+            self.conversations.pop(user_id)
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "user_ids": self.user_ids.stats(),
+            "profiles": self.profiles.stats(),
+            "conversations": self.conversations.stats(),
+            "invalidations": self.invalidations,
+        }
+
+
+def _conversation(row: dict) -> dict:
+    return {field: row.get(field) for field in _CONVERSATION_FIELDS}
+
+
+class AudioCache:
+    """
+    Content-addressed cache for synthesized speech. MP3 bytes live on local
+    disk under `directory`, evicted LRU once they exceed `max_bytes`; the
+    WhatsApp media id of an uploaded reply is remembered in memory until
+    `media_ttl` so a repeated reply skips both synthesis and upload.
+
+    The index is only touched from the event loop; file I/O runs in threads.
+    """
+
+    def __init__(
+        self, directory: str, max_bytes: int, media_ttl: float, max_media: int
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = bool(directory)
+        self._index: OrderedDict = OrderedDict()  # key → size, least recent first
+        self._bytes = 0
+        self._media_ids = TTLCache(max_media, media_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """Hashes e.g. (text, voice_id, model_id, output_format) into a cache key."""
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def load(self):
+        """Indexes the MP3s already on disk, oldest access first. Blocking; run it in a thread."""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".mp3"):
+                    stat = entry.stat()
+                    entries.append((stat.st_atime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+
+    async def get_audio(self, key: str) -> bytes | None:
+        if not self.enabled or key not in self._index:
+            self.misses += 1
+            return None
+        self._index.move_to_end(key)
+        try:
+            audio = await asyncio.to_thread(_read_file, self._path(key))
+        except FileNotFoundError:
+            self._bytes -= self._index.pop(key, 0)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return audio
+
+    async def put_audio(self, key: str, audio: bytes):
+        if not self.enabled or key in self._index:
+            return
+        await asyncio.to_thread(_write_file, self._path(key), audio)
+        if key in self._index:  # stored by a concurrent put meanwhile
+            return
+        self._index[key] = len(audio)
+        self._bytes += len(audio)
+
+        stale = []
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            old_key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            stale.append(self._path(old_key))
+            self.evictions += 1
+        if stale:
+            await asyncio.to_thread(_remove_files, stale)
+
+    def get_media_id(self, key: str) -> str | None:
+        return self._media_ids.get(key)
+
+    def set_media_id(self, key: str, media_id: str):
+        self._media_ids.set(key, media_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "files": len(self._index),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "media_ids": self._media_ids.stats(),
+        }
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path: str, data: bytes):
+    # Write then rename so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _remove_files(paths: list[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
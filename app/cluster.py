@@ -0,0 +1,164 @@
+"""
+Runs app.service:app as several worker processes sharing one port, so
+every core serves traffic while each sender stays on one process:
+
+    python -m app.cluster --host 0.0.0.0 --port 8000 --shards 4
+
+The supervisor binds the public socket once and starts one worker per
+shard, passing the socket down; the kernel spreads connections across
+them and app/shard.py forwards each webhook to the shard that owns its
+sender. Shard 0 runs the singletons (Realtime listener, reminders,
+nudges). A worker that dies is restarted on the same shard index, and the
+public socket stays open meanwhile, so connections queue rather than fail.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import uvicorn
+
+from app.config import config
+from app.shard import shards
+
+
+def usable_cpus() -> int:
+    """Cores this process may run on, which in a container can be fewer than the host's."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--shards",
+        type=int,
+        # An explicit SHARD_COUNT wins, otherwise one shard per usable core
+        default=int(os.getenv("SHARD_COUNT") or 0) or usable_cpus(),
+    )
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+class Supervisor:
+    """Starts `count` workers on the public socket and keeps them running."""
+
+    def __init__(self, sock: socket.socket, count: int, log_level: str):
+        self.sock = sock
+        self.count = count
+        self.log_level = log_level
+        self.workers: dict[int, subprocess.Popen] = {}
+        self.started: dict[int, float] = {}
+        self.restarts: dict[int, int] = {}
+        # Crashed shards waiting out their backoff, by when to restart them
+        self.restart_at: dict[int, float] = {}
+        self.stopping = False
+
+    def spawn(self, index: int) -> subprocess.Popen:
+        env = {
+            **os.environ,
+            "SHARD_INDEX": str(index),
+            "SHARD_COUNT": str(self.count),
+            "SHARD_PUBLIC_FD": str(self.sock.fileno()),
+        }
+        worker = subprocess.Popen(
+            [sys.executable, "-m", "app.cluster", "--worker"]
+            + ["--log-level", self.log_level],
+            env=env,
+            pass_fds=(self.sock.fileno(),),
+        )
+        self.started[index] = time.monotonic()
+        print(f"🧩 Started shard {index}/{self.count} (pid {worker.pid})")
+        return worker
+
+    def run(self) -> int:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self._stop)
+        for index in range(self.count):
+            self.workers[index] = self.spawn(index)
+
+        while not self.stopping:
+            time.sleep(0.5)
+            now = time.monotonic()
+            for index, worker in self.workers.items():
+                if self.stopping:
+                    break
+                if index in self.restart_at:
+                    if now >= self.restart_at[index]:
+                        del self.restart_at[index]
+                        self.workers[index] = self.spawn(index)
+                    continue
+                if worker.poll() is None:
+                    continue
+                if now - self.started[index] > 60:
+                    self.restarts[index] = 0  # it was healthy for a while
+                self.restarts[index] = self.restarts.get(index, 0) + 1
+                # Back off a crash-looping worker, up to half a minute; the
+                # loop keeps watching the other shards and signals meanwhile
+                delay = min(2 ** (self.restarts[index] - 1), 30)
+                print(
+                    f"⚠️ Shard {index} exited ({worker.returncode}), "
+                    f"restarting in {delay}s"
+                )
+                self.restart_at[index] = now + delay
+
+        return self.shutdown()
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def shutdown(self, timeout: float = 30.0) -> int:
+        """Asks every worker to finish (they drain their queues), then kills stragglers."""
+        for worker in self.workers.values():
+            if worker.poll() is None:
+                worker.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        for index, worker in self.workers.items():
+            try:
+                worker.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                print(f"⚠️ Shard {index} did not stop in time, killing it")
+                worker.kill()
+                worker.wait()
+        self.sock.close()
+        return 0
+
+
+def serve_worker(log_level: str):
+    """One shard: the app on the inherited public socket and on its private port."""
+    public = socket.socket(fileno=int(os.environ["SHARD_PUBLIC_FD"]))
+    private = bind(config["SHARD_HOST"], shards.port(shards.index))
+    server = uvicorn.Server(uvicorn.Config("app.service:app", log_level=log_level))
+    server.run(sockets=[public, private])
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    if args.worker:
+        serve_worker(args.log_level)
+        return 0
+    if args.shards < 1:
+        raise ValueError("--shards must be at least 1")
+    sock = bind(args.host, args.port)
+    print(f"🧩 Serving on {args.host}:{args.port} with {args.shards} shard(s)")
+    return Supervisor(sock, args.shards, args.log_level).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
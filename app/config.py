@@ -4,10 +4,11 @@ from dotenv import load_dotenv
 
 
 def load_config():
-    if os.path.exists(
-        ".env"
-    ):  # this makes it so .env files override whatever other env vars have been loaded in
-        load_dotenv(".env", override=True)
+    # .env overrides whatever env vars are already set; DOTENV_PATH="" skips it
+    # (the benchmark does, so a developer's real keys never reach its fakes)
+    dotenv_path = os.getenv("DOTENV_PATH", ".env")
+    if dotenv_path and os.path.exists(dotenv_path):
+        load_dotenv(dotenv_path, override=True)
 
     config = {
         "WHATSAPP_TOKEN": os.getenv("WHATSAPP_TOKEN"),
@@ -17,11 +18,189 @@ def load_config():
         "ELEVENLABS_KEY": os.getenv("ELEVENLABS_KEY"),
         "SUPABASE_URL": os.getenv("SUPABASE_URL"),
         "SUPABASE_KEY": os.getenv("SUPABASE_KEY"),
+        # Point the SDKs somewhere else (e.g. the bench/ fakes); unset means the real APIs
+        "OPENAI_BASE_URL": os.getenv("OPENAI_BASE_URL") or None,
+        "ELEVENLABS_BASE_URL": os.getenv("ELEVENLABS_BASE_URL") or None,
+        # Subscribe to Supabase Realtime for table changes made outside this process
+        "SUPABASE_REALTIME": os.getenv("SUPABASE_REALTIME", "true").lower() == "true",
+        # "queue" acks the webhook immediately and processes on the worker pool,
+        # "inline" keeps the old behaviour of processing before responding
+        "WEBHOOK_MODE": os.getenv("WEBHOOK_MODE", "queue"),
+        "WORKER_POOL_SIZE": int(os.getenv("WORKER_POOL_SIZE", "4")),
+        "WORKER_CONCURRENCY": int(os.getenv("WORKER_CONCURRENCY", "8")),
+        "WORKER_QUEUE_SIZE": int(os.getenv("WORKER_QUEUE_SIZE", "1000")),
+        "WORKER_ENQUEUE_TIMEOUT": float(os.getenv("WORKER_ENQUEUE_TIMEOUT", "0.05")),
+        # Messages from the same sender within this window are answered as one turn
+        "MAILBOX_DEBOUNCE": float(os.getenv("MAILBOX_DEBOUNCE", "1.0")),
+        "MAILBOX_MAX_WAIT": float(os.getenv("MAILBOX_MAX_WAIT", "4.0")),
+        "MAILBOX_MAX_BATCH": int(os.getenv("MAILBOX_MAX_BATCH", "10")),
+        "MAILBOX_MAX_PENDING": int(os.getenv("MAILBOX_MAX_PENDING", "5000")),
+        # "memory" dedups per process, "supabase" also shares claims across replicas
+        "DEDUP_BACKEND": os.getenv("DEDUP_BACKEND", "memory"),
+        "DEDUP_TTL_SECONDS": float(os.getenv("DEDUP_TTL_SECONDS", "604800")),
+        "DEDUP_MAX_ENTRIES": int(os.getenv("DEDUP_MAX_ENTRIES", "100000")),
+        "GRAPH_API_URL": os.getenv("GRAPH_API_URL", "https://graph.facebook.com"),
+        "GRAPH_API_VERSION": os.getenv("GRAPH_API_VERSION", "v22.0"),
+        "GRAPH_TIMEOUT": float(os.getenv("GRAPH_TIMEOUT", "15")),
+        "GRAPH_MAX_CONNECTIONS": int(os.getenv("GRAPH_MAX_CONNECTIONS", "50")),
+        "GRAPH_MAX_RETRIES": int(os.getenv("GRAPH_MAX_RETRIES", "3")),
+        "GRAPH_BACKOFF": float(os.getenv("GRAPH_BACKOFF", "0.25")),
+        "SUPABASE_MAX_CONNECTIONS": int(os.getenv("SUPABASE_MAX_CONNECTIONS", "50")),
+        "SUPABASE_TIMEOUT": float(os.getenv("SUPABASE_TIMEOUT", "10")),
+        # Persist each turn through the db/migrations/002 functions (2 round trips)
+        "DB_TURN_RPC": os.getenv("DB_TURN_RPC", "true").lower() == "true",
+        "USER_CACHE_SIZE": int(os.getenv("USER_CACHE_SIZE", "10000")),
+        "USER_CACHE_TTL_SECONDS": float(os.getenv("USER_CACHE_TTL_SECONDS", "300")),
+        # Per-user rolling window of recent messages used to build the prompt
+        "HISTORY_WINDOW": int(os.getenv("HISTORY_WINDOW", "20")),
+        "HISTORY_MAX_USERS": int(os.getenv("HISTORY_MAX_USERS", "5000")),
+        "HISTORY_TTL_SECONDS": float(os.getenv("HISTORY_TTL_SECONDS", "1800")),
+        # Prompt token budget; older messages are folded into a rolling summary
+        # "tiktoken" counts prompt tokens exactly, "estimate" assumes ~4 characters
+        # per token and never fetches the encoding (offline runs, the bench)
+        "TOKENIZER": os.getenv("TOKENIZER", "tiktoken"),
+        "CONTEXT_TOKEN_BUDGET": int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000")),
+        "CONTEXT_KEEP_TURNS": int(os.getenv("CONTEXT_KEEP_TURNS", "12")),
+        "CONTEXT_SUMMARY_BATCH": int(os.getenv("CONTEXT_SUMMARY_BATCH", "6")),
+        "CONTEXT_SUMMARY_MODEL": os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-4o-mini"),
+        "CONTEXT_SUMMARY_MAX_TOKENS": int(
+            os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300")
+        ),
+        # Voice replies are synthesized sentence by sentence while the LLM streams
+        "TTS_MAX_CONCURRENCY": int(os.getenv("TTS_MAX_CONCURRENCY", "4")),
+        "TTS_FIRST_CHUNK_CHARS": int(os.getenv("TTS_FIRST_CHUNK_CHARS", "20")),
+        "TTS_CHUNK_CHARS": int(os.getenv("TTS_CHUNK_CHARS", "150")),
+        # Voice notes are buffered in memory up to this size, then spill to disk
+        "AUDIO_SPOOL_MAX_BYTES": int(os.getenv("AUDIO_SPOOL_MAX_BYTES", "1048576")),
+        # Synthesized speech cached on disk by text; set TTS_CACHE_DIR="" to disable
+        "TTS_CACHE_DIR": os.getenv("TTS_CACHE_DIR", ".cache/tts"),
+        "TTS_CACHE_MAX_BYTES": int(os.getenv("TTS_CACHE_MAX_BYTES", "268435456")),
+        # WhatsApp keeps uploaded media for 30 days; reuse ids well inside that
+        "TTS_MEDIA_TTL_SECONDS": float(os.getenv("TTS_MEDIA_TTL_SECONDS", "604800")),
+        "TTS_MEDIA_CACHE_SIZE": int(os.getenv("TTS_MEDIA_CACHE_SIZE", "10000")),
+        # One replica holds the reminder lease; missed reminders within the grace fire once
+        "REMINDER_LEASE_TTL_SECONDS": float(
+            os.getenv("REMINDER_LEASE_TTL_SECONDS", "30")
+        ),
+        "REMINDER_MISFIRE_GRACE_SECONDS": float(
+            os.getenv("REMINDER_MISFIRE_GRACE_SECONDS", "3600")
+        ),
+        # Reminders due within one tick are claimed, looked up and sent as a batch
+        "REMINDER_TICK_SECONDS": float(os.getenv("REMINDER_TICK_SECONDS", "1.0")),
+        "REMINDER_SEND_CONCURRENCY": int(os.getenv("REMINDER_SEND_CONCURRENCY", "20")),
+        "REMINDER_MAX_BATCH": int(os.getenv("REMINDER_MAX_BATCH", "1000")),
+        # A reminder whose send fails is released and retried, backing off from this delay
+        "REMINDER_RETRY_DELAY_SECONDS": float(
+            os.getenv("REMINDER_RETRY_DELAY_SECONDS", "30")
+        ),
+        "REMINDER_MAX_ATTEMPTS": int(os.getenv("REMINDER_MAX_ATTEMPTS", "3")),
+        # Outbound messages: per phone-number-id rate limit (split among shards),
+        # retries and shutdown drain
+        "OUTBOX_RATE": float(os.getenv("OUTBOX_RATE", "20")),
+        "OUTBOX_BURST": int(os.getenv("OUTBOX_BURST", "40")),
+        "OUTBOX_CONCURRENCY": int(os.getenv("OUTBOX_CONCURRENCY", "16")),
+        "OUTBOX_MAX_ATTEMPTS": int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6")),
+        "OUTBOX_BACKOFF": float(os.getenv("OUTBOX_BACKOFF", "1.0")),
+        "OUTBOX_BACKOFF_CAP": float(os.getenv("OUTBOX_BACKOFF_CAP", "300")),
+        "OUTBOX_DRAIN_TIMEOUT": float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "5")),
+        # Deferred messages stay with their process while it renews this lease
+        "OUTBOX_LEASE_TTL_SECONDS": float(os.getenv("OUTBOX_LEASE_TTL_SECONDS", "60")),
+        # Senders wait this long for delivery, then leave the retries to the outbox
+        "OUTBOX_WAIT_SECONDS": float(os.getenv("OUTBOX_WAIT_SECONDS", "10")),
+        # Turns the local router may answer without GPT-4o: "ack" (template reply),
+        # "task" (reminder/goal phrasing on the cheaper model); empty disables both
+        "ROUTER_ROUTES": {
+            route.strip()
+            for route in os.getenv("ROUTER_ROUTES", "ack,task").split(",")
+            if route.strip()
+        },
+        "ROUTER_TASK_MODEL": os.getenv("ROUTER_TASK_MODEL", "gpt-4o-mini"),
+        "EMBEDDING_MODEL": os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"),
+        "EMBEDDING_CACHE_SIZE": int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+        "EMBEDDING_CACHE_TTL_SECONDS": float(
+            os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400")
+        ),
+        # Topics are matched by embedding; the current topic gets a bonus and a
+        # small model breaks ties within the ambiguous band
+        "TOPIC_MODEL": os.getenv("TOPIC_MODEL", "gpt-4o-mini"),
+        "TOPIC_STICKINESS": float(os.getenv("TOPIC_STICKINESS", "0.05")),
+        "TOPIC_AMBIGUOUS_BAND": float(os.getenv("TOPIC_AMBIGUOUS_BAND", "0.05")),
+        "TOPIC_MIN_SIMILARITY": float(os.getenv("TOPIC_MIN_SIMILARITY", "0.2")),
+        "TOPIC_MIN_WORDS": int(os.getenv("TOPIC_MIN_WORDS", "3")),
+        # Replies to self-contained questions shared across users
+        "RESPONSE_CACHE_ENABLED": os.getenv("RESPONSE_CACHE_ENABLED", "false").lower()
+        == "true",
+        "RESPONSE_CACHE_THRESHOLD": float(
+            os.getenv("RESPONSE_CACHE_THRESHOLD", "0.94")
+        ),
+        "RESPONSE_CACHE_MAX_ENTRIES": int(
+            os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000")
+        ),
+        "RESPONSE_CACHE_TTL_SECONDS": float(
+            os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400")
+        ),
+        "RESPONSE_CACHE_MAX_WORDS": int(os.getenv("RESPONSE_CACHE_MAX_WORDS", "25")),
+        # Every OpenAI call: in-flight cap, deadline, retries, and the model used
+        # once less than LLM_FALLBACK_BELOW seconds of the deadline remain
+        "LLM_MAX_IN_FLIGHT": int(os.getenv("LLM_MAX_IN_FLIGHT", "32")),
+        "LLM_TIMEOUT": float(os.getenv("LLM_TIMEOUT", "30")),
+        "LLM_MAX_RETRIES": int(os.getenv("LLM_MAX_RETRIES", "2")),
+        "LLM_BACKOFF": float(os.getenv("LLM_BACKOFF", "0.5")),
+        "LLM_FALLBACK_MODEL": os.getenv("LLM_FALLBACK_MODEL", "gpt-4o-mini"),
+        "LLM_FALLBACK_BELOW": float(os.getenv("LLM_FALLBACK_BELOW", "10")),
+        # Wearable/biomarker/assessment exports used to personalize replies;
+        # HEALTH_DATA_DIR="" turns them off, HEALTH_DATA_CACHE_DIR="" skips the parsed cache
+        "HEALTH_DATA_DIR": os.getenv("HEALTH_DATA_DIR", "data"),
+        "HEALTH_DATA_CACHE_DIR": os.getenv("HEALTH_DATA_CACHE_DIR", ".cache/health"),
+        "HEALTH_WINDOW_DAYS": int(os.getenv("HEALTH_WINDOW_DAYS", "7")),
+        # Proactive nudges scored from the health data (off unless enabled);
+        # quiet hours are "start-end" in NUDGE_TIMEZONE and may wrap past midnight
+        "NUDGES_ENABLED": os.getenv("NUDGES_ENABLED", "false").lower() == "true",
+        "NUDGE_INTERVAL_SECONDS": float(os.getenv("NUDGE_INTERVAL_SECONDS", "3600")),
+        "NUDGE_COOLDOWN_HOURS": float(os.getenv("NUDGE_COOLDOWN_HOURS", "72")),
+        "NUDGE_QUIET_HOURS": tuple(
+            int(hour) for hour in os.getenv("NUDGE_QUIET_HOURS", "21-9").split("-")
+        ),
+        "NUDGE_TIMEZONE": os.getenv("NUDGE_TIMEZONE", "UTC"),
+        "NUDGE_STEP_TARGET": float(os.getenv("NUDGE_STEP_TARGET", "7000")),
+        "NUDGE_DEEP_SLEEP_RATIO": float(os.getenv("NUDGE_DEEP_SLEEP_RATIO", "0.2")),
+        "NUDGE_TREND_DROP": float(os.getenv("NUDGE_TREND_DROP", "0.3")),
+        "NUDGE_MIN_SCORE": float(os.getenv("NUDGE_MIN_SCORE", "0.5")),
+        "NUDGE_MAX_PER_RUN": int(os.getenv("NUDGE_MAX_PER_RUN", "1000")),
+        # Worker processes started by app/cluster.py; each sender's webhooks are
+        # handled by the shard its WhatsApp id hashes to, and shard i also
+        # listens on SHARD_HOST:SHARD_BASE_PORT+i for traffic from the others
+        "SHARD_COUNT": int(os.getenv("SHARD_COUNT", "1")),
+        "SHARD_INDEX": int(os.getenv("SHARD_INDEX", "0")),
+        "SHARD_HOST": os.getenv("SHARD_HOST", "127.0.0.1"),
+        "SHARD_BASE_PORT": int(os.getenv("SHARD_BASE_PORT", "8100")),
+        "SHARD_VNODES": int(os.getenv("SHARD_VNODES", "128")),
+        "SHARD_FORWARD_TIMEOUT": float(os.getenv("SHARD_FORWARD_TIMEOUT", "10")),
+        # Structured JSON logs; "debug" adds a line per span and webhook
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "info"),
+        # How often the event loop is checked for lag (a blocked loop delays everything)
+        "LOOP_LAG_INTERVAL": float(os.getenv("LOOP_LAG_INTERVAL", "0.25")),
     }
 
     # Validate required settings
     if not config["WHATSAPP_TOKEN"]:
         raise ValueError("WHATSAPP_TOKEN is not set")
+    if config["WEBHOOK_MODE"] not in ("queue", "inline"):
+        raise ValueError("WEBHOOK_MODE must be 'queue' or 'inline'")
+    if config["DEDUP_BACKEND"] not in ("memory", "supabase"):
+        raise ValueError("DEDUP_BACKEND must be 'memory' or 'supabase'")
+    if config["TOKENIZER"] not in ("tiktoken", "estimate"):
+        raise ValueError("TOKENIZER must be 'tiktoken' or 'estimate'")
+    if not config["ROUTER_ROUTES"] <= {"ack", "task"}:
+        raise ValueError("ROUTER_ROUTES may only contain 'ack' and 'task'")
+
+    if not 0 <= config["SHARD_INDEX"] < config["SHARD_COUNT"]:
+        raise ValueError("SHARD_INDEX must be between 0 and SHARD_COUNT - 1")
+
+    if len(config["NUDGE_QUIET_HOURS"]) != 2 or not all(
+        0 <= hour <= 23 for hour in config["NUDGE_QUIET_HOURS"]
+    ):
+        raise ValueError("NUDGE_QUIET_HOURS must look like '21-9'")
 
     return config
 
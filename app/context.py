@@ -0,0 +1,210 @@
+import asyncio
+import logging
+
+import tiktoken
+
+from app.config import config
+from app.db import db
+from app.gateway import gateway
+from app.tracing import log
+
+# GPT-4o's tokenizer
+ENCODING = "o200k_base"
+
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a WhatsApp conversation between a user "
+    "and Aura, their personal assistant. Update the summary with the new "
+    "messages below. Keep facts about the user, their plans, reminders, goals "
+    "and anything Aura promised; drop small talk. Write at most a short "
+    "paragraph in the third person."
+)
+
+_encoding: tiktoken.Encoding | None = None
+_estimate = config["TOKENIZER"] == "estimate"
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts tokens locally. The encoding is loaded on first use, from
+    TIKTOKEN_CACHE_DIR or else downloaded; with TOKENIZER=estimate, or if it
+    can't be loaded (e.g. offline), ~4 characters per token are assumed.
+    """
+    global _encoding, _estimate
+    if _encoding is None and not _estimate:
+        try:
+            _encoding = tiktoken.get_encoding(ENCODING)
+        except Exception as e:
+            log("tokenizer_unavailable", logging.WARNING, error=repr(e))
+            _estimate = True
+    if _estimate:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+class Context:
+    """The assembled prompt for one turn, plus the history that didn't fit in it."""
+
+    __slots__ = ("messages", "tokens", "overflow")
+
+    def __init__(self, messages: list[dict], tokens: int, overflow: list[dict]):
+        self.messages = messages
+        self.tokens = tokens
+        # Older messages left out of the prompt and not yet in the summary
+        self.overflow = overflow
+
+
+class ContextBuilder:
+    """
+    Assembles the chat prompt within a token budget: the system prompt, the
+    conversation's rolling summary and as many of the most recent messages
+    as fit (at most `keep_turns`), verbatim.
+
+    Older messages are folded into the summary in the background with a
+    cheaper model once `summary_batch` of them have piled up, and stored on
+    the conversation row, so the prompt stays roughly the same size however
+    long the conversation gets.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        keep_turns: int,
+        summary_batch: int,
+        summary_model: str,
+        summary_max_tokens: int,
+    ):
+        self.budget = budget
+        self.keep_turns = keep_turns
+        self.summary_batch = summary_batch
+        self.summary_model = summary_model
+        self.summary_max_tokens = summary_max_tokens
+        self._summarizing: set[int] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+        # Counters exposed through stats()
+        self.builds = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.trimmed = 0
+        self.summaries = 0
+        self.summary_errors = 0
+
+    def build(
+        self, system_prompt: str, history: list[dict], conversation: dict | None = None
+    ) -> Context:
+        """
+        `history` is the chronological message log ({id, role, message}) and
+        `conversation` the open conversation with its summary, if any.
+        """
+        conversation = conversation or {}
+        summary = conversation.get("summary")
+        summary_through = conversation.get("summary_through")
+        if summary_through is not None:
+            # Anything up to the watermark is already covered by the summary
+            history = [
+                log
+                for log in history
+                if log.get("id") is None or log["id"] > summary_through
+            ]
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if summary:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation: {summary}",
+                }
+            )
+        tokens = sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+        recent = []
+        for entry in reversed(history[-self.keep_turns :]):
+            content = entry.get("message") or entry.get("content", "")
+            cost = count_tokens(content) + MESSAGE_OVERHEAD
+            # The latest message always goes in, even if it blows the budget
+            if recent and tokens + cost > self.budget:
+                self.trimmed += 1
+                break
+            role = "user" if entry["role"] == "user" else "assistant"
+            recent.append({"role": role, "content": content})
+            tokens += cost
+        messages.extend(reversed(recent))
+
+        self.builds += 1
+        self.prompt_tokens += tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, tokens)
+        return Context(messages, tokens, history[: len(history) - len(recent)])
+
+    def schedule_summary(self, user_id: int, conversation: dict | None, ctx: Context):
+        """Starts folding the context's overflow into the summary, if enough has piled up."""
+        if not conversation or conversation["id"] in self._summarizing:
+            return
+        overflow = [log for log in ctx.overflow if log.get("id") is not None]
+        if len(overflow) < self.summary_batch:
+            return
+        self._summarizing.add(conversation["id"])
+        task = asyncio.create_task(self._summarize(user_id, conversation, overflow))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, user_id: int, conversation: dict, logs: list[dict]):
+        try:
+            transcript = "\n".join(
+                f"{'User' if log['role'] == 'user' else 'Aura'}: {log.get('message') or ''}"
+                for log in logs
+            )
+            previous = conversation.get("summary") or "(none yet)"
+            response = await gateway.chat(
+                self.summary_model,
+                max_tokens=self.summary_max_tokens,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {
+                        "role": "user",
+                        "content": f"Current summary:\n{previous}\n\nNew messages:\n{transcript}",
+                    },
+                ],
+            )
+            summary = (response.choices[0].message.content or "").strip()
+            if summary:
+                await db.update_conversation_summary(
+                    user_id, conversation["id"], summary, logs[-1]["id"]
+                )
+                self.summaries += 1
+        except Exception as e:
+            self.summary_errors += 1
+            log(
+                "summary_failed",
+                logging.WARNING,
+                conversation_id=conversation["id"],
+                error=repr(e),
+            )
+        finally:
+            self._summarizing.discard(conversation["id"])
+
+    def stats(self) -> dict:
+        return {
+            "budget": self.budget,
+            "tokenizer": "estimate" if _estimate else ENCODING,
+            "builds": self.builds,
+            "avg_prompt_tokens": (
+                round(self.prompt_tokens / self.builds) if self.builds else 0
+            ),
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "trimmed": self.trimmed,
+            "summaries": self.summaries,
+            "summary_errors": self.summary_errors,
+            "summarizing": len(self._summarizing),
+        }
+
+
+context_builder = ContextBuilder(
+    budget=config["CONTEXT_TOKEN_BUDGET"],
+    keep_turns=config["CONTEXT_KEEP_TURNS"],
+    summary_batch=config["CONTEXT_SUMMARY_BATCH"],
+    summary_model=config["CONTEXT_SUMMARY_MODEL"],
+    summary_max_tokens=config["CONTEXT_SUMMARY_MAX_TOKENS"],
+)
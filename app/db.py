@@ -0,0 +1,617 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
+
+from app.cache import UserCache
+from app.config import config
+from app.history import HistoryBuffer, history
+from app.tracing import span
+
+# What the reminder scheduler needs from a task row
+TASK_SCHEDULE_COLUMNS = (
+    "id, user_id, active, created_at, updated_at, freq, content, last_fired_at"
+)
+
+
+class RoundTrips:
+    """Counts Supabase requests made while it is the active tracker (see track_round_trips)."""
+
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+
+_round_trips: ContextVar[RoundTrips | None] = ContextVar("round_trips", default=None)
+
+
+class Repository:
+    """
+    Async data access for the Supabase tables the service uses. One client
+    (and one pooled HTTP/2 connection set) is shared by the whole app and
+    opened in the startup hook, so concurrent webhooks don't queue up behind
+    blocking `.execute()` calls on the event loop thread.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        max_connections: int,
+        timeout: float,
+        turn_rpc: bool,
+        cache: UserCache,
+        history: HistoryBuffer,
+    ):
+        self.url = url
+        self.key = key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.turn_rpc = turn_rpc
+        self.cache = cache
+        self.history = history
+        self._client: AsyncClient | None = None
+        self._http: httpx.AsyncClient | None = None
+
+        # Counters exposed through stats()
+        self.requests = 0
+        self.turns = 0
+        self.turn_round_trips = 0
+        self.max_turn_round_trips = 0
+
+    async def connect(self):
+        if self._client is not None:
+            return
+        self._http = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            timeout=httpx.Timeout(self.timeout, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=60.0,
+            ),
+        )
+        self._client = await acreate_client(
+            self.url, self.key, options=AsyncClientOptions(httpx_client=self._http)
+        )
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+        self._client = None
+        self._http = None
+
+    @property
+    def client(self) -> AsyncClient:
+        if self._client is None:
+            raise RuntimeError("Repository is not connected")
+        return self._client
+
+    def table(self, name: str):
+        return self.client.table(name)
+
+    async def _execute(self, query):
+        """Runs a query builder, counting it as one round trip."""
+        self.requests += 1
+        trips = _round_trips.get()
+        if trips is not None:
+            trips.count += 1
+        # e.g. "db.users" or "db.rpc.aura_begin_turn"
+        stage = "db." + getattr(query, "path", "/query").strip("/").replace("/", ".")
+        with span(stage):
+            return await query.execute()
+
+    @contextmanager
+    def track_round_trips(self):
+        """Counts the Supabase round trips made inside the block (per task)."""
+        trips = RoundTrips()
+        token = _round_trips.set(trips)
+        try:
+            yield trips
+        finally:
+            _round_trips.reset(token)
+            self.turns += 1
+            self.turn_round_trips += trips.count
+            self.max_turn_round_trips = max(self.max_turn_round_trips, trips.count)
+
+    # --- Users ---
+
+    async def get_user(self, user_id: int) -> dict | None:
+        user = self.cache.get_user(user_id)
+        if user is not None:
+            return user
+        res = await self._execute(self.table("users").select("*").eq("id", user_id))
+        if not res.data:
+            return None
+        self.cache.put_user(res.data[0])
+        return res.data[0]
+
+    async def get_user_by_phone(self, phone: str) -> dict | None:
+        user = self.cache.get_user_by_phone(phone)
+        if user is not None:
+            return user
+        res = await self._execute(self.table("users").select("*").eq("phone", phone))
+        if not res.data:
+            return None
+        self.cache.put_user(res.data[0])
+        return res.data[0]
+
+    async def get_or_create_user(self, phone: str, name: str | None) -> dict:
+        """Returns the user with this phone number, creating them on first contact."""
+        user = await self.get_user_by_phone(phone)
+        if user is not None:
+            return user
+        return await self.create_user({"phone": phone, "name": name})
+
+    async def create_user(self, data: dict) -> dict:
+        res = await self._execute(self.table("users").insert(data))
+        self.cache.put_user(res.data[0])
+        return res.data[0]
+
+    async def update_user(self, user_id: int, data: dict) -> list[dict]:
+        # Drop the old entry first so a changed phone number can't linger
+        self.cache.invalidate_user(user_id)
+        res = await self._execute(self.table("users").update(data).eq("id", user_id))
+        for user in res.data:
+            self.cache.put_user(user)
+        return res.data
+
+    async def get_user_phones(self, user_ids: list[int]) -> dict[int, str]:
+        """Maps user ids to phone numbers, fetching the uncached ones in one request."""
+        phones = {}
+        missing = []
+        for user_id in set(user_ids):
+            user = self.cache.get_user(user_id)
+            if user is None:
+                missing.append(user_id)
+            elif user.get("phone"):
+                phones[user_id] = user["phone"]
+        if missing:
+            res = await self._execute(
+                self.table("users").select("*").in_("id", missing)
+            )
+            for user in res.data:
+                self.cache.put_user(user)
+                if user.get("phone"):
+                    phones[user["id"]] = user["phone"]
+        return phones
+
+    async def list_health_users(self, page_size: int = 1000) -> list[dict]:
+        """Users linked to the health datasets (see app/nudges.py), paging past the row limit."""
+        users = []
+        while True:
+            res = await self._execute(
+                self.table("users")
+                .select("id, phone, health_user_id, last_nudged_at")
+                .not_.is_("health_user_id", "null")
+                .order("id")
+                .range(len(users), len(users) + page_size - 1)
+            )
+            users.extend(res.data)
+            if len(res.data) < page_size:
+                return users
+
+    async def mark_nudged(self, user_ids: list[int], at: str, chunk: int = 500):
+        for i in range(0, len(user_ids), chunk):
+            await self._execute(
+                self.table("users")
+                .update({"last_nudged_at": at})
+                .in_("id", user_ids[i : i + chunk])
+            )
+
+    # --- Conversations ---
+
+    async def open_conversations(self, user_id: int) -> list[dict]:
+        """Returns the user's open conversations, most recently started first."""
+        conversations = self.cache.open_conversations(user_id)
+        if conversations is not None:
+            return conversations
+        res = await self._execute(
+            self.table("conversations")
+            .select("id, topic, summary, summary_through")
+            .eq("user_id", user_id)
+            .eq("status", "open")
+            .order("started_at", desc=True)
+        )
+        self.cache.set_open_conversations(user_id, res.data)
+        return res.data
+
+    async def latest_open_conversation(self, user_id: int) -> dict | None:
+        conversations = await self.open_conversations(user_id)
+        return conversations[0] if conversations else None
+
+    async def create_conversation(self, user_id: int, topic: str) -> dict:
+        res = await self._execute(
+            self.table("conversations").insert(
+                {"user_id": user_id, "topic": topic, "status": "open"}
+            )
+        )
+        self.cache.add_conversation(user_id, res.data[0])
+        return res.data[0]
+
+    async def update_conversation_summary(
+        self, user_id: int, conversation_id: int, summary: str, summary_through: int
+    ):
+        """Stores the rolling summary of every message up to `summary_through`."""
+        conversation = {
+            "id": conversation_id,
+            "summary": summary,
+            "summary_through": summary_through,
+        }
+        await self._execute(
+            self.table("conversations")
+            .update({"summary": summary, "summary_through": summary_through})
+            .eq("id", conversation_id)
+        )
+        self.cache.update_conversation(user_id, conversation)
+
+    # --- Messages ---
+
+    async def append_message(self, entry: dict) -> dict | None:
+        rows = await self.append_messages([entry])
+        return rows[0] if rows else None
+
+    async def append_messages(self, entries: list[dict]) -> list[dict]:
+        """Inserts several message rows in one request and returns them with their ids."""
+        if not entries:
+            return []
+        res = await self._execute(self.table("messages").insert(entries))
+        for row in res.data:
+            self.history.append(row["user_id"], [row])
+        return res.data
+
+    async def move_messages(self, message_ids: list[int], conversation_id: int):
+        if not message_ids:
+            return
+        await self._execute(
+            self.table("messages")
+            .update({"conversation_id": conversation_id})
+            .in_("id", message_ids)
+        )
+
+    async def recent_messages(self, user_id: int, limit: int = 20) -> list[dict]:
+        """
+        Returns the user's last `limit` messages in chronological order, from
+        the in-process history window when it is warm.
+        """
+        if limit <= self.history.size:
+            logs = self.history.get(user_id, limit)
+            if logs is not None:
+                return logs
+        res = await self._execute(
+            self.table("messages")
+            .select("id, role, message")
+            .eq("user_id", user_id)
+            .order("timestamp", desc=True)
+            # A burst is inserted in one statement, so its rows share a timestamp
+            .order("id", desc=True)
+            .limit(max(limit, self.history.size))
+        )
+        logs = res.data[::-1]
+        self.history.load(user_id, logs)
+        return logs[-limit:] if limit else []
+
+    # --- Tasks ---
+
+    async def create_task(self, data: dict) -> dict:
+        res = await self._execute(self.table("tasks").insert(data))
+        return res.data[0]
+
+    async def active_tasks(self, user_id: int) -> list[dict]:
+        res = await self._execute(
+            self.table("tasks").select("*").eq("user_id", user_id).eq("active", True)
+        )
+        return res.data
+
+    async def list_active_tasks(self, page_size: int = 1000) -> list[dict]:
+        """Returns every active task, paging past PostgREST's row limit."""
+        tasks = []
+        while True:
+            res = await self._execute(
+                self.table("tasks")
+                .select(TASK_SCHEDULE_COLUMNS)
+                .eq("active", True)
+                .order("id")
+                .range(len(tasks), len(tasks) + page_size - 1)
+            )
+            tasks.extend(res.data)
+            if len(res.data) < page_size:
+                return tasks
+
+    async def tasks_changed_since(
+        self, since: str, page_size: int = 1000
+    ) -> list[dict]:
+        """Returns tasks (active or not) created or edited at or after `since`, oldest first."""
+        tasks = []
+        while True:
+            res = await self._execute(
+                self.table("tasks")
+                .select(TASK_SCHEDULE_COLUMNS)
+                .gte("updated_at", since)
+                .order("updated_at")
+                .order("id")
+                .range(len(tasks), len(tasks) + page_size - 1)
+            )
+            tasks.extend(res.data)
+            if len(res.data) < page_size:
+                return tasks
+
+    async def claim_reminders(self, claims: list[dict]) -> dict[int, str | None]:
+        """
+        Claims a batch of task firings ({task_id, fire_at}) in one request and
+        returns the ids that were won, each with the last_fired_at it replaced;
+        the rest were already sent or are inactive.
+        """
+        if not claims:
+            return {}
+        res = await self._execute(
+            self.client.rpc("aura_claim_reminders", {"p_claims": claims})
+        )
+        return {
+            int(task_id): previous for task_id, previous in (res.data or {}).items()
+        }
+
+    async def release_reminders(self, claims: list[dict]) -> int:
+        """
+        Undoes claimed firings ({task_id, fire_at, previous}) whose send failed,
+        unless a later firing has been claimed since (db/migrations/012).
+        """
+        if not claims:
+            return 0
+        res = await self._execute(
+            self.client.rpc("aura_release_reminders", {"p_claims": claims})
+        )
+        return res.data or 0
+
+    # --- Outbox (see app/outbox.py) ---
+
+    async def save_outbox(self, rows: list[dict]):
+        if rows:
+            await self._execute(self.table("outbox").upsert(rows))
+
+    async def delete_outbox(self, ids: list[str]):
+        if ids:
+            await self._execute(self.table("outbox").delete().in_("id", ids))
+
+    async def take_outbox(self, limit: int = 1000) -> list[dict]:
+        """
+        Removes and returns persisted outbound messages for this process to
+        send: rows saved at shutdown and rows whose owner's lease lapsed.
+        """
+        res = await self._execute(
+            self.client.rpc("aura_take_outbox", {"p_limit": limit})
+        )
+        return res.data or []
+
+    async def renew_outbox(self, owner: str, ttl: float) -> int:
+        """Extends the lease on the owner's deferred rows (db/migrations/011)."""
+        res = await self._execute(
+            self.client.rpc(
+                "aura_renew_outbox", {"p_owner": owner, "p_ttl_seconds": int(ttl)}
+            )
+        )
+        return res.data or 0
+
+    # --- Scheduler leases (see db/migrations/005_reminder_scheduling.sql) ---
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Takes or renews the named lease. Returns False while another holder has it."""
+        res = await self._execute(
+            self.client.rpc(
+                "aura_acquire_lease",
+                {"p_name": name, "p_holder": holder, "p_ttl_seconds": int(ttl)},
+            )
+        )
+        return bool(res.data)
+
+    async def release_lease(self, name: str, holder: str):
+        await self._execute(
+            self.client.rpc("aura_release_lease", {"p_name": name, "p_holder": holder})
+        )
+
+    # --- Turns ---
+    #
+    # A turn is persisted in two round trips through the server-side functions
+    # in db/migrations/002_turn_functions.sql: begin_turn before the LLM call and
+    # finish_turn after it. With DB_TURN_RPC=false the same steps run as
+    # individual queries.
+
+    async def begin_turn(
+        self,
+        phone: str,
+        name: str | None,
+        messages: list[dict],
+        history_limit: int = 20,
+    ) -> dict:
+        """
+        Resolves (or creates) the user and their latest open conversation,
+        logs the incoming `messages` (role/message/message_type/...) to it and
+        returns the recent history for the prompt, as:
+        {user, conversation: {id, topic, summary, summary_through},
+        existing_conversation, message_ids, history}
+        """
+        # For a returning user whose profile, open conversation and history are
+        # all cached, the step-by-step path below costs a single insert
+        user = self.cache.get_user_by_phone(phone)
+        warm = (
+            user is not None
+            and bool(self.cache.open_conversations(user["id"]))
+            and self.history.is_warm(user["id"])
+        )
+
+        if self.turn_rpc and not warm:
+            res = await self._execute(
+                self.client.rpc(
+                    "aura_begin_turn",
+                    {
+                        "p_phone": phone,
+                        "p_name": name,
+                        "p_messages": messages,
+                        "p_history_limit": max(history_limit, self.history.size),
+                    },
+                )
+            )
+            turn = res.data
+            user_id = turn["user"]["id"]
+            self.cache.put_user(turn["user"])
+            if "open_conversations" in turn:
+                self.cache.set_open_conversations(user_id, turn["open_conversations"])
+            elif not turn["existing_conversation"]:
+                self.cache.add_conversation(user_id, turn["conversation"])
+            self.history.load(user_id, turn["history"])
+            turn["history"] = turn["history"][-history_limit:] if history_limit else []
+            return turn
+
+        user = await self.get_or_create_user(phone, name)
+        conversation = await self.latest_open_conversation(user["id"])
+        existing_conversation = conversation is not None
+        if conversation is None:
+            conversation = await self.create_conversation(user["id"], "General")
+        rows = await self.append_messages(
+            [
+                {**m, "user_id": user["id"], "conversation_id": conversation["id"]}
+                for m in messages
+            ]
+        )
+        history = await self.recent_messages(user["id"], limit=history_limit)
+        return {
+            "user": user,
+            "conversation": {
+                "id": conversation["id"],
+                "topic": conversation["topic"],
+                "summary": conversation.get("summary"),
+                "summary_through": conversation.get("summary_through"),
+            },
+            "existing_conversation": existing_conversation,
+            "message_ids": [row["id"] for row in rows],
+            "history": history,
+        }
+
+    async def finish_turn(
+        self,
+        user_id: int,
+        conversation_id: int,
+        message_ids: list[int],
+        topic: str,
+        assistant_message: dict,
+        task: dict | None = None,
+        current_topic: str | None = None,
+    ) -> dict:
+        """
+        Files the turn under the open conversation for `topic` (creating it if
+        needed), moving the user's messages there, then stores the assistant
+        reply and the optional task. Returns {conversation_id, created_conversation, task}.
+        `current_topic` is the topic of `conversation_id`; when the turn stays
+        on it no other conversation has to be looked up.
+        """
+        if self.turn_rpc:
+            res = await self._execute(
+                self.client.rpc(
+                    "aura_finish_turn",
+                    {
+                        "p_user_id": user_id,
+                        "p_conversation_id": conversation_id,
+                        "p_message_ids": message_ids,
+                        "p_topic": topic,
+                        "p_assistant": assistant_message,
+                        "p_task": task,
+                    },
+                )
+            )
+            result = res.data
+            self.history.append(
+                user_id,
+                [{**assistant_message, "id": result.get("assistant_message_id")}],
+            )
+            if result["created_conversation"]:
+                self.cache.add_conversation(
+                    user_id, {"id": result["conversation_id"], "topic": topic}
+                )
+            return result
+
+        final_conversation_id = conversation_id if topic == current_topic else None
+        if final_conversation_id is None:
+            for conv in await self.open_conversations(user_id):
+                if conv.get("topic") == topic:
+                    final_conversation_id = conv["id"]
+                    break
+        created_conversation = final_conversation_id is None
+        if created_conversation:
+            final_conversation_id = (await self.create_conversation(user_id, topic))[
+                "id"
+            ]
+
+        if final_conversation_id != conversation_id:
+            await self.move_messages(message_ids, final_conversation_id)
+
+        created_task = None
+        if task is not None:
+            created_task = await self.create_task(
+                {**task, "user_id": user_id, "conversation_id": final_conversation_id}
+            )
+
+        await self.append_message(
+            {
+                **assistant_message,
+                "user_id": user_id,
+                "conversation_id": final_conversation_id,
+            }
+        )
+        return {
+            "conversation_id": final_conversation_id,
+            "created_conversation": created_conversation,
+            "task": created_task,
+        }
+
+    # --- Processed webhook messages (see app/dedup.py) ---
+
+    async def claim_message_id(self, message_id: str) -> bool:
+        """Records a WhatsApp message id. Returns False if another replica already has it."""
+        # ignore_duplicates only returns rows that were actually inserted
+        res = await self._execute(
+            self.table("processed_messages").upsert(
+                {"message_id": message_id},
+                on_conflict="message_id",
+                ignore_duplicates=True,
+            )
+        )
+        return bool(res.data)
+
+    async def release_message_id(self, message_id: str):
+        await self._execute(
+            self.table("processed_messages").delete().eq("message_id", message_id)
+        )
+
+    async def purge_processed_messages(self, before: str):
+        await self._execute(
+            self.table("processed_messages").delete().lt("received_at", before)
+        )
+
+    def stats(self) -> dict:
+        return {
+            "turn_rpc": self.turn_rpc,
+            "cache": self.cache.stats(),
+            "history": self.history.stats(),
+            "requests": self.requests,
+            "turns": self.turns,
+            "avg_turn_round_trips": (
+                round(self.turn_round_trips / self.turns, 2) if self.turns else 0.0
+            ),
+            "max_turn_round_trips": self.max_turn_round_trips,
+        }
+
+
+db = Repository(
+    url=config["SUPABASE_URL"],
+    key=config["SUPABASE_KEY"],
+    max_connections=config["SUPABASE_MAX_CONNECTIONS"],
+    timeout=config["SUPABASE_TIMEOUT"],
+    turn_rpc=config["DB_TURN_RPC"],
+    cache=UserCache(
+        maxsize=config["USER_CACHE_SIZE"], ttl=config["USER_CACHE_TTL_SECONDS"]
+    ),
+    history=history,
+)
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from app.cache import TTLCache
+from app.config import config
+from app.db import db
+from app.tracing import log
+
+
+class DedupStore:
+    """
+    Remembers which WhatsApp message ids have already been accepted so Meta
+    redeliveries are dropped before any transcription or LLM work.
+
+    An in-process LRU answers repeat deliveries to the same replica. With the
+    "supabase" backend, first sightings are also claimed in the shared
+    `processed_messages` table so several replicas agree on who owns a message.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, backend: str):
+        self.ttl = ttl
+        self.backend = backend
+        self._seen = TTLCache(maxsize=max_entries, ttl=ttl)
+        self.accepted = 0
+        self.duplicates = 0
+        self.backend_errors = 0
+
+    async def claim(self, message_id: str | None) -> bool:
+        """Returns True the first time a message id is seen, False for duplicates."""
+        if not message_id:
+            return True
+
+        if self._seen.get(message_id):
+            self.duplicates += 1
+            return False
+        # Reserve locally before awaiting so concurrent deliveries can't both pass
+        self._seen.set(message_id, True)
+
+        if self.backend == "supabase":
+            try:
+                fresh = await db.claim_message_id(message_id)
+            except Exception as e:
+                # Fail open: a duplicate reply is better than a dropped message
+                self.backend_errors += 1
+                log(
+                    "dedup_unavailable",
+                    logging.WARNING,
+                    message_id=message_id,
+                    error=repr(e),
+                )
+                fresh = True
+            if not fresh:
+                self.duplicates += 1
+                return False
+
+        self.accepted += 1
+        return True
+
+    async def release(self, message_id: str | None):
+        """Forgets a claimed message id, e.g. when it could not be queued and Meta should retry."""
+        if not message_id:
+            return
+        self._seen.pop(message_id)
+        if self.backend == "supabase":
+            try:
+                await db.release_message_id(message_id)
+            except Exception as e:
+                log(
+                    "dedup_release_failed",
+                    logging.WARNING,
+                    message_id=message_id,
+                    error=repr(e),
+                )
+
+    async def run_purge_loop(self):
+        """Periodically deletes shared entries older than the TTL."""
+        if self.backend != "supabase":
+            return
+        while True:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+            try:
+                await db.purge_processed_messages(cutoff.isoformat())
+            except Exception as e:
+                log("dedup_purge_failed", logging.WARNING, error=repr(e))
+            await asyncio.sleep(max(self.ttl / 4, 60))
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "backend_errors": self.backend_errors,
+            "lru": self._seen.stats(),
+        }
+
+
+dedup = DedupStore(
+    ttl=config["DEDUP_TTL_SECONDS"],
+    max_entries=config["DEDUP_MAX_ENTRIES"],
+    backend=config["DEDUP_BACKEND"],
+)
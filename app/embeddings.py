@@ -0,0 +1,66 @@
+import math
+import time
+
+from app.cache import TTLCache
+from app.config import config
+from app.gateway import gateway
+
+
+def cosine(a: list[float], b: list[float]) -> float:
+    """Cosine similarity of two vectors that embed() already normalized."""
+    return sum(x * y for x, y in zip(a, b))
+
+
+def _normalize(vector: list[float]) -> list[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class Embedder:
+    """
+    Text embeddings from OpenAI, cached by text. Lookups for labels and
+    repeated phrases come from memory; the misses of one call are fetched
+    in a single request.
+    """
+
+    def __init__(self, model: str, cache_size: int, ttl: float):
+        self.model = model
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+
+        # Counters exposed through stats()
+        self.requests = 0
+        self.embedded = 0
+        self.request_ms = 0.0
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        """Returns one unit-length vector per text, in order."""
+        vectors = {text: self.cache.get(text) for text in texts}
+        missing = [text for text, vector in vectors.items() if vector is None]
+        if missing:
+            started = time.monotonic()
+            response = await gateway.embed(self.model, missing)
+            self.requests += 1
+            self.embedded += len(missing)
+            self.request_ms += (time.monotonic() - started) * 1000
+            for text, item in zip(missing, response.data):
+                vectors[text] = _normalize(item.embedding)
+                self.cache.set(text, vectors[text])
+        return [vectors[text] for text in texts]
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "requests": self.requests,
+            "embedded": self.embedded,
+            "avg_request_ms": round(self.request_ms / self.requests, 1)
+            if self.requests
+            else 0.0,
+            "cache": self.cache.stats(),
+        }
+
+
+embedder = Embedder(
+    model=config["EMBEDDING_MODEL"],
+    cache_size=config["EMBEDDING_CACHE_SIZE"],
+    ttl=config["EMBEDDING_CACHE_TTL_SECONDS"],
+)
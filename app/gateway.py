@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import random
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import openai
+from openai import AsyncOpenAI
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from app.config import config
+from app.metrics import LATENCY_BUCKETS_MS, TOKEN_BUCKETS, Histograms, registry
+from app.tracing import log
+
+# Failures worth another attempt: rate limits, 5xx and dropped connections
+RETRY_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,  # includes APITimeoutError
+)
+
+
+class LLMGateway:
+    """
+    The one way the app talks to OpenAI. Every call goes through the async
+    client with at most `max_in_flight` requests open at once, and gets a
+    deadline (`timeout` seconds unless the caller passes its own) that
+    covers queueing, retries and, for streams, every chunk.
+
+    Rate limits, 5xx responses and connection failures are retried with
+    jittered exponential backoff (honouring Retry-After) while the deadline
+    allows. Once less than `fallback_below` seconds remain, including on a
+    retry, chat calls switch to `fallback_model`, which answers faster.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        max_in_flight: int,
+        timeout: float,
+        max_retries: int,
+        backoff: float,
+        fallback_model: str,
+        fallback_below: float,
+        backoff_cap: float = 8.0,
+        base_url: str | None = None,
+    ):
+        # The gateway owns retries and timeouts, so the SDK shouldn't add its own
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.fallback_model = fallback_model
+        self.fallback_below = fallback_below
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+        # Counters and histograms exposed through stats(), keyed by model
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+        self.waiting = 0
+        self.in_flight = 0
+        self.latency_ms = Histograms(LATENCY_BUCKETS_MS)
+        self.first_token_ms = Histograms(LATENCY_BUCKETS_MS)
+        self.prompt_tokens = Histograms(TOKEN_BUCKETS)
+        self.completion_tokens = Histograms(TOKEN_BUCKETS)
+
+    async def chat(
+        self, model: str, messages: list[dict], timeout: float | None = None, **kwargs
+    ) -> ChatCompletion:
+        """A chat completion, retried and bounded by the deadline."""
+        deadline = self._deadline(timeout)
+        async with self._slot(deadline):
+            for attempt in range(self.max_retries + 1):
+                used = self._model(model, deadline)
+                started = asyncio.get_running_loop().time()
+                try:
+                    response = await self._within(
+                        self._attempt_deadline(used, deadline),
+                        self.client.chat.completions.create(
+                            model=used, messages=messages, **kwargs
+                        ),
+                    )
+                except (*RETRY_ERRORS, TimeoutError) as e:
+                    await self._backoff(attempt, deadline, e)
+                    continue
+                self._record(used, started, response.usage)
+                return response
+
+    async def stream_chat(
+        self, model: str, messages: list[dict], timeout: float | None = None, **kwargs
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        """
+        Streams a chat completion. Opening the stream is retried; once chunks
+        are flowing a failure is raised to the caller. The final chunk
+        carries token usage and no choices.
+        """
+        deadline = self._deadline(timeout)
+        async with self._slot(deadline):
+            stream = None
+            try:
+                for attempt in range(self.max_retries + 1):
+                    used = self._model(model, deadline)
+                    started = asyncio.get_running_loop().time()
+                    try:
+                        attempt_deadline = self._attempt_deadline(used, deadline)
+                        stream = await self._within(
+                            attempt_deadline,
+                            self.client.chat.completions.create(
+                                model=used,
+                                messages=messages,
+                                stream=True,
+                                stream_options={"include_usage": True},
+                                **kwargs,
+                            ),
+                        )
+                        chunks = stream.__aiter__()
+                        first = await self._within(attempt_deadline, chunks.__anext__())
+                    except (*RETRY_ERRORS, TimeoutError) as e:
+                        if stream is not None:
+                            await stream.close()
+                            stream = None
+                        await self._backoff(attempt, deadline, e)
+                        continue
+                    break
+
+                loop = asyncio.get_running_loop()
+                self.first_token_ms.labels(used).observe((loop.time() - started) * 1000)
+                usage = first.usage
+                yield first
+                while True:
+                    try:
+                        chunk = await self._within(deadline, chunks.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    usage = chunk.usage or usage
+                    yield chunk
+                self._record(used, started, usage)
+            finally:
+                # Frees the connection however the stream ends: a failed open,
+                # cancellation, a chunk timing out or the caller stopping early
+                if stream is not None:
+                    await stream.close()
+
+    async def embed(
+        self, model: str, texts: list[str], timeout: float | None = None
+    ) -> CreateEmbeddingResponse:
+        deadline = self._deadline(timeout)
+        async with self._slot(deadline):
+            for attempt in range(self.max_retries + 1):
+                started = asyncio.get_running_loop().time()
+                try:
+                    response = await self._within(
+                        deadline,
+                        self.client.embeddings.create(model=model, input=texts),
+                    )
+                except RETRY_ERRORS as e:
+                    await self._backoff(attempt, deadline, e)
+                    continue
+                self._record(model, started, response.usage)
+                return response
+
+    def _deadline(self, timeout: float | None) -> float:
+        self.calls += 1
+        return asyncio.get_running_loop().time() + (timeout or self.timeout)
+
+    def _remaining(self, deadline: float) -> float:
+        return deadline - asyncio.get_running_loop().time()
+
+    @asynccontextmanager
+    async def _slot(self, deadline: float):
+        """Holds one of the in-flight slots, waiting no longer than the deadline."""
+        self.waiting += 1
+        try:
+            await self._within(deadline, self._slots.acquire())
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def _within(self, deadline: float, awaitable):
+        remaining = self._remaining(deadline)
+        try:
+            if remaining <= 0:
+                raise TimeoutError
+            return await asyncio.wait_for(awaitable, remaining)
+        except TimeoutError:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            self.timeouts += 1
+            raise
+
+    def _attempt_deadline(self, model: str, deadline: float) -> float:
+        """
+        A slow primary model gives up while `fallback_below` seconds remain,
+        so the retry can still go to the fallback model.
+        """
+        if self.fallback_model and model != self.fallback_model:
+            return deadline - self.fallback_below
+        return deadline
+
+    def _model(self, model: str, deadline: float) -> str:
+        if (
+            self.fallback_model
+            and model != self.fallback_model
+            and self._remaining(deadline) < self.fallback_below
+        ):
+            self.fallbacks += 1
+            return self.fallback_model
+        return model
+
+    async def _backoff(self, attempt: int, deadline: float, error: Exception):
+        """Sleeps before the next attempt, or re-raises `error` if there is none."""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff * 2**attempt))
+        if isinstance(error, TimeoutError):
+            # The attempt already waited; go straight to the fallback model
+            delay = 0.0
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response else None
+        if retry_after and retry_after.isdigit():
+            delay = min(float(retry_after), self.backoff_cap)
+        if attempt == self.max_retries or delay >= self._remaining(deadline):
+            self.errors += 1
+            raise error
+        log("openai_retry", logging.WARNING, error=repr(error), delay=round(delay, 1))
+        self.retries += 1
+        await asyncio.sleep(delay)
+
+    def _record(self, model: str, started: float, usage):
+        elapsed = (asyncio.get_running_loop().time() - started) * 1000
+        self.latency_ms.labels(model).observe(elapsed)
+        if usage is not None:
+            self.prompt_tokens.labels(model).observe(usage.prompt_tokens)
+            completion = getattr(usage, "completion_tokens", None)
+            if completion is not None:
+                self.completion_tokens.labels(model).observe(completion)
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "retries": self.retries,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "fallbacks": self.fallbacks,
+            "latency_ms": self.latency_ms.snapshot(),
+            "first_token_ms": self.first_token_ms.snapshot(),
+            "prompt_tokens": self.prompt_tokens.snapshot(),
+            "completion_tokens": self.completion_tokens.snapshot(),
+        }
+
+
+gateway = LLMGateway(
+    api_key=config["OPENAI_KEY"],
+    max_in_flight=config["LLM_MAX_IN_FLIGHT"],
+    timeout=config["LLM_TIMEOUT"],
+    max_retries=config["LLM_MAX_RETRIES"],
+    backoff=config["LLM_BACKOFF"],
+    fallback_model=config["LLM_FALLBACK_MODEL"],
+    fallback_below=config["LLM_FALLBACK_BELOW"],
+    base_url=config["OPENAI_BASE_URL"],
+)
+
+registry.histograms(
+    "aura_llm_latency_ms",
+    "OpenAI call latency by model, in milliseconds",
+    "model",
+    gateway.latency_ms,
+)
+registry.histograms(
+    "aura_llm_first_token_ms",
+    "Time to the first streamed chunk by model, in milliseconds",
+    "model",
+    gateway.first_token_ms,
+)
+registry.histograms(
+    "aura_llm_prompt_tokens", "Prompt tokens per call", "model", gateway.prompt_tokens
+)
+registry.histograms(
+    "aura_llm_completion_tokens",
+    "Completion tokens per call",
+    "model",
+    gateway.completion_tokens,
+)
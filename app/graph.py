@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import random
+from typing import IO
+
+import httpx
+
+from app.config import config
+from app.tracing import log
+
+# Responses worth retrying: rate limits and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Failures where the request never reached Meta, so retrying can't double-send
+RETRY_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+    httpx.RemoteProtocolError,
+)
+
+
+class GraphClient:
+    """
+    Shared async client for the Meta Graph API. One HTTP/2 connection pool is
+    kept alive for the lifetime of the app (see the startup/shutdown hooks in
+    app/service.py) instead of a fresh TLS handshake per call.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        version: str,
+        token: str,
+        timeout: float,
+        max_connections: int,
+        max_retries: int,
+        backoff: float,
+        backoff_cap: float = 8.0,
+    ):
+        self.base_url = f"{base_url.rstrip('/')}/{version}"
+        self.token = token
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self._client: httpx.AsyncClient | None = None
+
+        # Counters exposed through stats()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.token}"},
+                http2=True,
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60.0,
+                ),
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("Graph client is not started")
+        return self._client
+
+    def _delay(self, attempt: int, response: httpx.Response | None = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_cap)
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_cap, self.backoff * 2**attempt))
+
+    async def request(
+        self, method: str, url: str, *, retries: int | None = None, **kwargs
+    ) -> httpx.Response:
+        """
+        Sends a request, retrying rate limits, 5xx responses and connection
+        failures with jittered exponential backoff. `url` can be a Graph path
+        (e.g. "/<phone-number-id>/messages") or an absolute URL.
+        """
+        retries = self.max_retries if retries is None else retries
+        self.requests += 1
+        for attempt in range(retries + 1):
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except RETRY_ERRORS as e:
+                if attempt == retries:
+                    self.errors += 1
+                    raise
+                log(
+                    "graph_retry",
+                    logging.WARNING,
+                    method=method,
+                    url=url,
+                    error=repr(e),
+                )
+                self.retries += 1
+                await asyncio.sleep(self._delay(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < retries:
+                log(
+                    "graph_retry",
+                    logging.WARNING,
+                    method=method,
+                    url=url,
+                    status=response.status_code,
+                )
+                self.retries += 1
+                await asyncio.sleep(self._delay(attempt, response))
+                continue
+
+            if response.is_error:
+                self.errors += 1
+            return response
+
+    async def download(self, url: str, sink: IO[bytes]) -> int:
+        """
+        Streams a media download into the file-like `sink` chunk by chunk
+        rather than holding the whole body, and returns the number of bytes
+        written. Connection failures are retried from the start.
+        """
+        self.requests += 1
+        for attempt in range(self.max_retries + 1):
+            sink.seek(0)
+            sink.truncate()
+            try:
+                async with self.client.stream("GET", url) as response:
+                    if response.is_error:
+                        self.errors += 1
+                        await response.aread()
+                        response.raise_for_status()
+                    size = 0
+                    async for chunk in response.aiter_bytes():
+                        sink.write(chunk)
+                        size += len(chunk)
+                    return size
+            except RETRY_ERRORS as e:
+                if attempt == self.max_retries:
+                    self.errors += 1
+                    raise
+                log("graph_download_retry", logging.WARNING, url=url, error=repr(e))
+                self.retries += 1
+                await asyncio.sleep(self._delay(attempt))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+        }
+
+
+graph = GraphClient(
+    base_url=config["GRAPH_API_URL"],
+    version=config["GRAPH_API_VERSION"],
+    token=config["WHATSAPP_TOKEN"],
+    timeout=config["GRAPH_TIMEOUT"],
+    max_connections=config["GRAPH_MAX_CONNECTIONS"],
+    max_retries=config["GRAPH_MAX_RETRIES"],
+    backoff=config["GRAPH_BACKOFF"],
+)
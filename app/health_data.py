@@ -0,0 +1,517 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+
+from app.config import config
+from app.tracing import log
+
+# Column types per dataset: "int" (-1 when missing), "float" (NaN when
+# missing), "bool" (int8, -1 when missing), "date" (datetime64[D]) and
+# "category" (int32 codes into a vocabulary, -1 when missing).
+# Each table is keyed by its first column and sorted by key, then date.
+SCHEMAS = {
+    "wearables": (
+        "wearable_data.csv",
+        {
+            "userId": "int",
+            "date": "date",
+            "steps": "float",
+            "calories": "float",
+            "heartRateAVG": "float",
+            "sleepTimeDeep": "float",
+            "sleepTimeRem": "float",
+            "sleepTimeLight": "float",
+            "bloodSugar": "float",
+            "bloodPressureDiastolic": "float",
+            "bloodPressureSystolic": "float",
+            "hrvSleep": "float",
+            "vo2Max": "float",
+        },
+    ),
+    "biomarkers": (
+        "biomarkers.csv",
+        {
+            "userId": "int",
+            "date": "date",
+            "biomarkerName": "category",
+            "value": "float",
+            "range": "category",
+        },
+    ),
+    "assessments": (
+        "health_assessment.csv",
+        {
+            "userId": "int",
+            "date": "date",
+            "biometricHeight": "float",
+            "biometricWeight": "float",
+            "biometricWhtr": "float",
+            "dietAlcohol": "bool",
+            "dietAlcoholFrequency": "category",
+            "dietCoffee": "bool",
+            "dietCoffeeQty": "category",
+            "dietTea": "bool",
+            "dietTeaQty": "category",
+            "lifestyleSmoking": "bool",
+            "dietType": "category",
+            "lifestyleExerciseFrequencyPerWeek": "category",
+            "lifestyleCardioFitness": "category",
+            "lifestyleMuscularStrength": "category",
+        },
+    ),
+    # Names and emails are left out on purpose; the prompt never needs them
+    "profiles": (
+        "users.csv",
+        {
+            "id": "int",
+            "gender": "category",
+            "age": "float",
+            "lifestyle": "category",
+            "goal": "category",
+        },
+    ),
+}
+
+SLEEP_STAGES = ("sleepTimeDeep", "sleepTimeRem", "sleepTimeLight")
+
+
+def _parse_date(value: str) -> str | None:
+    # The exports mix zero-padded and bare months and days ("05/06/2024", "7/7/2025")
+    try:
+        return datetime.strptime(value.strip(), "%m/%d/%Y").date().isoformat()
+    except ValueError:
+        return None
+
+
+def _column(kind: str, values: list[str], vocabulary: list[str]):
+    if kind == "float":
+        return np.array([float(v) if v.strip() else np.nan for v in values])
+    if kind == "int":
+        return np.array([int(v) if v.strip() else -1 for v in values], "int64")
+    if kind == "bool":
+        flags = {"true": 1, "false": 0}
+        return np.array([flags.get(v.strip().lower(), -1) for v in values], "int8")
+    if kind == "date":
+        return np.array([_parse_date(v) for v in values], "datetime64[D]")
+    codes = {label: i for i, label in enumerate(vocabulary)}
+    column = []
+    for value in values:
+        value = value.strip()
+        if not value:
+            column.append(-1)
+            continue
+        if value not in codes:
+            codes[value] = len(vocabulary)
+            vocabulary.append(value)
+        column.append(codes[value])
+    return np.array(column, "int32")
+
+
+def _mean(values) -> float | None:
+    values = values[~np.isnan(values)]
+    return float(values.mean()) if len(values) else None
+
+
+class ColumnTable:
+    """
+    One dataset as typed NumPy columns, sorted by `key` (then date) so each
+    key's rows are contiguous: `keys` holds the distinct keys in order and
+    `starts` where each one's rows begin, plus a final end offset.
+    """
+
+    def __init__(self, key: str, columns: dict, vocabularies: dict[str, list[str]]):
+        self.key = key
+        self.columns = columns
+        self.vocabularies = vocabularies
+        keys = columns[key]
+        self.keys, first = np.unique(keys, return_index=True)
+        self.starts = np.append(first, len(keys))
+
+    def __len__(self) -> int:
+        return len(self.columns[self.key])
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    def rows(self, key: int) -> slice | None:
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        return slice(int(self.starts[i]), int(self.starts[i + 1]))
+
+    def label(self, column: str, code: int) -> str | None:
+        return self.vocabularies[column][code] if code >= 0 else None
+
+    def window(self, days: int):
+        """Mask of the rows within `days` of each key's latest date."""
+        dates = self.columns["date"]
+        latest = dates[self.starts[1:] - 1]
+        counts = np.diff(self.starts)
+        return dates > np.repeat(latest, counts) - np.timedelta64(days, "D")
+
+    def mean_by_key(self, column: str, mask=None):
+        """Per-key mean of `column` over the masked rows, NaN where none count."""
+        values = self.columns[column]
+        present = ~np.isnan(values)
+        if mask is not None:
+            present &= mask
+        sums = np.add.reduceat(np.where(present, values, 0.0), self.starts[:-1])
+        counts = np.add.reduceat(present.astype("int64"), self.starts[:-1])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+    def sum_by_key(self, column: str, mask=None):
+        values = np.nan_to_num(self.columns[column])
+        if mask is not None:
+            values = np.where(mask, values, 0.0)
+        return np.add.reduceat(values, self.starts[:-1])
+
+    def latest_per(self, column: str):
+        """Row indices of the latest row for each (key, `column`) pair."""
+        order = np.lexsort(
+            (self.columns["date"], self.columns[column], self.columns[self.key])
+        )
+        keys = self.columns[self.key][order]
+        groups = self.columns[column][order]
+        last = np.ones(len(order), bool)
+        last[:-1] = (keys[1:] != keys[:-1]) | (groups[1:] != groups[:-1])
+        return order[last]
+
+    def save(self, directory: str, name: str):
+        for column, values in self.columns.items():
+            np.save(os.path.join(directory, f"{name}.{column}.npy"), values)
+
+    @classmethod
+    def open(cls, directory: str, name: str, key: str, meta: dict) -> "ColumnTable":
+        columns = {
+            column: np.load(
+                os.path.join(directory, f"{name}.{column}.npy"), mmap_mode="r"
+            )
+            for column in meta["columns"]
+        }
+        return cls(key, columns, meta["vocabularies"])
+
+
+class HealthData:
+    """
+    The wearable, biomarker, assessment and profile exports in `directory`,
+    parsed once into columnar tables keyed by the dataset's userId. App
+    users are linked to it through users.health_user_id.
+
+    Parsed columns are saved under `cache_dir` as .npy files, fingerprinted
+    by the CSVs' sizes and mtimes, and memory-mapped on the next start
+    instead of parsing again. Aggregations run over all users at once;
+    the per-user lookups that feed the prompt slice one user's rows.
+
+    The exports are historical, so "recent" means the `window_days` up to
+    each user's latest reading rather than up to today.
+    """
+
+    def __init__(self, directory: str, cache_dir: str, window_days: int):
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self.window_days = window_days
+        self.enabled = bool(directory)
+        self.tables: dict[str, ColumnTable] = {}
+        self._summaries: dict[int, str | None] = {}
+
+        # Counters exposed through stats()
+        self.source = None
+        self.load_ms = 0.0
+        self.lookups = 0
+        self.lookup_us = 0.0
+
+    def load(self):
+        """Reads the cache or parses the CSVs. Blocking; run it in a thread."""
+        if not self.enabled:
+            return
+        started = time.perf_counter()
+        try:
+            fingerprint = self._fingerprint()
+        except OSError as e:
+            log("health_data_unavailable", logging.WARNING, error=repr(e))
+            self.enabled = False
+            return
+        cached = os.path.join(self.cache_dir, fingerprint) if self.cache_dir else None
+        if cached and os.path.isdir(cached):
+            try:
+                self.tables = self._open(cached)
+                self.source = "cache"
+            except (OSError, ValueError, KeyError) as e:
+                log("health_data_cache_unreadable", logging.WARNING, error=repr(e))
+        if not self.tables:
+            self.tables = self._parse()
+            self.source = "csv"
+            if cached:
+                self._save(cached)
+        self._summaries.clear()
+        self.load_ms = (time.perf_counter() - started) * 1000
+        log(
+            "health_data_loaded",
+            source=self.source,
+            ms=round(self.load_ms),
+            rows={name: len(t) for name, t in self.tables.items()},
+        )
+
+    def _fingerprint(self) -> str:
+        parts = []
+        for filename, _ in SCHEMAS.values():
+            stat = os.stat(os.path.join(self.directory, filename))
+            parts.append(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}")
+        # The schema is part of the key, so a changed column type reparses
+        key = json.dumps([parts, SCHEMAS], sort_keys=True).encode()
+        return hashlib.sha256(key).hexdigest()[:16]
+
+    def _parse(self) -> dict[str, ColumnTable]:
+        tables = {}
+        for name, (filename, schema) in SCHEMAS.items():
+            with open(os.path.join(self.directory, filename), newline="") as f:
+                rows = list(csv.DictReader(f))
+            vocabularies = {c: [] for c, kind in schema.items() if kind == "category"}
+            columns = {
+                column: _column(
+                    kind,
+                    [row.get(column) or "" for row in rows],
+                    vocabularies.get(column, []),
+                )
+                for column, kind in schema.items()
+            }
+            key = next(iter(schema))
+            if "date" in columns:
+                order = np.lexsort((columns["date"], columns[key]))
+            else:
+                order = np.argsort(columns[key], kind="stable")
+            columns = {column: values[order] for column, values in columns.items()}
+            tables[name] = ColumnTable(key, columns, vocabularies)
+        return tables
+
+    def _save(self, directory: str):
+        # Written next to its final name and renamed, so a crash never leaves half a cache
+        partial = directory + ".partial"
+        try:
+            shutil.rmtree(partial, ignore_errors=True)
+            os.makedirs(partial)
+            meta = {}
+            for name, table in self.tables.items():
+                table.save(partial, name)
+                meta[name] = {
+                    "columns": list(table.columns),
+                    "vocabularies": table.vocabularies,
+                }
+            with open(os.path.join(partial, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            os.replace(partial, directory)
+        except OSError as e:
+            log("health_data_cache_write_failed", logging.WARNING, error=repr(e))
+            return
+        # Caches for earlier versions of the CSVs are no longer needed
+        for entry in os.listdir(self.cache_dir):
+            if entry != os.path.basename(directory):
+                shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors=True)
+
+    def _open(self, directory: str) -> dict[str, ColumnTable]:
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        return {
+            name: ColumnTable.open(directory, name, next(iter(schema)), meta[name])
+            for name, (_, schema) in SCHEMAS.items()
+        }
+
+    # --- All users at once ---
+
+    def rolling_steps(self, days: int | None = None):
+        """(userIds, mean daily steps over each user's last `days` days)."""
+        table = self.tables["wearables"]
+        mask = table.window(days or self.window_days)
+        return table.keys, table.mean_by_key("steps", mask)
+
+    def sleep_totals(self, days: int | None = None):
+        """(userIds, {stage: hours over each user's last `days` days})."""
+        table = self.tables["wearables"]
+        mask = table.window(days or self.window_days)
+        return table.keys, {
+            stage: table.sum_by_key(stage, mask) for stage in SLEEP_STAGES
+        }
+
+    def latest_biomarkers(self):
+        """Row indices into the biomarkers table of each user's latest reading per biomarker."""
+        return self.tables["biomarkers"].latest_per("biomarkerName")
+
+    # --- One user ---
+
+    def activity(self, user_id: int) -> dict | None:
+        table = self.tables["wearables"]
+        rows = table.rows(user_id)
+        if rows is None:
+            return None
+        dates = table["date"][rows]
+        recent = dates > dates[-1] - np.timedelta64(self.window_days, "D")
+        sleep = {
+            stage: float(np.nansum(table[stage][rows][recent]))
+            for stage in SLEEP_STAGES
+        }
+        total_sleep = sum(sleep.values())
+        return {
+            "since": str(dates[recent][0]),
+            "until": str(dates[-1]),
+            "days": int(recent.sum()),
+            "steps_avg": _mean(table["steps"][rows][recent]),
+            "heart_rate_avg": _mean(table["heartRateAVG"][rows][recent]),
+            "hrv_avg": _mean(table["hrvSleep"][rows][recent]),
+            "sleep_hours": sleep,
+            "deep_sleep_ratio": sleep["sleepTimeDeep"] / total_sleep
+            if total_sleep
+            else None,
+        }
+
+    def biomarkers(self, user_id: int) -> list[dict]:
+        """The latest reading of each biomarker, with its range label."""
+        table = self.tables["biomarkers"]
+        rows = table.rows(user_id)
+        if rows is None:
+            return []
+        names = table["biomarkerName"][rows][::-1]
+        _, newest = np.unique(names, return_index=True)
+        latest = rows.stop - 1 - newest
+        return [
+            {
+                "name": table.label("biomarkerName", int(table["biomarkerName"][i])),
+                "value": float(table["value"][i]),
+                "range": table.label("range", int(table["range"][i])),
+                "date": str(table["date"][i]),
+            }
+            for i in latest
+        ]
+
+    def assessment(self, user_id: int) -> dict | None:
+        """The user's latest health assessment, with labels for coded answers."""
+        table = self.tables["assessments"]
+        rows = table.rows(user_id)
+        if rows is None:
+            return None
+        i = rows.stop - 1
+        answers = {}
+        for column, kind in SCHEMAS["assessments"][1].items():
+            value = table[column][i]
+            if kind == "category":
+                answers[column] = table.label(column, int(value))
+            elif kind == "bool":
+                answers[column] = None if value < 0 else bool(value)
+            elif kind == "float":
+                answers[column] = None if np.isnan(value) else float(value)
+            else:
+                answers[column] = str(value) if kind == "date" else int(value)
+        return answers
+
+    def profile(self, user_id: int) -> dict | None:
+        table = self.tables["profiles"]
+        rows = table.rows(user_id)
+        if rows is None:
+            return None
+        i = rows.start
+        age = table["age"][i]
+        return {
+            "gender": table.label("gender", int(table["gender"][i])),
+            "age": None if np.isnan(age) else int(age),
+            "lifestyle": table.label("lifestyle", int(table["lifestyle"][i])),
+            "goal": table.label("goal", int(table["goal"][i])),
+        }
+
+    def summary(self, user_id: int | None) -> str | None:
+        """A few lines on the user's health for the system prompt, or None if there's no data."""
+        if not self.enabled or not self.tables or user_id is None:
+            return None
+        started = time.perf_counter()
+        if user_id not in self._summaries:
+            self._summaries[user_id] = self._summarize(int(user_id))
+        self.lookups += 1
+        self.lookup_us += (time.perf_counter() - started) * 1e6
+        return self._summaries[user_id]
+
+    def _summarize(self, user_id: int) -> str | None:
+        lines = []
+        profile = self.profile(user_id)
+        if profile:
+            facts = [
+                f"{profile['age']} years old" if profile["age"] else None,
+                profile["gender"],
+                profile["lifestyle"],
+                f"goal: {profile['goal']}" if profile["goal"] else None,
+            ]
+            lines.append("Profile: " + ", ".join(f for f in facts if f))
+
+        activity = self.activity(user_id)
+        if activity:
+            sleep = activity["sleep_hours"]
+            facts = [
+                f"{activity['steps_avg']:.0f} steps/day"
+                if activity["steps_avg"] is not None
+                else None,
+                f"sleep {sum(sleep.values()):.1f}h "
+                f"(deep {sleep['sleepTimeDeep']:.1f}h, REM {sleep['sleepTimeRem']:.1f}h, "
+                f"light {sleep['sleepTimeLight']:.1f}h)",
+                f"average heart rate {activity['heart_rate_avg']:.0f} bpm"
+                if activity["heart_rate_avg"] is not None
+                else None,
+            ]
+            period = activity["until"]
+            if activity["since"] != period:
+                period = f"{activity['since']} to {period}"
+            lines.append(f"Wearable, {period}: " + ", ".join(f for f in facts if f))
+
+        markers = self.biomarkers(user_id)
+        if markers:
+            lines.append(
+                "Latest biomarkers: "
+                + "; ".join(
+                    f"{m['name']} {m['value']:g} ({m['range']}, {m['date']})"
+                    for m in markers
+                )
+            )
+
+        assessment = self.assessment(user_id)
+        if assessment:
+            facts = [
+                f"{assessment['dietType']} diet" if assessment["dietType"] else None,
+                "smoker" if assessment["lifestyleSmoking"] else None,
+                f"exercises {assessment['lifestyleExerciseFrequencyPerWeek']} a week"
+                if assessment["lifestyleExerciseFrequencyPerWeek"]
+                else None,
+                f"alcohol {assessment['dietAlcoholFrequency'].lower()}"
+                if assessment["dietAlcohol"] and assessment["dietAlcoholFrequency"]
+                else None,
+            ]
+            facts = [f for f in facts if f]
+            if facts:
+                lines.append(f"Assessment ({assessment['date']}): " + ", ".join(facts))
+
+        if not lines:
+            return None
+        return "What we know about the user's health:\n" + "\n".join(lines)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "source": self.source,
+            "load_ms": round(self.load_ms, 1),
+            "rows": {name: len(table) for name, table in self.tables.items()},
+            "users": len(self.tables["wearables"].keys) if self.tables else 0,
+            "lookups": self.lookups,
+            "avg_lookup_us": round(self.lookup_us / self.lookups, 1)
+            if self.lookups
+            else 0.0,
+        }
+
+
+health_data = HealthData(
+    directory=config["HEALTH_DATA_DIR"],
+    cache_dir=config["HEALTH_DATA_CACHE_DIR"],
+    window_days=config["HEALTH_WINDOW_DAYS"],
+)
@@ -0,0 +1,114 @@
+import time
+from collections import OrderedDict, deque
+
+from app.config import config
+
+
+class Turn:
+    """One logged message in a user's rolling history window."""
+
+    __slots__ = ("id", "role", "message")
+
+    def __init__(self, id: int | None, role: str, message: str):
+        self.id = id
+        self.role = role
+        self.message = message
+
+    def as_log(self) -> dict:
+        return {"id": self.id, "role": self.role, "message": self.message}
+
+
+class _Window:
+    __slots__ = ("turns", "loaded_at")
+
+    def __init__(self, size: int):
+        self.turns: deque[Turn] = deque(maxlen=size)
+        self.loaded_at = time.monotonic()
+
+
+class HistoryBuffer:
+    """
+    In-process ring buffer of each user's most recent messages, so building
+    the prompt doesn't need a `messages` query on every turn.
+
+    A user's window is loaded from Supabase once on a cold miss, then kept
+    current by appending every message the repository writes. Users are
+    evicted LRU beyond `max_users`, and a window is reloaded after `ttl`
+    seconds to pick up anything written by another replica.
+    """
+
+    def __init__(self, size: int, max_users: int, ttl: float):
+        self.size = size
+        self.max_users = max_users
+        self.ttl = ttl
+        self._windows: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _window(self, user_id) -> _Window | None:
+        window = self._windows.get(user_id)
+        if window is None:
+            return None
+        if time.monotonic() - window.loaded_at > self.ttl:
+            del self._windows[user_id]
+            return None
+        self._windows.move_to_end(user_id)
+        return window
+
+    def get(self, user_id, limit: int | None = None) -> list[dict] | None:
+        """Returns the user's recent messages in chronological order, or None on a cold miss."""
+        window = self._window(user_id)
+        if window is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        turns = list(window.turns)
+        if limit is not None:
+            turns = turns[-limit:] if limit else []
+        return [turn.as_log() for turn in turns]
+
+    def is_warm(self, user_id) -> bool:
+        return self._window(user_id) is not None
+
+    def load(self, user_id, logs: list[dict]):
+        """Replaces the user's window with `logs` (chronological) fetched from Supabase."""
+        window = _Window(self.size)
+        window.turns.extend(_turn(log) for log in logs)
+        self._windows[user_id] = window
+        self._windows.move_to_end(user_id)
+        while len(self._windows) > self.max_users:
+            self._windows.popitem(last=False)
+            self.evictions += 1
+
+    def append(self, user_id, logs: list[dict]):
+        """Appends newly written messages. Cold users are left alone and load on next read."""
+        window = self._window(user_id)
+        if window is not None:
+            window.turns.extend(_turn(log) for log in logs)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._windows),
+            "max_users": self.max_users,
+            "window": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+def _turn(log: dict) -> Turn:
+    # Handle both 'content' and 'message' fields for backward compatibility
+    return Turn(
+        log.get("id"), log["role"], log.get("message") or log.get("content", "")
+    )
+
+
+history = HistoryBuffer(
+    size=config["HISTORY_WINDOW"],
+    max_users=config["HISTORY_MAX_USERS"],
+    ttl=config["HISTORY_TTL_SECONDS"],
+)
@@ -1,111 +1,132 @@
-import asyncio
 import json
+import logging
+from contextlib import aclosing
+from typing import Callable
 
-from openai import OpenAI
-from supabase import Client, create_client
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
 
-from app.config import config
-
-client = OpenAI(api_key=config["OPENAI_KEY"])
-
-# Initialize a Supabase client within the module
-supabase_url = config["SUPABASE_URL"]
-supabase_key = config["SUPABASE_KEY"]
-supabase: Client = create_client(supabase_url, supabase_key)
+from app.context import context_builder
+from app.db import db
+from app.gateway import gateway
+from app.health_data import health_data
+from app.response_cache import fingerprint, response_cache
+from app.router import FULL, TASK, router
+from app.tracing import log
 
 # Load tools from the JSON file
 with open("app/tools.json", "r") as f:
     tools = json.load(f)
 
+SYSTEM_PROMPT = "You are Aura, a personalized, empathetic WhatsApp-based personal assistant. Your mission is to help users organize their lives, set reminders, track goals, and provide helpful support across various life domains. Your tone is warm, supportive, and professional. You celebrate achievements and offer gentle encouragement. Based on the user's message, provide a conversational reply. If the user wants to set a reminder or a goal, call the appropriate tool. The user-facing reply should acknowledge the action if a tool is called (e.g., 'Okay, I've set that reminder for you!')."
+
+
+async def _build_messages(
+    user_id: str,
+    history: list[dict] | None,
+    conversation: dict | None,
+    system_prompt: str = SYSTEM_PROMPT,
+) -> list[dict]:
+    if history is not None:
+        recent_logs = history
+    else:
+        try:
+            # Fetch the last 20 messages for this user from Supabase
+            recent_logs = await db.recent_messages(user_id, limit=20)
+        except Exception as e:
+            log("history_fetch_failed", logging.ERROR, error=repr(e))
+            recent_logs = []
+
+    context = context_builder.build(system_prompt, recent_logs, conversation)
+    context_builder.schedule_summary(user_id, conversation, context)
+    return context.messages
+
+
+async def generate_llm_response(
+    user_id: str,
+    history: list[dict] | None = None,
+    conversation: dict | None = None,
+    on_text: Callable[[str], None] | None = None,
+    route: str = FULL,
+    texts: list[str] | None = None,
+    health_user_id: int | None = None,
+) -> dict:
+    """
+    Generates a response from the LLM: a user-facing reply and an optional
+    tool call. The topic is picked separately (see app/topic.py). `history` is the
+    chronological message log for the prompt; it is fetched when not given.
+    `conversation` carries the rolling summary of older messages (see app/context.py).
 
-def build_chat_history(logs):
-    """Builds a chat history list suitable for the OpenAI API."""
-    history = []
-    for log in logs:
-        role = "user" if log["role"] == "user" else "assistant"
-        # Handle both 'content' and 'message' fields for backward compatibility
-        content = log.get("message") or log.get("content", "")
-        history.append({"role": role, "content": content})
-    return history
+    The completion is streamed; `on_text` is called with each piece of the
+    reply as it arrives, e.g. to start speech synthesis early.
 
+    `route` comes from app/router.py: TASK turns go to the cheaper model.
 
-async def generate_llm_response(user_id: str) -> dict:
-    """
-    Generates a response from the LLM, including a user-facing reply,
-    an optional tool call, and the conversation topic.
+    `texts` are the user's messages for this turn. A self-contained question
+    asked with no history, summary or health profile in the prompt may be
+    answered from, and stored in, the response cache (see app/response_cache.py).
+
+    `health_user_id` links the user to the wearable and biomarker exports
+    (see app/health_data.py); their summary is added to the system prompt.
     """
-    try:
-        # Fetch the last 20 messages for this user from Supabase
-        response = (
-            supabase.table("messages")
-            .select("role, message")
-            .eq("user_id", user_id)
-            .order("timestamp", desc=True)
-            .limit(20)
-            .execute()
+    model = router.task_model if route == TASK else "gpt-4o"
+    system_prompt = SYSTEM_PROMPT
+    health = health_data.summary(health_user_id)
+    if health:
+        system_prompt = f"{SYSTEM_PROMPT}\n\n{health}"
+    messages = await _build_messages(user_id, history, conversation, system_prompt)
+
+    question = None
+    if route == FULL:
+        question = response_cache.question(texts or [], messages, profile=bool(health))
+    if question is not None:
+        # Keyed on everything in the prompt ahead of the question
+        context_key = fingerprint(model, *(m["content"] for m in messages[:-1]))
+        cached = await response_cache.get(question, context_key)
+        if cached is not None:
+            if on_text is not None:
+                on_text(cached)
+            return {"reply": cached, "tool_call": None}
+
+    # Closed on every exit so a failing consumer (e.g. `on_text`) or a
+    # cancelled turn gives back the gateway slot and the connection at once
+    async with aclosing(
+        gateway.stream_chat(model, messages, tools=tools, tool_choice="auto")
+    ) as stream:
+        content = []
+        # Tool calls arrive as fragments keyed by index: id and name first, then arguments
+        partial_calls: dict[int, dict] = {}
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content.append(delta.content)
+                if on_text is not None:
+                    on_text(delta.content)
+            for fragment in delta.tool_calls or []:
+                call = partial_calls.setdefault(
+                    fragment.index, {"id": None, "name": "", "arguments": ""}
+                )
+                if fragment.id:
+                    call["id"] = fragment.id
+                if fragment.function is not None:
+                    call["name"] += fragment.function.name or ""
+                    call["arguments"] += fragment.function.arguments or ""
+
+    tool_calls = [
+        ChatCompletionMessageToolCall(
+            id=call["id"] or f"call_{index}",
+            type="function",
+            function=Function(name=call["name"], arguments=call["arguments"]),
         )
-        recent_logs = response.data[::-1]  # Reverse to get chronological order
-    except Exception as e:
-        print(f"Error fetching conversation history from Supabase: {e}")
-        recent_logs = []
-
-    messages = [
-        {
-            "role": "system",
-            "content": "You are Aura, a personalized, empathetic WhatsApp-based personal assistant. Your mission is to help users organize their lives, set reminders, track goals, and provide helpful support across various life domains. Your tone is warm, supportive, and professional. You celebrate achievements and offer gentle encouragement. Based on the user's message, provide a conversational reply. If the user wants to set a reminder or a goal, call the appropriate tool. The user-facing reply should acknowledge the action if a tool is called (e.g., 'Okay, I've set that reminder for you!'). Also, determine a broad topic category for the current conversation. Use general categories like 'Work', 'Health', 'Personal', 'Finance' - only change the topic if the conversation shifts to a significantly different life domain (e.g., from work tasks to fitness goals, or from personal matters to financial planning).",
-        },
+        for index, call in sorted(partial_calls.items())
     ]
-    messages.extend(build_chat_history(recent_logs))
-
-    # Define a function for the LLM to get the topic
-    topic_tool = {
-        "type": "function",
-        "function": {
-            "name": "set_conversation_topic",
-            "description": "Sets the topic of the conversation.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "topic": {
-                        "type": "string",
-                        "description": "A one or two-word topic for the conversation.",
-                    }
-                },
-                "required": ["topic"],
-            },
-        },
-    }
-
-    all_tools = tools + [topic_tool]
-
-    response = await asyncio.to_thread(
-        client.chat.completions.create,
-        model="gpt-4o",
-        messages=messages,
-        tools=all_tools,
-        tool_choice="auto",
-    )
-
-    response_message = response.choices[0].message
-    tool_calls = response_message.tool_calls
-
-    topic = "General"
-    task_tool_call = None
-
-    if tool_calls:
-        for tool_call in tool_calls:
-            if tool_call.function.name == "set_conversation_topic":
-                try:
-                    topic = json.loads(tool_call.function.arguments).get(
-                        "topic", "General"
-                    )
-                except json.JSONDecodeError:
-                    pass  # Keep default topic if arguments are invalid
-            else:
-                task_tool_call = tool_call  # This is the task-related tool call
-
-    return {
-        "reply": response_message.content or "Got it!",
-        "tool_call": task_tool_call,
-        "topic": topic,
-    }
+
+    # Only the task tools are offered, so the last call is the one to run
+    task_tool_call = tool_calls[-1] if tool_calls else None
+
+    reply = "".join(content) or "Got it!"
+    if question is not None and task_tool_call is None:
+        await response_cache.put(question, context_key, reply)
+    return {"reply": reply, "tool_call": task_tool_call}
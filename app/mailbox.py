@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+from app.config import config
+from app.workers import WorkerPool, worker_pool
+
+
+class _Box:
+    __slots__ = ("pending", "first_arrival", "last_arrival", "task")
+
+    def __init__(self):
+        self.pending: list = []
+        self.first_arrival = 0.0
+        self.last_arrival = 0.0
+        self.task: asyncio.Task | None = None
+
+
+class SenderMailbox:
+    """
+    Per-sender ordering layer in front of the worker pool.
+
+    Messages are grouped by key (the sender's WhatsApp id). Once a sender has
+    been quiet for `debounce` seconds (or `max_wait` has passed since the first
+    message), everything pending is handed to `handler` as one batch. Only one
+    batch per sender runs at a time; messages that arrive meanwhile form the
+    next batch. Different senders are independent and run in parallel.
+    """
+
+    def __init__(
+        self,
+        pool: WorkerPool,
+        debounce: float,
+        max_wait: float,
+        max_batch: int,
+        max_pending: int,
+    ):
+        self.pool = pool
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.handler = None
+        self._boxes: dict[str, _Box] = {}
+        self._pending_total = 0
+
+        # Counters exposed through stats()
+        self.posted = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def set_handler(self, handler):
+        """Sets the coroutine function that processes a batch: handler(batch)."""
+        self.handler = handler
+
+    def post(self, key: str, item) -> bool:
+        """Adds an item to the sender's mailbox. Returns False when the mailbox is full."""
+        if self._pending_total >= self.max_pending:
+            self.rejected += 1
+            return False
+
+        now = time.monotonic()
+        box = self._boxes.get(key)
+        if box is None:
+            box = self._boxes[key] = _Box()
+        if not box.pending:
+            box.first_arrival = now
+        box.pending.append(item)
+        box.last_arrival = now
+        self._pending_total += 1
+        self.posted += 1
+
+        if box.task is None:
+            box.task = asyncio.create_task(self._drain(key, box))
+        return True
+
+    async def _settle(self, box: _Box):
+        """Sleeps until the sender has been quiet for `debounce` seconds or `max_wait` expires."""
+        while True:
+            now = time.monotonic()
+            quiet_until = box.last_arrival + self.debounce
+            deadline = box.first_arrival + self.max_wait
+            remaining = min(quiet_until, deadline) - now
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
+
+    async def _drain(self, key: str, box: _Box):
+        try:
+            while box.pending:
+                await self._settle(box)
+
+                batch = box.pending[: self.max_batch]
+                del box.pending[: self.max_batch]
+                self._pending_total -= len(batch)
+                if box.pending:
+                    # Leftovers from an oversized burst go out right after this batch
+                    box.first_arrival = box.last_arrival = 0.0
+
+                self.batches += 1
+                self.coalesced += len(batch) - 1
+
+                # Waiting for a queue slot is this sender's backpressure; the
+                # webhook still sheds load via max_pending
+                future = await self.pool.submit(self.handler, batch, wait=True)
+                try:
+                    await future
+                except Exception:
+                    pass  # already reported by the worker pool
+        finally:
+            box.task = None
+            if not box.pending and self._boxes.get(key) is box:
+                del self._boxes[key]
+
+    def stats(self) -> dict:
+        return {
+            "senders": len(self._boxes),
+            "pending": self._pending_total,
+            "max_pending": self.max_pending,
+            "debounce_ms": int(self.debounce * 1000),
+            "posted": self.posted,
+            "batches": self.batches,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+        }
+
+
+mailbox = SenderMailbox(
+    pool=worker_pool,
+    debounce=config["MAILBOX_DEBOUNCE"],
+    max_wait=config["MAILBOX_MAX_WAIT"],
+    max_batch=config["MAILBOX_MAX_BATCH"],
+    max_pending=config["MAILBOX_MAX_PENDING"],
+)
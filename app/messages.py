@@ -1,18 +1,12 @@
-import requests
+import logging
 
 from app.config import config
+from app.outbox import INTERACTIVE, outbox
+from app.tracing import log, span
 
 
-# endpoint to send a custom message when triggered
-def send_text_message(to_number: str, message: str):
-    url = f"https://graph.facebook.com/v22.0/{config['PHONE_NUMBER_ID']}/messages"
-
-    headers = {
-        "Authorization": f"Bearer {config['WHATSAPP_TOKEN']}",
-        "Content-Type": "application/json",
-    }
-
-    payload = {
+def text_payload(to_number: str, message: str) -> dict:
+    return {
         "messaging_product": "whatsapp",
         "to": to_number,
         "type": "text",
@@ -21,13 +15,27 @@ def send_text_message(to_number: str, message: str):
         },
     }
 
-    response = requests.post(url, headers=headers, json=payload)
 
-    print("📤 Status:", response.status_code)
-    try:
-        print("📤 Response:", response.json())
-    except Exception as e:
-        print("⚠️ Could not decode JSON:", e, "| Raw:", response.text)
+# endpoint to send a custom message when triggered
+async def send_text_message(to_number: str, message: str, priority: int = INTERACTIVE):
+    payload = text_payload(to_number, message)
+
+    with span("send"):
+        response = await outbox.send(
+            payload, priority=priority, timeout=config["OUTBOX_WAIT_SECONDS"]
+        )
+
+    if response is None:
+        log("send_pending", priority=priority)
+    elif response.is_success:
+        log("sent", logging.DEBUG, status=response.status_code)
+    else:
+        log(
+            "send_failed",
+            logging.WARNING,
+            status=response.status_code,
+            body=response.text,
+        )
 
     return response
 
@@ -56,17 +64,13 @@ def extract_message_data(payload: dict) -> dict:
             "raw": message,
         }
     except Exception as e:
-        print("⚠️ Error extracting message:", e)
+        log("bad_webhook_payload", logging.WARNING, error=repr(e))
         return {}
 
 
-def send_audio_message(to_number: str, media_id: str):
-    url = f"https://graph.facebook.com/v18.0/{config['PHONE_NUMBER_ID']}/messages"
-    headers = {
-        "Authorization": f"Bearer {config['WHATSAPP_TOKEN']}",
-        "Content-Type": "application/json",
-    }
-
+async def send_audio_message(
+    to_number: str, media_id: str, priority: int = INTERACTIVE
+):
     payload = {
         "messaging_product": "whatsapp",
         "to": to_number,
@@ -74,6 +78,12 @@ def send_audio_message(to_number: str, media_id: str):
         "audio": {"id": media_id},
     }
 
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
+    with span("send"):
+        response = await outbox.send(
+            payload, priority=priority, timeout=config["OUTBOX_WAIT_SECONDS"]
+        )
+    if response is None:
+        log("send_pending", priority=priority)
+    else:
+        response.raise_for_status()
     return response
@@ -0,0 +1,151 @@
+from bisect import bisect_left
+from typing import Callable
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket upper bounds shared by the components that record histograms
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+class Histogram:
+    """Bucketed observations with their sum and count, in the Prometheus style."""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (the last bound if beyond it)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 1) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Histograms:
+    """A family of histograms with the same buckets, one per label value."""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self._histograms: dict[str, Histogram] = {}
+
+    def labels(self, label: str) -> Histogram:
+        histogram = self._histograms.get(label)
+        if histogram is None:
+            histogram = self._histograms[label] = Histogram(self.buckets)
+        return histogram
+
+    def items(self):
+        return self._histograms.items()
+
+    def snapshot(self) -> dict:
+        return {label: h.snapshot() for label, h in sorted(self._histograms.items())}
+
+
+class Counters:
+    """Monotonic counts, one per label value."""
+
+    def __init__(self):
+        self._counts: dict[str, float] = {}
+
+    def inc(self, label: str, amount: float = 1):
+        self._counts[label] = self._counts.get(label, 0) + amount
+
+    def items(self):
+        return self._counts.items()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(name: str, value: str, **extra) -> str:
+    pairs = [(name, value), *extra.items()] if name else list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Registry:
+    """
+    Everything exposed on /metrics in the Prometheus text format. Histograms
+    and counters are recorded as they happen; other values are read from
+    the components' own counters when the endpoint is scraped.
+    """
+
+    def __init__(self):
+        self._metrics: list[tuple] = []
+
+    def histograms(
+        self, name: str, help: str, label: str, family: Histograms
+    ) -> Histograms:
+        self._metrics.append(("histogram", name, help, label, family))
+        return family
+
+    def counters(self, name: str, help: str, label: str) -> Counters:
+        family = Counters()
+        self._metrics.append(("counter", name, help, label, family.items))
+        return family
+
+    def collect(
+        self,
+        kind: str,
+        name: str,
+        help: str,
+        read: Callable[[], float | dict],
+        label: str = "",
+    ):
+        """Registers a counter or gauge read when scraped; `read` may return {label: value}."""
+        self._metrics.append((kind, name, help, label, read))
+
+    def render(self) -> str:
+        lines = []
+        for kind, name, help, label, source in self._metrics:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for value, histogram in source.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        tags = _labels(label, value, le=bound)
+                        lines.append(f"{name}_bucket{tags} {cumulative}")
+                    tags = _labels(label, value, le="+Inf")
+                    lines.append(f"{name}_bucket{tags} {histogram.count}")
+                    lines.append(f"{name}_sum{_labels(label, value)} {histogram.sum}")
+                    lines.append(
+                        f"{name}_count{_labels(label, value)} {histogram.count}"
+                    )
+                continue
+            values = source()
+            if isinstance(values, (int, float)):
+                values = {"": values}
+            for value, number in dict(values).items():
+                tags = _labels(label, value) if label else ""
+                lines.append(f"{name}{tags} {float(number)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
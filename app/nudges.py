@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from app.config import config
+from app.db import db
+from app.health_data import HealthData, health_data
+from app.messages import text_payload
+from app.outbox import BULK, outbox
+from app.tracing import log
+
+# Why a user is nudged; columns of the signal matrix, in tie-break order
+REASONS = ("biomarker", "steps", "sleep", "trend")
+BIOMARKER, STEPS, SLEEP, TREND = range(len(REASONS))
+
+# How much each signal counts towards a user's score
+WEIGHTS = (1.0, 0.8, 0.6, 0.7)
+
+# How far out of range each biomarker range label is
+RANGE_SEVERITY = {
+    "Critical High": 1.0,
+    "Critical Low": 1.0,
+    "High": 0.5,
+    "Low": 0.5,
+    "Supra Optimal": 0.2,
+    "Sub Optimal": 0.2,
+}
+
+MESSAGES = {
+    "biomarker": "Your latest {biomarker} result came back {range}. It could be "
+    "worth talking it through with your doctor, and I'm happy to help you "
+    "prepare questions 🩺",
+    "steps": "You've averaged about {steps:,.0f} steps a day lately. How about "
+    "a short walk today? Even ten minutes makes a difference 🚶",
+    "sleep": "Your deep sleep has been on the low side recently. A regular "
+    "bedtime and a screen-free last hour can really help 😴",
+    "trend": "You've been less active than usual this week. Anything getting in "
+    "the way? We could plan something small together 💪",
+}
+
+
+class NudgeEngine:
+    """
+    Proactive nudges from the health datasets (see app/health_data.py).
+
+    Every `interval` seconds one replica (whoever holds the "nudges" lease)
+    scores all users at once: each signal is a column of a users x reasons
+    matrix computed with array operations over the wearable and biomarker
+    tables, so a run costs the same few passes whether it covers a hundred
+    user-days or millions.
+
+    - biomarker: the worst range label among each user's latest readings
+    - steps: the shortfall of recent daily steps against `step_target`
+    - sleep: how far the recent deep-sleep share falls below `deep_sleep_ratio`
+    - trend: recent steps dropping more than `trend_drop` below the weeks before
+
+    Users linked through users.health_user_id are ranked by weighted score;
+    those below `min_score` or nudged in the last `cooldown` seconds are
+    skipped, and the top `max_per_run` are queued on the outbox's bulk lane,
+    behind replies and reminders. Nothing is sent during `quiet_hours`
+    (start and end hour in `tz`).
+    """
+
+    def __init__(
+        self,
+        health: HealthData,
+        enabled: bool,
+        interval: float,
+        cooldown: float,
+        quiet_hours: tuple[int, int],
+        tz: str,
+        step_target: float,
+        deep_sleep_ratio: float,
+        trend_drop: float,
+        min_score: float,
+        max_per_run: int,
+    ):
+        self.health = health
+        self.enabled = enabled
+        self.interval = interval
+        self.cooldown = cooldown
+        self.quiet_hours = quiet_hours
+        self.tz = ZoneInfo(tz)
+        self.step_target = step_target
+        self.deep_sleep_ratio = deep_sleep_ratio
+        self.trend_drop = trend_drop
+        self.min_score = min_score
+        self.max_per_run = max_per_run
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: asyncio.Task | None = None
+        self._leading = False
+
+        # Counters exposed through stats()
+        self.runs = 0
+        self.errors = 0
+        self.skipped_quiet = 0
+        self.queued = 0
+        self.reasons: Counter = Counter()
+        self.last_candidates = 0
+        self.last_run: dict = {}
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._leading:
+            self._leading = False
+            try:
+                await db.release_lease("nudges", self.holder)
+            except Exception as e:
+                log("nudge_lease_release_failed", logging.WARNING, error=repr(e))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.errors += 1
+                log("nudge_run_failed", logging.WARNING, error=repr(e))
+            await asyncio.sleep(self.interval)
+
+    def quiet(self, now: datetime) -> bool:
+        start, end = self.quiet_hours
+        hour = now.astimezone(self.tz).hour
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end  # wraps past midnight
+
+    async def run_once(self) -> int:
+        """Scores, ranks and queues one round of nudges. Returns how many were queued."""
+        now = datetime.now(timezone.utc)
+        if self.quiet(now):
+            self.skipped_quiet += 1
+            return 0
+        # Held for a bit more than a run apart, so a standby only takes over
+        # once this replica has missed its next run
+        self._leading = await db.acquire_lease(
+            "nudges", self.holder, self.interval * 1.5
+        )
+        if not self._leading or not self.health.tables:
+            return 0
+
+        started = time.perf_counter()
+        # Array work runs off the event loop, which keeps serving replies meanwhile
+        scored = await asyncio.to_thread(self.score)
+        users = await db.list_health_users()
+        nudges = await asyncio.to_thread(self.rank, scored, users, now.timestamp())
+        for phone, text, _ in nudges:
+            await outbox.send(text_payload(phone, text), priority=BULK, wait=False)
+        if nudges:
+            await db.mark_nudged([user_id for _, _, user_id in nudges], now.isoformat())
+
+        self.runs += 1
+        self.queued += len(nudges)
+        self.last_run = {
+            "at": now.isoformat(timespec="seconds"),
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+            "scored": len(scored["ids"]),
+            "linked_users": len(users),
+            "candidates": self.last_candidates,
+            "queued": len(nudges),
+        }
+        log("nudges_queued", nudges=len(nudges), users=len(users))
+        return len(nudges)
+
+    def score(self) -> dict:
+        """
+        The signal matrix for every user in the health datasets, as
+        {ids, signals, scores, reasons, steps, worst_biomarker}, aligned
+        with `ids` (the datasets' sorted userIds). CPU-bound; run it in a thread.
+        """
+        wearables = self.health.tables["wearables"]
+        biomarkers = self.health.tables["biomarkers"]
+        # Both key arrays are sorted, so a stable sort merges them in one pass
+        ids = np.concatenate([wearables.keys, biomarkers.keys])
+        ids.sort(kind="stable")
+        ids = ids[np.append(True, ids[1:] != ids[:-1])]
+        signals = np.zeros((len(ids), len(REASONS)))
+        days = self.health.window_days
+
+        # Wearables: recent steps and sleep, and the weeks before as a baseline
+        w = np.searchsorted(ids, wearables.keys)
+        recent = wearables.window(days)
+        steps = wearables.mean_by_key("steps", recent)
+        baseline = wearables.mean_by_key("steps", wearables.window(days * 4) & ~recent)
+        deep = wearables.sum_by_key("sleepTimeDeep", recent)
+        total = deep + wearables.sum_by_key("sleepTimeRem", recent)
+        total += wearables.sum_by_key("sleepTimeLight", recent)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = np.where(total > 0, deep / total, np.nan)
+            drop = 1 - steps / baseline
+        shortfall = (self.step_target - steps) / self.step_target
+        signals[w, STEPS] = np.nan_to_num(np.clip(shortfall, 0, 1))
+        light = (self.deep_sleep_ratio - ratio) / self.deep_sleep_ratio
+        signals[w, SLEEP] = np.nan_to_num(np.clip(light, 0, 1))
+        signals[w, TREND] = np.nan_to_num(np.where(drop >= self.trend_drop, drop, 0))
+
+        # Biomarkers: the most severe range among each user's latest readings
+        latest = biomarkers.latest_per("biomarkerName")
+        labels = biomarkers.vocabularies["range"]
+        # The extra 0 is for code -1, a reading without a range
+        by_code = np.array([RANGE_SEVERITY.get(label, 0.0) for label in labels] + [0])
+        severity = by_code[biomarkers["range"][latest]]
+        owners = np.searchsorted(ids, biomarkers["userId"][latest])
+        # Sorted by user then severity, the last reading of each user is its worst
+        order = np.lexsort((severity, owners))
+        owners = owners[order]
+        worst = np.append(owners[1:] != owners[:-1], True)
+        signals[owners[worst], BIOMARKER] = severity[order][worst]
+        worst_row = np.full(len(ids), -1)
+        worst_row[owners[worst]] = latest[order][worst]
+
+        weighted = signals * np.array(WEIGHTS)
+        step_avg = np.full(len(ids), np.nan)
+        step_avg[w] = steps
+        return {
+            "ids": ids,
+            "signals": signals,
+            "scores": weighted.sum(axis=1),
+            "reasons": weighted.argmax(axis=1),
+            "steps": step_avg,
+            "worst_biomarker": worst_row,
+        }
+
+    def rank(self, scored: dict, users: list[dict], now: float) -> list[tuple]:
+        """(phone, message, user id) for the users to nudge, highest score first."""
+        if not users:
+            return []
+        ids = scored["ids"]
+        health_ids = np.array([u["health_user_id"] for u in users], "int64")
+        last_nudged = np.array(
+            [
+                datetime.fromisoformat(u["last_nudged_at"]).timestamp()
+                if u.get("last_nudged_at")
+                else -np.inf
+                for u in users
+            ]
+        )
+
+        at = np.minimum(np.searchsorted(ids, health_ids), len(ids) - 1)
+        linked = ids[at] == health_ids
+        scores = np.where(linked, scored["scores"][at], 0.0)
+        eligible = (
+            linked
+            & (scores >= self.min_score)
+            & (now - last_nudged >= self.cooldown)
+            & np.array([bool(u.get("phone")) for u in users])
+        )
+        candidates = np.flatnonzero(eligible)
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        self.last_candidates = len(candidates)
+
+        nudges = []
+        for i in order[: self.max_per_run]:
+            reason = REASONS[scored["reasons"][at[i]]]
+            self.reasons[reason] += 1
+            nudges.append(
+                (
+                    users[i]["phone"],
+                    self._message(reason, scored, at[i]),
+                    users[i]["id"],
+                )
+            )
+        return nudges
+
+    def _message(self, reason: str, scored: dict, i: int) -> str:
+        biomarkers = self.health.tables["biomarkers"]
+        row = scored["worst_biomarker"][i]
+        fields = {"steps": scored["steps"][i]}
+        if row >= 0:
+            fields["biomarker"] = biomarkers.label(
+                "biomarkerName", int(biomarkers["biomarkerName"][row])
+            )
+            fields["range"] = biomarkers.label("range", int(biomarkers["range"][row]))
+            fields["range"] = fields["range"].lower()
+        return MESSAGES[reason].format(**fields)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "leading": self._leading,
+            "runs": self.runs,
+            "errors": self.errors,
+            "skipped_quiet": self.skipped_quiet,
+            "queued": self.queued,
+            "reasons": dict(self.reasons),
+            "last_run": self.last_run,
+        }
+
+
+nudges = NudgeEngine(
+    health=health_data,
+    enabled=config["NUDGES_ENABLED"],
+    interval=config["NUDGE_INTERVAL_SECONDS"],
+    cooldown=config["NUDGE_COOLDOWN_HOURS"] * 3600,
+    quiet_hours=config["NUDGE_QUIET_HOURS"],
+    tz=config["NUDGE_TIMEZONE"],
+    step_target=config["NUDGE_STEP_TARGET"],
+    deep_sleep_ratio=config["NUDGE_DEEP_SLEEP_RATIO"],
+    trend_drop=config["NUDGE_TREND_DROP"],
+    min_score=config["NUDGE_MIN_SCORE"],
+    max_per_run=config["NUDGE_MAX_PER_RUN"],
+)
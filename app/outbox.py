@@ -0,0 +1,448 @@
+import asyncio
+import itertools
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from app.config import config
+from app.db import db
+from app.graph import RETRY_ERRORS, RETRY_STATUSES, graph
+from app.tracing import log
+
+# Priority lanes: lower numbers are sent first
+INTERACTIVE = 0
+REMINDER = 1
+BULK = 2
+LANES = {INTERACTIVE: "interactive", REMINDER: "reminder", BULK: "bulk"}
+
+
+class TokenBucket:
+    """Allows `rate` sends per second with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stops all sends for `seconds`, e.g. after Meta answers 429."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class OutboundMessage:
+    __slots__ = (
+        "id",
+        "phone_number_id",
+        "payload",
+        "priority",
+        "attempts",
+        "persisted",
+        "future",
+    )
+
+    def __init__(
+        self,
+        phone_number_id: str,
+        payload: dict,
+        priority: int,
+        id: str | None = None,
+        attempts: int = 0,
+        persisted: bool = False,
+    ):
+        self.id = id or str(uuid.uuid4())
+        self.phone_number_id = phone_number_id
+        self.payload = payload
+        self.priority = priority
+        self.attempts = attempts
+        self.persisted = persisted
+        self.future: asyncio.Future | None = None
+
+    def as_row(
+        self,
+        next_attempt_at: datetime,
+        owner: str | None = None,
+        lease_expires_at: datetime | None = None,
+    ) -> dict:
+        """The `outbox` row; without an owner any replica may take it right away."""
+        return {
+            "id": self.id,
+            "phone_number_id": self.phone_number_id,
+            "payload": self.payload,
+            "priority": self.priority,
+            "attempts": self.attempts,
+            "next_attempt_at": next_attempt_at.isoformat(),
+            "owner": owner,
+            "lease_expires_at": lease_expires_at.isoformat()
+            if lease_expires_at
+            else None,
+        }
+
+
+class Outbox:
+    """
+    Delivery queue for every outbound WhatsApp message.
+
+    Messages wait in priority lanes (interactive replies before reminders
+    before bulk sends) and go out through a token bucket per phone number
+    id. Rate limits, 5xx responses and connection failures are retried with
+    jittered exponential backoff (honouring Retry-After) up to
+    `max_attempts`; a 429 also pauses that number's bucket.
+
+    A deferred message is written to the `outbox` table until it is
+    delivered, under a lease this process renews every `lease_ttl` / 3
+    seconds while it holds the message. Anything still queued at shutdown is
+    saved without an owner. Other processes take over rows that are
+    unowned or whose lease lapsed (the holder died), at startup and
+    periodically after, so a live process's retries are never sent twice.
+    A send cut off by shutdown while its request was out is dropped rather
+    than saved, since Graph may already have delivered it.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        concurrency: int,
+        max_attempts: int,
+        backoff: float,
+        backoff_cap: float,
+        drain_timeout: float,
+        lease_ttl: float,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.drain_timeout = drain_timeout
+        self.lease_ttl = lease_ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._buckets: dict[str, TokenBucket] = {}
+        self._deferred: dict[str, tuple[asyncio.TimerHandle, OutboundMessage]] = {}
+        self._depth: Counter = Counter()
+        self._workers: list[asyncio.Task] = []
+        self._maintainer: asyncio.Task | None = None
+        self._background: set[asyncio.Task] = set()
+
+        # Counters exposed through stats()
+        self.statuses: Counter = Counter()
+        self.lane_sent: Counter = Counter()
+        self.delivered = 0
+        self.failed = 0
+        self.exhausted = 0
+        self.retries = 0
+        self.persisted = 0
+        self.restored = 0
+        self.in_doubt = 0
+        self.handed_off = 0
+
+    async def start(self):
+        if self._workers:
+            return
+        await self._restore()
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+        self._maintainer = asyncio.create_task(self._maintain())
+
+    async def _restore(self):
+        """Takes over unowned and abandoned rows, keeping their retry times."""
+        try:
+            rows = await db.take_outbox()
+        except Exception as e:
+            log("outbox_restore_failed", logging.WARNING, error=repr(e))
+            return
+        now = datetime.now(timezone.utc)
+        for row in rows:
+            message = OutboundMessage(
+                row["phone_number_id"],
+                row["payload"],
+                row["priority"],
+                id=row["id"],
+                attempts=row["attempts"],
+                # Taking the rows deleted them; saved again if deferred
+                persisted=False,
+            )
+            delay = (
+                datetime.fromisoformat(row["next_attempt_at"]) - now
+            ).total_seconds()
+            if delay > 0:
+                self._defer(message, delay)
+            else:
+                self._put(message)
+        self.restored += len(rows)
+        if rows:
+            log("outbox_restored", messages=len(rows))
+
+    async def _maintain(self):
+        """Renews the lease on this process's deferred rows and adopts orphaned ones."""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            if any(message.persisted for _, message in self._deferred.values()):
+                try:
+                    await db.renew_outbox(self.holder, self.lease_ttl)
+                except Exception as e:
+                    log("outbox_renew_failed", logging.WARNING, error=repr(e))
+            await self._restore()
+
+    async def stop(self):
+        """Gives queued messages a moment to go out, then saves the rest."""
+        if not self._workers:
+            return
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+            await asyncio.gather(self._maintainer, return_exceptions=True)
+            self._maintainer = None
+        deadline = time.monotonic() + self.drain_timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        now = datetime.now(timezone.utc)
+        leftovers = []
+        while not self._queue.empty():
+            leftovers.append(self._take())
+        for handle, message in self._deferred.values():
+            handle.cancel()
+            leftovers.append(message)
+        self._deferred.clear()
+        try:
+            await db.save_outbox([m.as_row(now) for m in leftovers])
+            self.persisted += len(leftovers)
+        except Exception as e:
+            log(
+                "outbox_save_failed",
+                logging.ERROR,
+                messages=len(leftovers),
+                error=repr(e),
+            )
+        # Row deletes for messages finished (or dropped) on the way down
+        await asyncio.gather(*self._background, return_exceptions=True)
+
+    async def send(
+        self,
+        payload: dict,
+        priority: int = INTERACTIVE,
+        phone_number_id: str | None = None,
+        wait: bool = True,
+        timeout: float | None = None,
+    ) -> httpx.Response | None:
+        """
+        Queues a Graph /messages payload. With `wait` the call returns the
+        final response once the message is delivered or given up on, or
+        None once `timeout` seconds pass first; the outbox then keeps
+        retrying it in the background.
+        """
+        message = OutboundMessage(
+            phone_number_id or config["PHONE_NUMBER_ID"], payload, priority
+        )
+        if wait:
+            message.future = asyncio.get_running_loop().create_future()
+        self._put(message)
+        if not wait:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(message.future), timeout)
+        except TimeoutError:
+            self.handed_off += 1
+            return None
+
+    def _put(self, message: OutboundMessage):
+        self._queue.put_nowait((message.priority, next(self._seq), message))
+        self._depth[message.priority] += 1
+
+    def _take(self) -> OutboundMessage:
+        message = self._queue.get_nowait()[2]
+        self._depth[message.priority] -= 1
+        return message
+
+    def _bucket(self, phone_number_id: str) -> TokenBucket:
+        bucket = self._buckets.get(phone_number_id)
+        if bucket is None:
+            bucket = self._buckets[phone_number_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            _, _, message = await self._queue.get()
+            self._depth[message.priority] -= 1
+            try:
+                await self._bucket(message.phone_number_id).acquire()
+            except asyncio.CancelledError:
+                # Shutting down before the send: keep the message for the next process
+                self._put(message)
+                raise
+            try:
+                await self._deliver(message)
+            except asyncio.CancelledError:
+                # Graph may already have the request, so sending it again could
+                # deliver it twice; it is dropped (and its row deleted) instead
+                self.in_doubt += 1
+                log("outbox_in_doubt", logging.WARNING, message_id=message.id)
+                self._finish(message, error=RuntimeError("Cancelled mid-send"))
+                raise
+            except Exception as e:
+                log("outbox_worker_error", logging.ERROR, error=repr(e))
+                self._finish(message, error=e)
+
+    async def _deliver(self, message: OutboundMessage):
+        message.attempts += 1
+        url = f"/{message.phone_number_id}/messages"
+        try:
+            # The outbox owns retries, so the Graph client shouldn't add its own
+            response = await graph.post(url, json=message.payload, retries=0)
+        except RETRY_ERRORS as e:
+            self.statuses["network_error"] += 1
+            self._retry(message, error=e)
+            return
+
+        self.statuses[str(response.status_code)] += 1
+        if response.status_code in RETRY_STATUSES:
+            delay = self._retry(message, response=response)
+            if response.status_code == 429 and delay is not None:
+                self._bucket(message.phone_number_id).pause(delay)
+            return
+        self._finish(message, response=response)
+
+    def _delay(self, attempt: int, response: httpx.Response | None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_cap)
+        return random.uniform(0, min(self.backoff_cap, self.backoff * 2**attempt))
+
+    def _retry(
+        self,
+        message: OutboundMessage,
+        response: httpx.Response | None = None,
+        error: Exception | None = None,
+    ) -> float | None:
+        if message.attempts >= self.max_attempts:
+            self.exhausted += 1
+            log(
+                "outbox_exhausted",
+                logging.ERROR,
+                message_id=message.id,
+                attempts=message.attempts,
+            )
+            self._finish(message, response=response, error=error)
+            return None
+
+        self.retries += 1
+        delay = self._delay(message.attempts, response)
+        self._defer(message, delay)
+        return delay
+
+    def _defer(self, message: OutboundMessage, delay: float):
+        """Requeues a message after `delay` seconds, persisted under this process's lease."""
+        handle = asyncio.get_running_loop().call_later(delay, self._requeue, message.id)
+        self._deferred[message.id] = (handle, message)
+        if not message.persisted:
+            message.persisted = True
+            now = datetime.now(timezone.utc)
+            row = message.as_row(
+                now + timedelta(seconds=delay),
+                owner=self.holder,
+                lease_expires_at=now + timedelta(seconds=self.lease_ttl),
+            )
+            self._background_write(db.save_outbox([row]))
+
+    def _requeue(self, message_id: str):
+        entry = self._deferred.pop(message_id, None)
+        if entry is not None:
+            self._put(entry[1])
+
+    def _finish(
+        self,
+        message: OutboundMessage,
+        response: httpx.Response | None = None,
+        error: Exception | None = None,
+    ):
+        if response is not None and not response.is_error:
+            self.delivered += 1
+            self.lane_sent[LANES.get(message.priority, str(message.priority))] += 1
+        else:
+            self.failed += 1
+        if message.persisted:
+            self._background_write(db.delete_outbox([message.id]))
+
+        future = message.future
+        if future is not None and not future.done():
+            if response is not None:
+                future.set_result(response)
+            else:
+                future.set_exception(error or RuntimeError("Message not delivered"))
+
+    def _background_write(self, coro):
+        async def write():
+            try:
+                await coro
+            except Exception as e:
+                log("outbox_update_failed", logging.WARNING, error=repr(e))
+
+        task = asyncio.create_task(write())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def stats(self) -> dict:
+        return {
+            "queued": {
+                LANES.get(priority, str(priority)): count
+                for priority, count in self._depth.items()
+            },
+            "deferred": len(self._deferred),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "exhausted": self.exhausted,
+            "retries": self.retries,
+            "sent_by_lane": dict(self.lane_sent),
+            "statuses": dict(self.statuses),
+            "persisted": self.persisted,
+            "restored": self.restored,
+            "in_doubt": self.in_doubt,
+            "handed_off": self.handed_off,
+        }
+
+
+# Meta's rate limit is per phone number, so shards (app/cluster.py) split it
+outbox = Outbox(
+    rate=config["OUTBOX_RATE"] / config["SHARD_COUNT"],
+    burst=max(1, config["OUTBOX_BURST"] // config["SHARD_COUNT"]),
+    concurrency=config["OUTBOX_CONCURRENCY"],
+    max_attempts=config["OUTBOX_MAX_ATTEMPTS"],
+    backoff=config["OUTBOX_BACKOFF"],
+    backoff_cap=config["OUTBOX_BACKOFF_CAP"],
+    drain_timeout=config["OUTBOX_DRAIN_TIMEOUT"],
+    lease_ttl=config["OUTBOX_LEASE_TTL_SECONDS"],
+)
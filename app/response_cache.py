@@ -0,0 +1,198 @@
+import hashlib
+import logging
+import re
+import time
+
+import numpy as np
+
+from app.config import config
+from app.embeddings import Embedder, embedder
+from app.tracing import log
+
+# Questions that mention the user's own life, or lean on earlier messages,
+# need their context and are never shared between users
+PERSONAL = re.compile(
+    r"\b(?:i|my|mine|me|myself|our|ours|we|us|yesterday|today|tonight|tomorrow"
+    r"|that|this|it|those|these|again)\b",
+    re.IGNORECASE,
+)
+
+# Likely to end in a tool call, whose reply only makes sense alongside it
+TOOL_WORDS = re.compile(r"\b(?:remind|reminder|goal|goals)\b", re.IGNORECASE)
+
+# Best-match similarity is bucketed so the threshold can be tuned from /stats
+SIMILARITY_BUCKETS = (0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98)
+
+
+def normalize(text: str) -> str:
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return re.sub(r"[\s?!.]+$", "", text)
+
+
+def fingerprint(*parts: str) -> int:
+    """A context key: answers are only shared between identical prompts and models."""
+    digest = hashlib.sha256("\0".join(parts).encode()).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+class ResponseCache:
+    """
+    Shares replies to self-contained informational questions ("how much
+    water should an adult drink?") between users. Questions are normalized and
+    embedded, then matched against earlier ones with the same context
+    fingerprint; a match at or above `threshold` cosine similarity is served
+    without calling the model.
+
+    The index is a preallocated numpy matrix searched brute-force, which is
+    plenty for `max_entries` in the low thousands. Entries expire after
+    `ttl` seconds; when full, an expired or else the least recently used
+    entry is replaced.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        enabled: bool,
+        threshold: float,
+        max_entries: int,
+        ttl: float,
+        max_words: int,
+    ):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_words = max_words
+        self.enabled = enabled
+
+        self._vectors = None  # allocated on first put, once the dimension is known
+        self._expires = None
+        self._used = None
+        self._fingerprints = None
+        self._replies: list[str | None] = [None] * max_entries
+        self._size = 0
+
+        # Counters exposed through stats()
+        self.lookups = 0
+        self.hits = 0
+        self.near_misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.errors = 0
+        self.refused: dict[str, int] = {}
+        self.similarities = [0] * (len(SIMILARITY_BUCKETS) + 1)
+
+    def question(
+        self, texts: list[str], prompt: list[dict], profile: bool = False
+    ) -> str | None:
+        """
+        The normalized question if this turn may be answered from the cache.
+        `prompt` is the turn's built prompt; only a question asked with the
+        bare system prompt, so no earlier messages, conversation summary or
+        health `profile`, is shared.
+        """
+        if not self.enabled:
+            return None
+        if len(texts) != 1 or not texts[0]:
+            return self._refuse("batch")
+        text = texts[0].strip()
+        if not text.endswith("?"):
+            return self._refuse("not_a_question")
+        if len(text.split()) > self.max_words:
+            return self._refuse("too_long")
+        if TOOL_WORDS.search(text):
+            return self._refuse("tool")
+        if PERSONAL.search(text):
+            return self._refuse("personal")
+        if profile or len(prompt) != 2 or prompt[-1]["content"] != texts[0]:
+            return self._refuse("context")
+        return normalize(text)
+
+    def _refuse(self, reason: str) -> None:
+        self.refused[reason] = self.refused.get(reason, 0) + 1
+        return None
+
+    async def get(self, question: str, context: int) -> str | None:
+        self.lookups += 1
+        try:
+            (vector,) = await self.embedder.embed([question])
+        except Exception as e:
+            self.errors += 1
+            log("response_cache_lookup_failed", logging.WARNING, error=repr(e))
+            return None
+        if self._size == 0:
+            return None
+
+        now = time.monotonic()
+        n = self._size
+        live = (self._expires[:n] > now) & (self._fingerprints[:n] == context)
+        if not live.any():
+            return None
+        scores = np.where(live, self._vectors[:n] @ np.asarray(vector, "float32"), -1.0)
+        slot = int(scores.argmax())
+        best = float(scores[slot])
+        self.similarities[sum(best >= b for b in SIMILARITY_BUCKETS)] += 1
+
+        if best < self.threshold:
+            if best >= self.threshold - 0.05:
+                self.near_misses += 1
+            return None
+        self.hits += 1
+        self._used[slot] = now
+        return self._replies[slot]
+
+    async def put(self, question: str, context: int, reply: str):
+        try:
+            (vector,) = await self.embedder.embed([question])
+        except Exception as e:
+            self.errors += 1
+            log("response_cache_store_failed", logging.WARNING, error=repr(e))
+            return
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, len(vector)), "float32")
+            self._expires = np.zeros(self.max_entries)
+            self._used = np.zeros(self.max_entries)
+            self._fingerprints = np.zeros(self.max_entries, "int64")
+
+        now = time.monotonic()
+        if self._size < self.max_entries:
+            slot = self._size
+            self._size += 1
+        else:
+            expired = np.flatnonzero(self._expires <= now)
+            slot = int(expired[0]) if len(expired) else int(self._used.argmin())
+            self.evicted += 1
+
+        self._vectors[slot] = vector
+        self._expires[slot] = now + self.ttl
+        self._used[slot] = now
+        self._fingerprints[slot] = context
+        self._replies[slot] = reply
+        self.stored += 1
+
+    def stats(self) -> dict:
+        labels = [f"<{SIMILARITY_BUCKETS[0]}"] + [f">={b}" for b in SIMILARITY_BUCKETS]
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "entries": self._size,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "near_misses": self.near_misses,
+            "stored": self.stored,
+            "evicted": self.evicted,
+            "errors": self.errors,
+            "refused": dict(self.refused),
+            "best_similarity": dict(zip(labels, self.similarities)),
+        }
+
+
+response_cache = ResponseCache(
+    embedder=embedder,
+    enabled=config["RESPONSE_CACHE_ENABLED"],
+    threshold=config["RESPONSE_CACHE_THRESHOLD"],
+    max_entries=config["RESPONSE_CACHE_MAX_ENTRIES"],
+    ttl=config["RESPONSE_CACHE_TTL_SECONDS"],
+    max_words=config["RESPONSE_CACHE_MAX_WORDS"],
+)
@@ -0,0 +1,163 @@
+import re
+import unicodedata
+
+from app.config import config
+
+# Routes, cheapest first: a template reply, the smaller model, or the full
+# GPT-4o turn
+ACK = "ack"
+TASK = "task"
+FULL = "full"
+ROUTES = (ACK, TASK, FULL)
+
+THANKS = {
+    "thanks",
+    "thank you",
+    "thanks a lot",
+    "thank you so much",
+    "thanks so much",
+    "thx",
+    "ty",
+    "cheers",
+    "much appreciated",
+}
+ACKNOWLEDGEMENTS = THANKS | {
+    "ok",
+    "okay",
+    "okie",
+    "k",
+    "kk",
+    "ok thanks",
+    "okay thanks",
+    "ok thank you",
+    "cool",
+    "great",
+    "nice",
+    "perfect",
+    "awesome",
+    "sure",
+    "alright",
+    "all right",
+    "got it",
+    "sounds good",
+    "will do",
+    "yes",
+    "yep",
+    "yup",
+    "noted",
+}
+
+TEMPLATES = {
+    "thanks": "You're welcome! 😊",
+    "ack": "Got it! Let me know if there's anything else I can help with.",
+}
+
+# Obvious requests for a reminder or goal, optionally after a greeting or "please"
+TASK_PHRASES = re.compile(
+    r"^(?:(?:hey|hi|hello)(?: aura)?[,!]?\s+|please\s+|can you\s+|could you\s+)*"
+    r"(?:remind me\b|set (?:up )?(?:a |an )?reminder\b|add (?:a )?reminder\b"
+    r"|don'?t let me forget\b|my (?:new )?goal is\b|set (?:a |my )?(?:new )?goal\b"
+    r"|add (?:a )?goal\b)",
+    re.IGNORECASE,
+)
+
+# Longer messages usually carry more than a single request
+TASK_MAX_CHARS = 200
+
+# A reply ending in a question, possibly followed by emoji or punctuation
+QUESTION = re.compile(r"\?\W*$")
+
+
+def _normalize(text: str) -> str:
+    text = re.sub(r"[^\w\s']", " ", text.lower())
+    return " ".join(text.split())
+
+
+def _is_emoji_only(text: str) -> bool:
+    """True for messages made only of emoji, e.g. "👍" or "🙏🏽🙏🏽"."""
+    symbols = [c for c in text if not c.isspace()]
+    return bool(symbols) and all(
+        unicodedata.category(c) in ("So", "Sk") or c in "\u200d\ufe0f" for c in symbols
+    )
+
+
+class IntentRouter:
+    """
+    Decides how much model each turn needs before any LLM call is made.
+    Local rules catch acknowledgements ("ok", "thanks", "👍"), which get a
+    template reply unless they answer a question Aura just asked ("Shall I
+    set a reminder?" - "yes"), and obvious reminder/goal phrasing, which
+    goes to the cheaper model. Everything else, and any route
+    not listed in `routes`, gets the full GPT-4o turn.
+
+    Latency per route is recorded so stats() can show how often each route
+    is taken and roughly how much time the cheaper ones save.
+    """
+
+    def __init__(self, routes: set[str], task_model: str):
+        self.routes = routes
+        self.task_model = task_model
+
+        # Counters exposed through stats()
+        self.counts = {route: 0 for route in ROUTES}
+        self.latency_ms = {route: 0.0 for route in ROUTES}
+        self.answers = 0
+
+    def classify(self, texts: list[str], last_reply: str | None = None) -> str:
+        """
+        Picks the route for a turn; every message in it must qualify.
+        `last_reply` is Aura's previous message: if it asked a question,
+        an "ok" or "yes" is an answer for the model, not an acknowledgement.
+        """
+        routes = [self._classify(text or "") for text in texts]
+        if not routes:
+            return FULL
+        route = max(routes, key=ROUTES.index)
+        if route == ACK and last_reply and QUESTION.search(last_reply):
+            self.answers += 1
+            return FULL
+        return route if route in self.routes else FULL
+
+    def _classify(self, text: str) -> str:
+        text = text.strip()
+        if _is_emoji_only(text) or _normalize(text) in ACKNOWLEDGEMENTS:
+            return ACK
+        if len(text) <= TASK_MAX_CHARS and TASK_PHRASES.match(text):
+            return TASK
+        return FULL
+
+    def template(self, texts: list[str]) -> str:
+        """The canned reply for an ACK turn."""
+        if any(_normalize(text or "") in THANKS for text in texts):
+            return TEMPLATES["thanks"]
+        return TEMPLATES["ack"]
+
+    def record(self, route: str, elapsed_ms: float):
+        self.counts[route] += 1
+        self.latency_ms[route] += elapsed_ms
+
+    def stats(self) -> dict:
+        avg = {
+            route: round(self.latency_ms[route] / self.counts[route], 1)
+            if self.counts[route]
+            else 0.0
+            for route in ROUTES
+        }
+        # Time saved compared with sending the same turns through the full model
+        saved = sum(
+            self.counts[route] * max(avg[FULL] - avg[route], 0.0)
+            for route in (ACK, TASK)
+            if avg[FULL]
+        )
+        return {
+            "enabled": sorted(self.routes),
+            "counts": dict(self.counts),
+            "answers_to_questions": self.answers,
+            "avg_latency_ms": avg,
+            "estimated_saved_ms": round(saved, 1),
+        }
+
+
+router = IntentRouter(
+    routes=config["ROUTER_ROUTES"], task_model=config["ROUTER_TASK_MODEL"]
+)
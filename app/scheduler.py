@@ -0,0 +1,468 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+from app.config import config
+from app.db import db
+from app.graph import RETRY_STATUSES
+from app.messages import send_text_message
+from app.outbox import REMINDER
+from app.tracing import log
+
+
+class Reminder:
+    """One firing of a task, waiting for the next dispatcher tick."""
+
+    __slots__ = ("task_id", "user_id", "content", "due", "previous", "attempts")
+
+    def __init__(self, task_id: int, user_id: int, content: str, due: datetime):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.content = content
+        self.due = due
+        # The task's last_fired_at before this firing was claimed
+        self.previous: str | None = None
+        self.attempts = 0
+
+
+class ReminderDispatcher:
+    """
+    Sends due reminders in batches on the event loop. Everything that fires
+    within one `tick` is claimed and resolved to phone numbers with a single
+    Supabase request each, then sent with at most `concurrency` messages in
+    flight, so a few thousand reminders due on the same minute don't each
+    pay for their own lookups.
+
+    A claimed reminder that could not be sent (the send raised or Graph
+    kept failing) is released again and resubmitted after `retry_delay`
+    seconds, doubling each time, up to `max_attempts`. A released slot is
+    also caught up by whichever replica leads next.
+    """
+
+    def __init__(
+        self,
+        tick: float,
+        concurrency: int,
+        max_batch: int,
+        retry_delay: float,
+        max_attempts: int,
+    ):
+        self.tick = tick
+        self.max_batch = max_batch
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._sends = asyncio.Semaphore(concurrency)
+        self._pending: list[Reminder] = []
+        self._ticker: asyncio.Task | None = None
+        self._batches: set[asyncio.Task] = set()
+
+        # Counters exposed through stats()
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.no_phone = 0
+        self.retried = 0
+        self.dropped = 0
+        self.claimed_elsewhere = 0
+        self.batches = 0
+        self.latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self.last_batch_size = 0
+        self.last_batch_per_second = 0.0
+
+    def submit(self, task_id: int, user_id: int, content: str, due: datetime):
+        self.queued += 1
+        self._enqueue(Reminder(task_id, user_id, content, due))
+
+    def _enqueue(self, reminder: Reminder):
+        self._pending.append(reminder)
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.tick)
+            batch = self._pending[: self.max_batch]
+            self._pending = self._pending[self.max_batch :]
+            task = asyncio.create_task(self._dispatch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _dispatch(self, batch: list[Reminder]):
+        started = time.monotonic()
+        # A catch-up and a regular firing of the same task collapse into one
+        latest: dict[int, Reminder] = {}
+        for reminder in batch:
+            current = latest.get(reminder.task_id)
+            if current is None or reminder.due > current.due:
+                latest[reminder.task_id] = reminder
+        batch = list(latest.values())
+
+        try:
+            won = await db.claim_reminders(
+                [{"task_id": r.task_id, "fire_at": r.due.isoformat()} for r in batch]
+            )
+        except Exception as e:
+            log(
+                "reminders_prepare_failed",
+                logging.ERROR,
+                reminders=len(batch),
+                error=repr(e),
+            )
+            # Nothing is known to be claimed, so there is nothing to release
+            self._retry(batch)
+            return
+        claimed = [r for r in batch if r.task_id in won]
+        self.claimed_elsewhere += len(batch) - len(claimed)
+        for reminder in claimed:
+            reminder.previous = won[reminder.task_id]
+
+        try:
+            phones = await db.get_user_phones([r.user_id for r in claimed])
+        except Exception as e:
+            log(
+                "reminders_prepare_failed",
+                logging.ERROR,
+                reminders=len(claimed),
+                error=repr(e),
+            )
+            await self._release(claimed)
+            return
+
+        sent = await asyncio.gather(
+            *(self._send(r, phones.get(r.user_id)) for r in claimed)
+        )
+        await self._release([r for r, ok in zip(claimed, sent) if not ok])
+
+        self.batches += 1
+        self.last_batch_size = len(claimed)
+        elapsed = time.monotonic() - started
+        self.last_batch_per_second = (
+            round(len(claimed) / elapsed, 1) if elapsed else 0.0
+        )
+
+    async def _send(self, reminder: Reminder, phone: str | None) -> bool:
+        """Whether the reminder is done with: sent, handed to the outbox or unsendable."""
+        if not phone:
+            self.no_phone += 1
+            log("reminder_no_phone", logging.WARNING, user_id=reminder.user_id)
+            return True
+        async with self._sends:
+            try:
+                response = await send_text_message(
+                    phone, reminder.content, priority=REMINDER
+                )
+            except Exception as e:
+                log(
+                    "reminder_failed",
+                    logging.ERROR,
+                    user_id=reminder.user_id,
+                    task_id=reminder.task_id,
+                    error=repr(e),
+                )
+                return False
+        # None: still retrying in the outbox, which now owns the delivery
+        if response is not None and response.is_error:
+            if response.status_code in RETRY_STATUSES:
+                return False
+            # Rejected outright (e.g. a bad number), which a retry won't fix
+            self.failed += 1
+            return True
+
+        self.sent += 1
+        # Time from the slot the reminder was due to the send completing
+        latency = (datetime.now(timezone.utc) - reminder.due).total_seconds() * 1000
+        self.latency_ms += latency
+        self.max_latency_ms = max(self.max_latency_ms, latency)
+        log("reminder_sent", user_id=reminder.user_id, task_id=reminder.task_id)
+        return True
+
+    async def _release(self, reminders: list[Reminder]):
+        """Gives back the claims of reminders that weren't sent, then retries them."""
+        if not reminders:
+            return
+        try:
+            await db.release_reminders(
+                [
+                    {
+                        "task_id": r.task_id,
+                        "fire_at": r.due.isoformat(),
+                        "previous": r.previous,
+                    }
+                    for r in reminders
+                ]
+            )
+        except Exception as e:
+            # The retry's claim then fails, so the reminder counts as sent
+            log(
+                "reminders_release_failed",
+                logging.ERROR,
+                reminders=len(reminders),
+                error=repr(e),
+            )
+        self._retry(reminders)
+
+    def _retry(self, reminders: list[Reminder]):
+        loop = asyncio.get_running_loop()
+        for reminder in reminders:
+            reminder.attempts += 1
+            if reminder.attempts >= self.max_attempts:
+                self.failed += 1
+                self.dropped += 1
+                log(
+                    "reminder_dropped",
+                    logging.ERROR,
+                    user_id=reminder.user_id,
+                    task_id=reminder.task_id,
+                    attempts=reminder.attempts,
+                )
+                continue
+            self.retried += 1
+            delay = self.retry_delay * 2 ** (reminder.attempts - 1)
+            loop.call_later(delay, self._enqueue, reminder)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "in_flight_batches": len(self._batches),
+            "queued": self.queued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "no_phone": self.no_phone,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "claimed_elsewhere": self.claimed_elsewhere,
+            "batches": self.batches,
+            "avg_latency_ms": round(self.latency_ms / self.sent, 1)
+            if self.sent
+            else 0.0,
+            "max_latency_ms": round(self.max_latency_ms, 1),
+            "last_batch_size": self.last_batch_size,
+            "last_batch_per_second": self.last_batch_per_second,
+        }
+
+
+def parse_frequency(freq):
+    freq = float(freq)
+    if freq < 1:
+        hours = int(freq * 24)
+        return {"hours": hours}
+    return {"days": int(freq)}
+
+
+def _parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _last_slot(start: datetime, interval: timedelta, now: datetime) -> datetime | None:
+    """The most recent time at or before `now` the task was due, if any."""
+    if now < start:
+        return None
+    return start + interval * ((now - start) // interval)
+
+
+class ReminderScheduler:
+    """
+    Fires task reminders on their interval, once across all replicas.
+
+    The tasks table is the persistent job store: whichever replica holds the
+    Supabase lease rebuilds every active task into an AsyncIOScheduler and
+    fires them, while the rest stand by to take over if its lease expires.
+    Firings are handed to the ReminderDispatcher, which claims each one by
+    advancing `last_fired_at` to its slot before sending, so a handover
+    can't send the same slot twice.
+
+    Slots missed while no replica was running are coalesced into a single
+    catch-up reminder if the latest one is within `misfire_grace` seconds,
+    and dropped otherwise.
+    """
+
+    def __init__(
+        self,
+        lease_name: str,
+        lease_ttl: float,
+        misfire_grace: float,
+        dispatcher: ReminderDispatcher,
+    ):
+        self.lease_name = lease_name
+        self.lease_ttl = lease_ttl
+        self.misfire_grace = misfire_grace
+        self.dispatcher = dispatcher
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.scheduler = AsyncIOScheduler(
+            timezone=timezone.utc,
+            job_defaults={
+                "coalesce": True,
+                "max_instances": 1,
+                "misfire_grace_time": int(misfire_grace),
+            },
+        )
+        self.is_leader = False
+        # Latest task updated_at the jobs are known to reflect
+        self.synced_through: datetime | None = None
+
+        # Counters exposed through stats()
+        self.fired = 0
+        self.catch_ups = 0
+
+    async def run(self):
+        """Keeps trying to hold the lease; schedules reminders only while it does."""
+        self.scheduler.start(paused=True)
+        while True:
+            try:
+                held = await db.acquire_lease(
+                    self.lease_name, self.holder, self.lease_ttl
+                )
+            except Exception as e:
+                # Without the database no firing can be claimed anyway
+                log("reminder_lease_renew_failed", logging.WARNING, error=repr(e))
+                held = False
+
+            if held and not self.is_leader:
+                await self._lead()
+            elif not held and self.is_leader:
+                self._step_down()
+            await asyncio.sleep(self.lease_ttl / 3)
+
+    async def _lead(self):
+        log("reminder_lease_taken", holder=self.holder)
+        self.is_leader = True
+        try:
+            await self.rebuild()
+        except Exception as e:
+            log("reminder_tasks_load_failed", logging.WARNING, error=repr(e))
+            self._step_down()
+            return
+        self.scheduler.resume()
+
+    def _step_down(self):
+        log("reminder_lease_lost", logging.WARNING, holder=self.holder)
+        self.is_leader = False
+        self.scheduler.pause()
+        self.scheduler.remove_all_jobs()
+
+    async def rebuild(self):
+        """Reschedules every active task from the database."""
+        tasks = await db.list_active_tasks()
+        self.scheduler.remove_all_jobs()
+        self.synced_through = None
+        for task in tasks:
+            self.schedule(task)
+            self.observe(task)
+        log("reminders_scheduled", tasks=len(tasks))
+
+    def observe(self, task: dict):
+        """Advances the watermark of task edits the schedule reflects (see app/task_sync.py)."""
+        changed = task.get("updated_at") or task.get("created_at")
+        if changed:
+            changed = _parse_time(changed)
+            if self.synced_through is None or changed > self.synced_through:
+                self.synced_through = changed
+
+    def schedule(self, task: dict):
+        """Adds or replaces the reminder job for a task row. No-op unless leading."""
+        if not self.is_leader:
+            return
+        task_id = task["id"]
+        interval = timedelta(**parse_frequency(task["freq"]))
+        if interval <= timedelta(0):
+            log(
+                "task_bad_frequency",
+                logging.WARNING,
+                task_id=task_id,
+                freq=task["freq"],
+            )
+            return
+        start = _parse_time(task["created_at"])
+        args = [task_id, task["user_id"], task["content"], start, interval]
+
+        self.scheduler.add_job(
+            self._fire,
+            trigger=IntervalTrigger(start_date=start, seconds=interval.total_seconds()),
+            args=args,
+            id=f"task-{task_id}",
+            replace_existing=True,
+        )
+
+        # Catch up (once) on the latest slot missed while nobody was leading.
+        # The first slot is created_at itself, which isn't a firing: a new
+        # task is first due one interval after it was created
+        now = datetime.now(timezone.utc)
+        slot = _last_slot(start, interval, now)
+        last_fired = task.get("last_fired_at")
+        if (
+            slot is not None
+            and slot > start
+            and (last_fired is None or _parse_time(last_fired) < slot)
+            and (now - slot).total_seconds() <= self.misfire_grace
+        ):
+            self.catch_ups += 1
+            self.scheduler.add_job(
+                self._fire,
+                trigger=DateTrigger(run_date=now),
+                args=args + [slot],
+                id=f"task-{task_id}-catch-up",
+                replace_existing=True,
+            )
+
+    def unschedule(self, task_id: int):
+        for job_id in (f"task-{task_id}", f"task-{task_id}-catch-up"):
+            if self.scheduler.get_job(job_id):
+                self.scheduler.remove_job(job_id)
+
+    async def _fire(
+        self,
+        task_id: int,
+        user_id: int,
+        content: str,
+        start: datetime,
+        interval: timedelta,
+        slot: datetime | None = None,
+    ):
+        if slot is None:
+            slot = _last_slot(start, interval, datetime.now(timezone.utc))
+        self.fired += 1
+        self.dispatcher.submit(task_id, user_id, content, slot)
+
+    async def stop(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await db.release_lease(self.lease_name, self.holder)
+            except Exception as e:
+                log("reminder_lease_release_failed", logging.WARNING, error=repr(e))
+
+    def stats(self) -> dict:
+        return {
+            "holder": self.holder,
+            "leader": self.is_leader,
+            "jobs": len(self.scheduler.get_jobs()) if self.scheduler.running else 0,
+            "fired": self.fired,
+            "catch_ups": self.catch_ups,
+            "dispatcher": self.dispatcher.stats(),
+        }
+
+
+reminders = ReminderScheduler(
+    lease_name="reminders",
+    lease_ttl=config["REMINDER_LEASE_TTL_SECONDS"],
+    misfire_grace=config["REMINDER_MISFIRE_GRACE_SECONDS"],
+    dispatcher=ReminderDispatcher(
+        tick=config["REMINDER_TICK_SECONDS"],
+        concurrency=config["REMINDER_SEND_CONCURRENCY"],
+        max_batch=config["REMINDER_MAX_BATCH"],
+        retry_delay=config["REMINDER_RETRY_DELAY_SECONDS"],
+        max_attempts=config["REMINDER_MAX_ATTEMPTS"],
+    ),
+)
@@ -1,107 +1,163 @@
 import asyncio
 import json
-from datetime import datetime
+import logging
+import time
 from typing import Optional
 
-import httpx
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 from fastapi import FastAPI, Query, Request
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from realtime import AsyncRealtimeClient, RealtimeSubscribeStates
-from supabase import Client, create_client
 
 from app.config import config
+from app.context import context_builder, count_tokens
+from app.db import db
+from app.dedup import dedup
+from app.gateway import gateway
+from app.graph import graph
+from app.health_data import health_data
 from app.llm import generate_llm_response
-from app.log import append_message_log
+from app.mailbox import mailbox
 from app.messages import extract_message_data, send_audio_message, send_text_message
+from app.metrics import PROMETHEUS_CONTENT_TYPE, registry
+from app.nudges import nudges
+from app.outbox import outbox
+from app.response_cache import response_cache
+from app.router import ACK, router
+from app.scheduler import reminders
+from app.shard import shards
 from app.stt import download_whatsapp_audio, transcribe_audio
-from app.tts import generate_voice_with_elevenlabs, upload_audio_to_whatsapp
+from app.task_sync import task_sync
+from app.topic import topics
+from app.tracing import (
+    STAGE_LATENCY,
+    log,
+    loop_monitor,
+    span,
+    structured_log,
+    traced_turn,
+)
+from app.tts import speech, upload_voice_reply
+from app.workers import worker_pool
 
-# Initialize Supabase client
 supabase_url = config["SUPABASE_URL"]
 supabase_key = config["SUPABASE_KEY"]
-supabase: Client = create_client(supabase_url, supabase_key)
-
-# Initialize scheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
 
 app = FastAPI()
 
-# --- Scheduling Logic from action_server.py ---
-
 
-async def reminder_job(user_id, description):
-    try:
-        user = supabase.table("users").select("phone").eq("id", user_id).execute().data
-        if user:
-            phone_number = user[0]["phone"]
-            send_text_message(phone_number, description)
-            print(f"Sent reminder to {phone_number} for task.")
-        else:
-            print(f"Error: Could not find user with ID {user_id} to send reminder.")
-    except Exception as e:
-        print(f"Error sending reminder for user {user_id}: {e}")
-
-
-def parse_frequency(freq):
-    freq = float(freq)
-    if freq < 1:
-        hours = int(freq * 24)
-        return {"hours": hours}
-    return {"days": int(freq)}
-
-
-def schedule_task(task):
-    task_id = task["id"]
-    user_id = task["user_id"]  # Get user_id from the task
-    created_at = task["created_at"]
-    frequency = task["freq"]
-    content = task["content"]
-    start_time = datetime.fromisoformat(created_at)
-
-    scheduler.add_job(
-        reminder_job,
-        trigger=IntervalTrigger(start_date=start_time, **parse_frequency(frequency)),
-        args=[user_id, content],  # Pass user_id to the job
-        id=f"task-{task_id}",
-        replace_existing=True,
-    )
-    print(f"Scheduled task #{task_id} for user #{user_id} at {start_time}")
+# --- Supabase Listener Logic ---
 
 
-# --- Supabase Listener Logic ---
+realtime_socket: AsyncRealtimeClient | None = None
 
 
 async def run_supabase_listener():
+    """
+    Subscribes to the table changes this process reacts to. The realtime
+    client keeps the websocket (and its reconnects) running in its own tasks.
+    """
+    global realtime_socket
     ws_url = f"wss://{supabase_url.replace('https://', '')}/realtime/v1"
-    socket = AsyncRealtimeClient(ws_url, supabase_key)
-    channel = socket.channel("test-channel")
+    realtime_socket = AsyncRealtimeClient(ws_url, supabase_key)
+    channel = realtime_socket.channel("aura-changes")
 
     def on_subscribe(status: RealtimeSubscribeStates, err: Optional[Exception]):
         if status == RealtimeSubscribeStates.SUBSCRIBED:
-            print("Successfully subscribed to Supabase Realtime!")
+            log("realtime_subscribed")
+            task_sync.on_subscribed()
         else:
-            print(f"Error subscribing to Supabase Realtime: {err}")
+            log(
+                "realtime_subscribe_failed",
+                logging.ERROR,
+                status=status,
+                error=repr(err),
+            )
 
-    def on_new_task(payload):
-        new_record = payload["data"]["record"]
-        print(f"New task received from Supabase: {new_record['id']}")
-        schedule_task(new_record)
+    # Reminder jobs follow inserts, edits and deletes on tasks
+    task_sync.attach(channel)
 
-    channel.on_postgres_changes(
-        "INSERT", schema="public", table="task", callback=on_new_task
-    )
-    await channel.subscribe(on_subscribe)
+    # Every shard has its own user/conversation cache, so changes are
+    # applied here and relayed to the other shards
+    def on_cache_change(payload):
+        apply_cache_change(payload["data"])
+        shards.broadcast("/shard/cache-change", payload["data"])
 
-    while True:
-        await asyncio.sleep(1)
+    for event in ("UPDATE", "DELETE"):
+        channel.on_postgres_changes(
+            event, schema="public", table="users", callback=on_cache_change
+        )
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        channel.on_postgres_changes(
+            event, schema="public", table="conversations", callback=on_cache_change
+        )
+    try:
+        await channel.subscribe(on_subscribe)
+    except Exception as e:
+        log("realtime_connect_failed", logging.ERROR, error=repr(e))
+
+
+def apply_cache_change(data: dict):
+    """
+    Keeps the repository's user/conversation cache in sync with a change made
+    outside this process (dashboard edits, other replicas).
+    """
+    record = data.get("record")
+    if data.get("table") == "users":
+        record = record or data.get("old_record")
+        if record and "id" in record:
+            db.cache.invalidate_user(record["id"])
+        return
+
+    if data.get("type") == "INSERT":
+        if record and record.get("status") == "open":
+            db.cache.add_conversation(record["user_id"], record)
+        return
+    if record and record.get("status") == "open":
+        # Topic or summary edits are applied in place
+        db.cache.update_conversation(record["user_id"], record)
+        return
+    record = record or data.get("old_record")
+    if record and "id" in record:
+        db.cache.invalidate_conversation(record["id"], record.get("user_id"))
 
 
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(run_supabase_listener())
+    structured_log.start()
+    loop_monitor.start()
+    mailbox.set_handler(process_turn)
+    # Load the tokenizer off the event loop before the first turn needs it
+    await asyncio.to_thread(count_tokens, "")
+    await asyncio.to_thread(speech.cache.load)
+    await asyncio.to_thread(health_data.load)
+    await db.connect()
+    await graph.start()
+    await worker_pool.start()
+    await outbox.start()
+    await shards.start()
+    # With several shards (see app/cluster.py) only the primary runs the
+    # process-wide singletons
+    if shards.is_primary:
+        if config["SUPABASE_REALTIME"]:
+            asyncio.create_task(run_supabase_listener())
+        asyncio.create_task(reminders.run())
+        nudges.start()
+        asyncio.create_task(dedup.run_purge_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if realtime_socket is not None:
+        await realtime_socket.close()
+    await reminders.stop()
+    await nudges.stop()
+    await worker_pool.stop()
+    await outbox.stop()
+    await shards.close()
+    await graph.close()
+    await db.close()
+    await loop_monitor.stop()
+    structured_log.stop()
 
 
 # --- FastAPI Endpoints ---
@@ -112,203 +168,298 @@ async def health_check():
     return {"status": "all systems operational"}
 
 
+# Component counters, read from their stats when /metrics is scraped
+registry.collect(
+    "counter", "aura_db_requests_total", "Supabase requests", lambda: db.requests
+)
+registry.collect(
+    "counter", "aura_graph_requests_total", "Graph API requests", lambda: graph.requests
+)
+registry.collect(
+    "counter", "aura_graph_retries_total", "Graph API retries", lambda: graph.retries
+)
+registry.collect(
+    "gauge",
+    "aura_mailbox_pending",
+    "Messages waiting in sender mailboxes",
+    lambda: mailbox.stats()["pending"],
+)
+registry.collect(
+    "gauge",
+    "aura_worker_queue_depth",
+    "Batches queued for the worker pool",
+    lambda: worker_pool.queue.qsize(),
+)
+registry.collect(
+    "gauge",
+    "aura_worker_in_flight",
+    "Batches being processed",
+    lambda: worker_pool.in_flight,
+)
+registry.collect(
+    "gauge",
+    "aura_outbox_queued",
+    "Outbound messages queued, by lane",
+    lambda: outbox.stats()["queued"],
+    label="lane",
+)
+registry.collect(
+    "counter",
+    "aura_outbox_responses_total",
+    "Graph responses to outbound messages, by status",
+    lambda: outbox.statuses,
+    label="status",
+)
+registry.collect(
+    "counter",
+    "aura_turns_total",
+    "Turns by route",
+    lambda: router.counts,
+    label="route",
+)
+registry.collect(
+    "counter",
+    "aura_nudges_total",
+    "Nudges queued, by reason",
+    lambda: nudges.reasons,
+    label="reason",
+)
+registry.collect(
+    "counter", "aura_llm_retries_total", "OpenAI retries", lambda: gateway.retries
+)
+registry.collect(
+    "counter",
+    "aura_llm_timeouts_total",
+    "OpenAI deadlines hit",
+    lambda: gateway.timeouts,
+)
+registry.collect(
+    "counter",
+    "aura_llm_fallbacks_total",
+    "Calls switched to the fallback model",
+    lambda: gateway.fallbacks,
+)
+registry.collect(
+    "gauge", "aura_llm_in_flight", "OpenAI calls open", lambda: gateway.in_flight
+)
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "webhook_mode": config["WEBHOOK_MODE"],
+        "context": context_builder.stats(),
+        "db": db.stats(),
+        "dedup": dedup.stats(),
+        "event_loop": loop_monitor.stats(),
+        "graph": graph.stats(),
+        "health_data": health_data.stats(),
+        "llm": gateway.stats(),
+        "mailbox": mailbox.stats(),
+        "nudges": nudges.stats(),
+        "outbox": outbox.stats(),
+        "reminders": reminders.stats(),
+        "response_cache": response_cache.stats(),
+        "router": router.stats(),
+        "shard": shards.stats(),
+        "stages": STAGE_LATENCY.snapshot(),
+        "task_sync": task_sync.stats(),
+        "topics": topics.stats(),
+        "tts": speech.stats(),
+        "worker_pool": worker_pool.stats(),
+    }
+
+
 @app.post("/send-onboarding-message")
 async def send_onboarding_message(to_number: str):
-    # ... (existing code remains the same)
-    url = f"https://graph.facebook.com/v22.0/{config['PHONE_NUMBER_ID']}/messages"
-    headers = {
-        "Authorization": f"Bearer {config['WHATSAPP_TOKEN']}",
-        "Content-Type": "application/json",
-    }
     payload = {
         "messaging_product": "whatsapp",
         "to": to_number,
         "type": "template",
         "template": {"name": "aura_welcome", "language": {"code": "en"}},
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=payload)
-    print("📤 Onboarding status:", response.status_code)
+    response = await outbox.send(payload)
+    log("onboarding_sent", status=response.status_code)
     return JSONResponse(status_code=response.status_code, content=response.json())
 
 
 @app.post("/webhook")
 async def whatsapp_webhook(request: Request):
     body = await request.json()
-    print("📦 Incoming webhook payload:", body)
     message_data = extract_message_data(body)
+    log(
+        "webhook",
+        logging.DEBUG,
+        message_id=message_data.get("message_id"),
+        type=message_data.get("type"),
+    )
 
     if not message_data:
         return {"status": "ignored (no message data)"}
 
-    if message_data.get("audio_id"):
-        audio_path = download_whatsapp_audio(message_data["audio_id"])
-        user_text = transcribe_audio(audio_path)
-    elif message_data.get("text"):
-        user_text = message_data["text"]
-    else:
+    if not (message_data.get("audio_id") or message_data.get("text")):
         return {"status": "ignored (no valid input)"}
 
-    # --- Log User Message to Supabase ---
-    try:
-        user_res = (
-            supabase.table("users")
-            .select("id")
-            .eq("phone", message_data["sender_wa_id"])
-            .execute()
-        )
-        if not user_res.data:
-            # This is a new user, create them first
-            new_user_res = (
-                supabase.table("users")
-                .insert(
-                    {
-                        "phone": message_data["sender_wa_id"],
-                        "name": message_data["sender_name"],
-                    }
-                )
-                .execute()
-            )
-            user_id = new_user_res.data[0]["id"]
-        else:
-            user_id = user_res.data[0]["id"]
-
-        # Step 1: Log user message to temporary conversation first
-        # Use existing open conversation or create a temporary one
-        temp_conversation_res = (
-            supabase.table("conversations")
-            .select("id, topic")
-            .eq("user_id", user_id)
-            .eq("status", "open")
-            .order("started_at", desc=True)
-            .limit(1)
-            .execute()
-        )
+    # Each sender is handled by one shard, which keeps their turns in order
+    # and their caches (dedup included) in one process
+    if shards.is_internal(request.scope):
+        shards.received += 1
+    else:
+        owner = shards.owner(message_data["sender_wa_id"])
+        if owner != shards.index:
+            return await forward_webhook(owner, await request.body())
 
-        # Use existing or create temp conversation
-        if temp_conversation_res.data:
-            temp_conversation_id = temp_conversation_res.data[0]["id"]
-        else:
-            # Create temporary conversation
-            temp_conversation = (
-                supabase.table("conversations")
-                .insert(
-                    {
-                        "user_id": user_id,
-                        "topic": "General",
-                        "status": "open",
-                    }
-                )
-                .execute()
-            )
-            temp_conversation_id = temp_conversation.data[0]["id"]
+    # Redeliveries stop here, before any transcription or LLM call
+    if not await dedup.claim(message_data.get("message_id")):
+        return {"status": "ignored (duplicate)"}
 
-        # Log user message to get it in history
-        temp_log_entry = {
-            "user_id": user_id,
-            "conversation_id": temp_conversation_id,
-            "role": "user",
-            "content": user_text,
-            "message_type": "audio" if message_data.get("audio_id") else "text",
-            "audio_id": message_data.get("audio_id"),
-            "message_id": message_data.get("message_id"),
-        }
-        append_message_log(temp_log_entry)
-        print("📥 Temp logged user message")
+    if config["WEBHOOK_MODE"] == "inline":
+        return await process_turn([message_data])
 
-    except Exception as e:
-        print(f"Error handling user message logging: {e}")
-        return {"status": "error logging message"}
+    # Ack right away so Meta doesn't retry; the sender's mailbox batches the
+    # message and the worker pool does the heavy lifting
+    if not mailbox.post(message_data["sender_wa_id"], message_data):
+        log("mailbox_full", logging.WARNING)
+        await dedup.release(message_data.get("message_id"))
+        return JSONResponse(status_code=503, content={"status": "busy"})
+
+    return {"status": "queued"}
 
-    # Step 2: Generate LLM response with current message in history
-    print("🧠 Generating LLM response for user:", user_id)
-    llm_response = await generate_llm_response(user_id)
-    current_topic = llm_response.get("topic", "General")
 
-    # Step 3: Determine final conversation based on topic
+async def forward_webhook(shard: int, body: bytes):
     try:
-        final_conversation_id = None
-        topic_switched = False
-
-        # Get all open conversations to check topics
-        all_conversations_res = (
-            supabase.table("conversations")
-            .select("id, topic")
-            .eq("user_id", user_id)
-            .eq("status", "open")
-            .execute()
-        )
+        response = await shards.forward(shard, "/webhook", body)
+    except Exception as e:
+        # Meta retries the delivery, by which time the shard is likely back
+        log("forward_failed", logging.WARNING, shard=shard, error=repr(e))
+        return JSONResponse(status_code=503, content={"status": "busy"})
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type"),
+    )
 
-        # Look for existing conversation with same topic
-        for conv in all_conversations_res.data:
-            if conv.get("topic") == current_topic:
-                final_conversation_id = conv["id"]
-                print(
-                    f"📝 Found existing conversation #{final_conversation_id} for topic: {current_topic}"
-                )
-                break
 
-        # If no conversation exists for this topic, create one
-        if not final_conversation_id:
-            # Check if we're switching from a different topic
-            if (
-                temp_conversation_res.data
-                and temp_conversation_res.data[0].get("topic") != current_topic
-            ):
-                topic_switched = True
-                old_topic = temp_conversation_res.data[0].get("topic")
-                print(f"🔄 Topic switched from '{old_topic}' to '{current_topic}'")
-
-            new_conversation = (
-                supabase.table("conversations")
-                .insert(
-                    {
-                        "user_id": user_id,
-                        "topic": current_topic,
-                        "status": "open",
-                    }
-                )
-                .execute()
-            )
-            final_conversation_id = new_conversation.data[0]["id"]
-            print(
-                f"📝 Created new conversation #{final_conversation_id} for topic: {current_topic}"
+@app.post("/shard/cache-change")
+async def shard_cache_change(request: Request):
+    """Cache changes relayed by the primary shard's Realtime listener."""
+    if not shards.is_internal(request.scope):
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    apply_cache_change(await request.json())
+    return {"status": "applied"}
+
+
+async def process_turn(batch: list[dict]) -> dict:
+    """
+    Runs the full pipeline for one turn: a burst of messages from the same
+    sender is transcribed and logged, then answered with a single LLM reply.
+    """
+    # The first message's WhatsApp id ties every span and log line of the turn together
+    with (
+        traced_turn(batch[0].get("message_id")) as trace,
+        db.track_round_trips() as trips,
+    ):
+        result = None
+        try:
+            with span("turn"):
+                result = await _run_turn(batch)
+        finally:
+            log(
+                "turn",
+                messages=len(batch),
+                status=(result or {}).get("status", "failed"),
+                round_trips=trips.count,
+                spans=trace.spans,
             )
+    return result
 
-        # Step 4: Move message to correct conversation if needed
-        if final_conversation_id != temp_conversation_id:
-            supabase.table("messages").update(
-                {"conversation_id": final_conversation_id}
-            ).eq("id", temp_log_entry.get("id") or temp_conversation_id).execute()
-            print(f"📝 Moved message to correct conversation #{final_conversation_id}")
-
-        # Step 5: Update topic of conversation if it was temporary
-        if (
-            temp_conversation_res.data
-            and temp_conversation_res.data[0].get("topic") == "General"
-            and current_topic != "General"
-        ):
-            supabase.table("conversations").update({"topic": current_topic}).eq(
-                "id", final_conversation_id
-            ).execute()
-            print(f"📝 Updated conversation topic to: {current_topic}")
 
-        conversation_id = final_conversation_id
+async def _run_turn(batch: list[dict]) -> dict:
+    message_data = batch[-1]  # the latest message decides the reply format
 
+    user_texts = []
+    for item in batch:
+        if item.get("audio_id"):
+            async with download_whatsapp_audio(item["audio_id"]) as audio:
+                user_texts.append(await transcribe_audio(audio))
+        else:
+            user_texts.append(item["text"])
+
+    # --- Step 1: Log user messages to their open (or a new temporary) conversation ---
+    user_log_entries = [
+        {
+            "role": "user",
+            "message": user_text,
+            "message_type": "audio" if item.get("audio_id") else "text",
+            "audio_id": item.get("audio_id"),
+            "message_id": item.get("message_id"),
+        }
+        for item, user_text in zip(batch, user_texts)
+    ]
+    try:
+        turn = await db.begin_turn(
+            message_data["sender_wa_id"],
+            message_data["sender_name"],
+            user_log_entries,
+            history_limit=20,
+        )
     except Exception as e:
-        print(f"Error managing conversations: {e}")
-        conversation_id = temp_conversation_id
-        topic_switched = False
+        log("begin_turn_failed", logging.ERROR, error=repr(e))
+        return {"status": "error logging message"}
+
+    user = turn["user"]
+    user_id = user["id"]
+    temp_conversation = turn["conversation"]
+    log(
+        "turn_logged", logging.DEBUG, user_id=user_id, messages=len(turn["message_ids"])
+    )
 
+    # --- Step 2: Generate LLM response with the current messages in history ---
+    # Voice replies start synthesizing on the first sentence while the LLM streams
+    voice = speech.stream() if message_data.get("audio_id") else None
+    # Acknowledgements get a template reply and obvious task requests the cheaper model
+    last_reply = next(
+        (m["message"] for m in reversed(turn["history"]) if m["role"] == "assistant"),
+        None,
+    )
+    route = router.classify(user_texts, last_reply=last_reply)
+    started = time.monotonic()
+    if route == ACK:
+        llm_response = {"reply": router.template(user_texts), "tool_call": None}
+        current_topic = temp_conversation.get("topic") or "General"
+    else:
+        # The topic is picked alongside the reply rather than by the reply's model
+        topic_task = asyncio.create_task(
+            topics.classify(user_id, temp_conversation, user_texts)
+        )
+        try:
+            with span("llm", route=route):
+                llm_response = await generate_llm_response(
+                    user_id,
+                    history=turn["history"],
+                    conversation=temp_conversation,
+                    on_text=voice.feed if voice else None,
+                    route=route,
+                    texts=user_texts,
+                    health_user_id=user.get("health_user_id"),
+                )
+        except Exception:
+            topic_task.cancel()
+            if voice:
+                voice.cancel()
+            raise
+        current_topic = await topic_task
+    router.record(route, (time.monotonic() - started) * 1000)
+    log("routed", logging.DEBUG, user_id=user_id, route=route)
     reply = llm_response["reply"]
     tool_call = llm_response["tool_call"]
 
-    # Add debug message for topic switching
-    if topic_switched:
-        debug_message = f"🔄 Switching to {current_topic} topic"
-        send_text_message(message_data["sender_wa_id"], debug_message)
-
-    # --- Background Action Execution ---
+    new_task_data = None
     if tool_call:
         function_name = tool_call.function.name
         arguments = json.loads(tool_call.function.arguments)
@@ -317,53 +468,70 @@ async def whatsapp_webhook(request: Request):
         if content and (
             function_name == "create_reminder" or function_name == "create_goal"
         ):
-            print(f"Executing tool: {function_name} with content: {content}")
-
-            try:
-                user_res = (
-                    supabase.table("users").select("*").eq("id", user_id).execute()
-                )
-                if not user_res.data:
-                    raise Exception(f"User not found with id {user_id}")
-                user = user_res.data[0]
-
-                task_type = "Reminder" if function_name == "create_reminder" else "Goal"
-
-                new_task_data = {
-                    "user_id": user["id"],
-                    "conversation_id": conversation_id,
-                    "type": task_type,
-                    "active": True,
-                    "freq": 2 if user.get("personality") == "anxious" else 0.5,
-                    "content": content,
-                }
-
-                res = supabase.table("tasks").insert(new_task_data).execute()
-                print("Task creation response:", res.data)
-
-            except Exception as e:
-                print(f"Error executing tool {function_name}: {e}")
-
-    # --- Log Assistant Response ---
+            log("tool_call", logging.DEBUG, user_id=user_id, tool=function_name)
+            new_task_data = {
+                "type": "Reminder" if function_name == "create_reminder" else "Goal",
+                "active": True,
+                "freq": 2 if user.get("personality") == "anxious" else 0.5,
+                "content": content,
+            }
+
+    # --- Step 3: File the turn under the topic's conversation, store reply and task ---
     assistant_log_entry = {
-        "user_id": user_id,
-        "conversation_id": conversation_id,
         "role": "assistant",
         "message": reply,
         "message_type": "text",
     }
-    append_message_log(assistant_log_entry)
-    print("🧠 Logged assistant response:", assistant_log_entry)
+    topic_switched = False
+    try:
+        result = await db.finish_turn(
+            user_id,
+            temp_conversation["id"],
+            turn["message_ids"],
+            current_topic,
+            assistant_log_entry,
+            task=new_task_data,
+            current_topic=temp_conversation.get("topic"),
+        )
+        conversation_id = result["conversation_id"]
+        if result["created_conversation"]:
+            log(
+                "conversation_created",
+                user_id=user_id,
+                conversation_id=conversation_id,
+                topic=current_topic,
+            )
+            # Check if we're switching from a different topic
+            if (
+                turn["existing_conversation"]
+                and temp_conversation.get("topic") != current_topic
+            ):
+                topic_switched = True
+                old_topic = temp_conversation.get("topic")
+                log(
+                    "topic_switched",
+                    user_id=user_id,
+                    previous=old_topic,
+                    topic=current_topic,
+                )
+        if result.get("task"):
+            log("task_created", user_id=user_id, task_id=result["task"]["id"])
+
+    except Exception as e:
+        log("finish_turn_failed", logging.ERROR, user_id=user_id, error=repr(e))
+
+    # Add debug message for topic switching
+    if topic_switched:
+        debug_message = f"🔄 Switching to {current_topic} topic"
+        await send_text_message(message_data["sender_wa_id"], debug_message)
 
     # --- Send Reply to User ---
     if message_data.get("text"):
-        send_text_message(message_data["sender_wa_id"], reply)
+        await send_text_message(message_data["sender_wa_id"], reply)
     if message_data.get("audio_id"):
-        voice_path = generate_voice_with_elevenlabs(reply)
-        media_id = upload_audio_to_whatsapp(voice_path)
-        send_audio_message(message_data["sender_wa_id"], media_id)
+        media_id = await upload_voice_reply(voice, reply)
+        await send_audio_message(message_data["sender_wa_id"], media_id)
 
-    print("📤 Reply sent to user:", message_data["sender_wa_id"])
     return {"status": "received"}
 
 
@@ -383,39 +551,28 @@ def verify_webhook(
 
 
 @app.post("/users")
-def create_user(request: Request):
-    data = request.json()
-    res = (
-        supabase.table("users")
-        .insert({"phone": data["phone"], "name": data["name"]})
-        .execute()
-    )
-    return JSONResponse(content=res.data, status_code=201)
+async def create_user(request: Request):
+    data = await request.json()
+    user = await db.create_user({"phone": data["phone"], "name": data["name"]})
+    return JSONResponse(content=[user], status_code=201)
 
 
 @app.get("/users/{user_id}")
-def get_user(user_id: int):
-    res = supabase.table("users").select("*").eq("id", user_id).execute().data
-    return JSONResponse(content=res, status_code=200)
+async def get_user(user_id: int):
+    user = await db.get_user(user_id)
+    return JSONResponse(content=[user] if user else [], status_code=200)
 
 
 @app.put("/users/{user_id}")
-def update_user(user_id: int, request: Request):
-    data = request.json()
-    res = supabase.table("users").update(data).eq("id", user_id).execute().data
+async def update_user(user_id: int, request: Request):
+    data = await request.json()
+    res = await db.update_user(user_id, data)
     return JSONResponse(content=res, status_code=200)
 
 
 @app.get("/tasks/{user_id}")
-def get_tasks(user_id: int):
-    res = (
-        supabase.table("tasks")
-        .select("*")
-        .eq("user_id", user_id)
-        .eq("active", True)
-        .execute()
-        .data
-    )
+async def get_tasks(user_id: int):
+    res = await db.active_tasks(user_id)
     return JSONResponse(content=res, status_code=200)
 
 
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import logging
+from bisect import bisect
+
+import httpx
+
+from app.config import config
+from app.tracing import log
+
+
+def _point(key: str) -> int:
+    # A stable digest rather than hash(), which is salted per process
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto `shards` shards. Each shard owns
+    `vnodes` points on the ring, so keys spread evenly and changing the
+    shard count only moves about 1/shards of them.
+    """
+
+    def __init__(self, shards: int, vnodes: int):
+        ring = sorted(
+            (_point(f"shard-{shard}-{vnode}"), shard)
+            for shard in range(shards)
+            for vnode in range(vnodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._shards = [shard for _, shard in ring]
+
+    def owner(self, key: str | int) -> int:
+        at = bisect(self._points, _point(str(key))) % len(self._points)
+        return self._shards[at]
+
+
+class ShardRouter:
+    """
+    Sender affinity across the worker processes started by app/cluster.py.
+
+    Every process accepts webhooks on the shared public port, but a sender
+    (by WhatsApp id) belongs to exactly one shard: its turns run there in
+    mailbox order, against that process's warm user, history and dedup
+    caches. Webhooks that land on another shard are forwarded to the owner
+    over its private port (host:base_port+index), which only the cluster
+    uses. Shard 0 is the primary and runs the process-wide singletons (the
+    Realtime listener, the reminder scheduler, nudges), relaying cache
+    invalidations to the others.
+
+    With count=1 (plain `uvicorn app.service:app`) everything is local.
+    """
+
+    def __init__(
+        self,
+        index: int,
+        count: int,
+        host: str,
+        base_port: int,
+        vnodes: int,
+        timeout: float,
+    ):
+        self.index = index
+        self.count = count
+        self.host = host
+        self.base_port = base_port
+        self.timeout = timeout
+        self.ring = HashRing(count, vnodes)
+        self._client: httpx.AsyncClient | None = None
+        self._background: set[asyncio.Task] = set()
+
+        # Counters exposed through stats()
+        self.forwarded = 0
+        self.forward_errors = 0
+        self.received = 0
+        self.broadcasts = 0
+        self.broadcast_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 1
+
+    @property
+    def is_primary(self) -> bool:
+        return self.index == 0
+
+    def owner(self, key: str | int) -> int:
+        return self.ring.owner(key) if self.enabled else self.index
+
+    def port(self, shard: int) -> int:
+        return self.base_port + shard
+
+    def is_internal(self, scope: dict) -> bool:
+        """Whether a request came in on this shard's private port, i.e. from a peer."""
+        server = scope.get("server")
+        return self.enabled and bool(server) and server[1] == self.port(self.index)
+
+    async def start(self):
+        if self.enabled and self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=2.0),
+                limits=httpx.Limits(
+                    max_keepalive_connections=50, keepalive_expiry=60.0
+                ),
+            )
+
+    async def close(self):
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def forward(self, shard: int, path: str, body: bytes) -> httpx.Response:
+        """Replays a JSON request on another shard and returns its response."""
+        try:
+            response = await self._client.post(
+                f"http://{self.host}:{self.port(shard)}{path}",
+                content=body,
+                headers={"Content-Type": "application/json"},
+            )
+        except httpx.HTTPError:
+            self.forward_errors += 1
+            raise
+        self.forwarded += 1
+        return response
+
+    def broadcast(self, path: str, payload: dict):
+        """Posts `payload` to every other shard in the background."""
+        if not self.enabled:
+            return
+        self.broadcasts += 1
+        for shard in range(self.count):
+            if shard != self.index:
+                task = asyncio.create_task(self._post(shard, path, payload))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+
+    async def _post(self, shard: int, path: str, payload: dict):
+        try:
+            response = await self._client.post(
+                f"http://{self.host}:{self.port(shard)}{path}", json=payload
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.broadcast_errors += 1
+            log(
+                "broadcast_failed",
+                logging.WARNING,
+                shard=shard,
+                path=path,
+                error=repr(e),
+            )
+
+    def stats(self) -> dict:
+        return {
+            "index": self.index,
+            "count": self.count,
+            "primary": self.is_primary,
+            "forwarded": self.forwarded,
+            "forward_errors": self.forward_errors,
+            "received": self.received,
+            "broadcasts": self.broadcasts,
+            "broadcast_errors": self.broadcast_errors,
+        }
+
+
+shards = ShardRouter(
+    index=config["SHARD_INDEX"],
+    count=config["SHARD_COUNT"],
+    host=config["SHARD_HOST"],
+    base_port=config["SHARD_BASE_PORT"],
+    vnodes=config["SHARD_VNODES"],
+    timeout=config["SHARD_FORWARD_TIMEOUT"],
+)
@@ -1,42 +1,48 @@
 import tempfile
+from contextlib import asynccontextmanager
+from typing import IO, AsyncIterator
 
-import requests
-from elevenlabs.client import ElevenLabs
+from elevenlabs.client import AsyncElevenLabs
 
 from app.config import config
+from app.graph import graph
+from app.tracing import span
 
-elevenlabs_stt = ElevenLabs(api_key=config["ELEVENLABS_KEY"])
+elevenlabs_stt = AsyncElevenLabs(
+    api_key=config["ELEVENLABS_KEY"], base_url=config["ELEVENLABS_BASE_URL"]
+)
 
 
-def download_whatsapp_audio(media_id: str) -> str:
+@asynccontextmanager
+async def download_whatsapp_audio(media_id: str) -> AsyncIterator[IO[bytes]]:
     """
-    Download WhatsApp voice message by media ID and save it to a temp file.
-    Returns path to the downloaded file.
+    Download WhatsApp voice message by media ID into a buffer that stays in
+    memory up to AUDIO_SPOOL_MAX_BYTES and spills to disk above it. The
+    buffer is closed (and any spill file deleted) when the block exits.
     """
-    # Step 1: Get the media download URL
-    url = f"https://graph.facebook.com/v22.0/{media_id}"
-    headers = {"Authorization": f"Bearer {config['WHATSAPP_TOKEN']}"}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    download_url = response.json().get("url")
-
-    # Step 2: Download the media bytes
-    audio_response = requests.get(download_url, headers=headers, stream=True)
-    audio_response.raise_for_status()
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as tmp:
-        for chunk in audio_response.iter_content(chunk_size=8192):
-            tmp.write(chunk)
-        return tmp.name
-
-
-def transcribe_audio(file_path: str) -> str:
+    with tempfile.SpooledTemporaryFile(
+        max_size=config["AUDIO_SPOOL_MAX_BYTES"], suffix=".ogg"
+    ) as audio:
+        with span("download"):
+            # Step 1: Get the media download URL
+            response = await graph.get(f"/{media_id}")
+            response.raise_for_status()
+            download_url = response.json().get("url")
+
+            # Step 2: Stream the media bytes into the buffer
+            await graph.download(download_url, audio)
+            audio.seek(0)
+        yield audio
+
+
+async def transcribe_audio(audio: IO[bytes]) -> str:
     """
-    Transcribe an audio file using ElevenLabs Speech-to-Text.
+    Transcribe audio using ElevenLabs Speech-to-Text. The buffer is streamed
+    into the multipart request as-is.
     """
-    with open(file_path, "rb") as audio_file:
-        result = elevenlabs_stt.speech_to_text.convert(
-            file=audio_file,
+    with span("stt"):
+        result = await elevenlabs_stt.speech_to_text.convert(
+            file=("voice.ogg", audio, "audio/ogg"),
             model_id="scribe_v1",  # Required
             language_code="eng",  # Optional: change or set to None for auto-detect
             tag_audio_events=False,  # Optional
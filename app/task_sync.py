@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from realtime import AsyncRealtimeChannel
+
+from app.db import db
+from app.scheduler import ReminderScheduler, reminders
+from app.tracing import log
+
+
+class TaskSync:
+    """
+    Keeps the reminder scheduler in step with the `tasks` table. Realtime
+    INSERT/UPDATE/DELETE events add, reschedule or remove jobs as they
+    happen; after the channel rejoins following a disconnect, only tasks
+    whose `updated_at` is past the scheduler's watermark are fetched and
+    applied, rather than reloading every task.
+    """
+
+    def __init__(self, scheduler: ReminderScheduler, overlap: float = 5.0):
+        self.scheduler = scheduler
+        # Re-read a few seconds before the watermark to absorb clock skew and
+        # transactions that committed out of order
+        self.overlap = timedelta(seconds=overlap)
+        self._subscribed_once = False
+        self._catch_up: asyncio.Task | None = None
+
+        # Counters exposed through stats()
+        self.events = 0
+        self.catch_ups = 0
+        self.caught_up = 0
+        self.errors = 0
+
+    def attach(self, channel: AsyncRealtimeChannel):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            channel.on_postgres_changes(
+                event, schema="public", table="tasks", callback=self.on_change
+            )
+
+    def on_change(self, payload):
+        self.events += 1
+        data = payload["data"]
+        if data.get("type") == "DELETE":
+            old = data.get("old_record") or {}
+            if "id" in old:
+                log("task_deleted", task_id=old["id"])
+                self.scheduler.unschedule(old["id"])
+            return
+        record = data.get("record")
+        if record:
+            log("task_changed", task_id=record["id"])
+            self.apply(record)
+
+    def apply(self, task: dict):
+        if task.get("active"):
+            self.scheduler.schedule(task)
+        else:
+            self.scheduler.unschedule(task["id"])
+        self.scheduler.observe(task)
+
+    def on_subscribed(self):
+        """Called on every (re)subscribe; the first one is covered by the leader's rebuild."""
+        if not self._subscribed_once:
+            self._subscribed_once = True
+            return
+        if self._catch_up is None or self._catch_up.done():
+            self._catch_up = asyncio.create_task(self.catch_up())
+
+    async def catch_up(self):
+        """Applies task changes made after the watermark, e.g. while disconnected."""
+        since = self.scheduler.synced_through
+        if not self.scheduler.is_leader or since is None:
+            # A new leader rebuilds everything anyway
+            return
+        try:
+            tasks = await db.tasks_changed_since((since - self.overlap).isoformat())
+        except Exception as e:
+            self.errors += 1
+            log("task_catch_up_failed", logging.WARNING, error=repr(e))
+            return
+        for task in tasks:
+            self.apply(task)
+        self.catch_ups += 1
+        self.caught_up += len(tasks)
+        log("task_caught_up", tasks=len(tasks), since=since.isoformat())
+
+    def stats(self) -> dict:
+        synced = self.scheduler.synced_through
+        return {
+            "events": self.events,
+            "catch_ups": self.catch_ups,
+            "caught_up": self.caught_up,
+            "errors": self.errors,
+            "synced_through": synced.isoformat() if synced else None,
+        }
+
+
+task_sync = TaskSync(reminders)
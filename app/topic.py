@@ -0,0 +1,153 @@
+import logging
+
+from app.config import config
+from app.db import db
+from app.embeddings import Embedder, cosine, embedder
+from app.gateway import gateway
+from app.tracing import log, span
+
+DEFAULT_TOPIC = "General"
+
+# Broad life domains every user can switch to, described for the embedding
+TOPIC_DESCRIPTIONS = {
+    "General": "Greetings, small talk and everyday chit-chat",
+    "Work": "Work, career, job, meetings, projects, colleagues and deadlines",
+    "Health": "Health, fitness, exercise, sleep, diet, medication and wellbeing",
+    "Personal": "Personal life, family, friends, relationships, hobbies and home",
+    "Finance": "Money, finances, budgeting, saving, bills, spending and investing",
+}
+
+TOPIC_PROMPT = (
+    "You file messages sent to a personal assistant under a broad topic. "
+    "Given the conversation's current topic, the user's other topics and the "
+    "new message, answer with the topic the message belongs to: the current "
+    "one unless the message clearly moves to a different life domain, one of "
+    "the other topics, or a new one- or two-word category. Answer with the "
+    "topic only."
+)
+
+
+class TopicClassifier:
+    """
+    Picks the conversation topic for a turn outside the main completion.
+
+    The turn's text is embedded and compared with the broad topics and the
+    user's open conversations. The current topic gets a `stickiness` bonus,
+    so the conversation only moves when another topic is clearly closer;
+    when the lead is within `ambiguous_band` a small model decides instead.
+    Messages shorter than `min_words` (replies like "yes please") stay put
+    without any call, as do turns where no candidate is close.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        model: str,
+        stickiness: float,
+        ambiguous_band: float,
+        min_similarity: float,
+        min_words: int,
+    ):
+        self.embedder = embedder
+        self.model = model
+        self.stickiness = stickiness
+        self.ambiguous_band = ambiguous_band
+        self.min_similarity = min_similarity
+        self.min_words = min_words
+
+        # Counters exposed through stats()
+        self.kept_short = 0
+        self.kept = 0
+        self.switched = 0
+        self.asked_model = 0
+        self.errors = 0
+
+    async def classify(self, user_id: int, conversation: dict, texts: list[str]) -> str:
+        """Returns the topic to file this turn under; falls back to the current one."""
+        with span("topic"):
+            return await self._classify(user_id, conversation, texts)
+
+    async def _classify(
+        self, user_id: int, conversation: dict, texts: list[str]
+    ) -> str:
+        current = conversation.get("topic") or DEFAULT_TOPIC
+        text = " ".join(t for t in texts if t).strip()
+        if len(text.split()) < self.min_words:
+            self.kept_short += 1
+            return current
+
+        try:
+            open_topics = [
+                c["topic"]
+                for c in await db.open_conversations(user_id)
+                if c.get("topic")
+            ]
+            candidates = list(
+                dict.fromkeys([current, *open_topics, *TOPIC_DESCRIPTIONS])
+            )
+            vectors = await self.embedder.embed(
+                [text] + [TOPIC_DESCRIPTIONS.get(c, c) for c in candidates]
+            )
+            message, labels = vectors[0], vectors[1:]
+            scores = {c: cosine(message, v) for c, v in zip(candidates, labels)}
+            scores[current] += self.stickiness
+
+            best = max(candidates, key=scores.get)
+            lead = scores[best] - scores[current]
+            if best == current or scores[best] < self.min_similarity:
+                self.kept += 1
+                return current
+            if lead >= self.ambiguous_band:
+                self.switched += 1
+                return best
+
+            self.asked_model += 1
+            return await self._ask(text, current, open_topics)
+        except Exception as e:
+            self.errors += 1
+            log("topic_failed", logging.WARNING, topic=current, error=repr(e))
+            return current
+
+    async def _ask(self, text: str, current: str, open_topics: list[str]) -> str:
+        others = [
+            t
+            for t in dict.fromkeys([*open_topics, *TOPIC_DESCRIPTIONS])
+            if t != current
+        ]
+        response = await gateway.chat(
+            self.model,
+            max_tokens=8,
+            temperature=0,
+            messages=[
+                {"role": "system", "content": TOPIC_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"Current topic: {current}\nOther topics: {', '.join(others)}\n\nMessage: {text}",
+                },
+            ],
+        )
+        topic = (response.choices[0].message.content or "").strip().strip(".'\"")
+        # Anything longer than a short label is not a usable answer
+        if not topic or len(topic.split()) > 2:
+            return current
+        return topic.title() if topic.islower() else topic
+
+    def stats(self) -> dict:
+        return {
+            "kept_short": self.kept_short,
+            "kept": self.kept,
+            "switched": self.switched,
+            "asked_model": self.asked_model,
+            "errors": self.errors,
+            "embeddings": self.embedder.stats(),
+        }
+
+
+topics = TopicClassifier(
+    embedder=embedder,
+    model=config["TOPIC_MODEL"],
+    stickiness=config["TOPIC_STICKINESS"],
+    ambiguous_band=config["TOPIC_AMBIGUOUS_BAND"],
+    min_similarity=config["TOPIC_MIN_SIMILARITY"],
+    min_words=config["TOPIC_MIN_WORDS"],
+)
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.config import config
+from app.metrics import LATENCY_BUCKETS_MS, Histograms, registry
+
+logger = logging.getLogger("aura")
+
+# Per-message id carried through every span and log line of a turn
+correlation_id: ContextVar[str | None] = ContextVar("correlation_id", default=None)
+_trace: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+
+STAGE_LATENCY = registry.histograms(
+    "aura_stage_latency_ms",
+    "Time spent in each pipeline stage, in milliseconds",
+    "stage",
+    Histograms(LATENCY_BUCKETS_MS),
+)
+STAGE_ERRORS = registry.counters(
+    "aura_stage_errors_total", "Pipeline stages that raised", "stage"
+)
+
+# Event loop lag is a few milliseconds when healthy, so it gets finer buckets
+LOOP_LAG = registry.histograms(
+    "aura_event_loop_lag_ms",
+    "How late the event loop ran a scheduled wakeup, in milliseconds",
+    "",
+    Histograms((1, 5, 10, 25, 50, 100, 250, 500, 1000)),
+)
+
+
+class Trace:
+    """The spans recorded for one turn, logged together when it finishes."""
+
+    __slots__ = ("spans",)
+
+    def __init__(self):
+        self.spans: list[tuple[str, float]] = []
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["error"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class StructuredLog:
+    """
+    JSON-lines logging that never blocks the event loop: records go onto an
+    in-memory queue and a QueueListener thread writes them to stdout.
+    """
+
+    def __init__(self, level: str):
+        self.level = level
+        self._listener: logging.handlers.QueueListener | None = None
+
+    def start(self):
+        if self._listener is not None:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(records))
+        logger.setLevel(self.level.upper())
+        logger.propagate = False
+        self._listener = logging.handlers.QueueListener(records, handler)
+        self._listener.start()
+
+    def stop(self):
+        """Flushes whatever is still queued."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+def log(event: str, level: int = logging.INFO, **fields):
+    """Logs a structured event tagged with the current correlation id."""
+    if logger.isEnabledFor(level):
+        logger.log(
+            level, event, extra={"fields": {"cid": correlation_id.get(), **fields}}
+        )
+
+
+@contextmanager
+def traced_turn(cid: str | None = None):
+    """Scopes a turn: sets its correlation id and collects its spans."""
+    cid_token = correlation_id.set(cid or uuid.uuid4().hex[:12])
+    trace = Trace()
+    trace_token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(trace_token)
+        correlation_id.reset(cid_token)
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """
+    Times the enclosed block as `stage`: the duration goes into the stage
+    histogram, the current turn's trace and a debug log line.
+    """
+    started = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except Exception:
+        ok = False
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        STAGE_LATENCY.labels(stage).observe(elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace.spans.append((stage, round(elapsed, 1)))
+        log("span", logging.DEBUG, stage=stage, ms=round(elapsed, 1), ok=ok, **fields)
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop wakes a task that sleeps `interval`
+    seconds. Anything blocking the loop (sync I/O, heavy CPU) shows up here
+    before it shows up as slow turns.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lag_ms = LOOP_LAG.labels("")
+        self.max_lag_ms = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, (loop.time() - started - self.interval) * 1000)
+            self.lag_ms.observe(lag)
+            self.max_lag_ms = max(self.max_lag_ms, lag)
+
+    def stats(self) -> dict:
+        return {
+            **self.lag_ms.snapshot(),
+            "max_ms": round(self.max_lag_ms, 1),
+        }
+
+
+structured_log = StructuredLog(level=config["LOG_LEVEL"])
+loop_monitor = LoopMonitor(interval=config["LOOP_LAG_INTERVAL"])
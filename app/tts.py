@@ -1,57 +1,225 @@
-import os
-import tempfile
+import asyncio
+import logging
+import re
+import time
 
-import requests
-from elevenlabs.client import ElevenLabs
+import httpx
+from elevenlabs.client import AsyncElevenLabs
 
+from app.cache import AudioCache
 from app.config import config
+from app.graph import graph
+from app.tracing import log, span
 
-# Set up ElevenLabs client
-elevenlabs = ElevenLabs(api_key=config["ELEVENLABS_KEY"])
+DEFAULT_VOICE_ID = "JBFqnCBsd6RMkjVDRZzb"
 
+# A sentence ends at . ! ? or … (plus any closing quotes/brackets) followed by whitespace
+SENTENCE_END = re.compile(r"[.!?…][\"')\]]*\s+")
 
-def generate_voice_with_elevenlabs(
-    text: str, voice_id: str = "JBFqnCBsd6RMkjVDRZzb"
-) -> str:
+# How much preceding text is sent as `previous_text` so prosody carries across segments
+CONTEXT_CHARS = 500
+
+
+class SpeechSynthesizer:
+    """
+    Async ElevenLabs client shared by every voice reply. Segments are
+    synthesized concurrently, up to `max_concurrency` requests at a time.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        max_concurrency: int,
+        first_chunk_chars: int,
+        chunk_chars: int,
+        cache: AudioCache,
+        model_id: str = "eleven_multilingual_v2",
+        output_format: str = "mp3_44100_128",
+        base_url: str | None = None,
+    ):
+        self.client = AsyncElevenLabs(api_key=api_key, base_url=base_url)
+        self.cache = cache
+        self.first_chunk_chars = first_chunk_chars
+        self.chunk_chars = chunk_chars
+        self.model_id = model_id
+        self.output_format = output_format
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+        # Counters exposed through stats()
+        self.replies = 0
+        self.segments = 0
+        self.errors = 0
+        self.first_audio_ms = 0.0
+        self.max_first_audio_ms = 0.0
+
+    async def synthesize(
+        self,
+        text: str,
+        voice_id: str = DEFAULT_VOICE_ID,
+        previous_text: str | None = None,
+    ) -> bytes:
+        """
+        Synthesizes `text` into MP3 bytes, reusing the cached audio for
+        repeated text spoken after the same `previous_text`.
+        """
+        key = self.cache_key(text, voice_id, previous_text)
+        audio = await self.cache.get_audio(key)
+        if audio is not None:
+            return audio
+
+        kwargs = {"previous_text": previous_text} if previous_text else {}
+        async with self._slots:
+            chunks = [
+                chunk
+                async for chunk in self.client.text_to_speech.convert(
+                    voice_id,
+                    text=text,
+                    model_id=self.model_id,
+                    output_format=self.output_format,
+                    **kwargs,
+                )
+            ]
+        self.segments += 1
+        audio = b"".join(chunks)
+        await self.cache.put_audio(key, audio)
+        return audio
+
+    def cache_key(
+        self,
+        text: str,
+        voice_id: str = DEFAULT_VOICE_ID,
+        previous_text: str | None = None,
+    ) -> str:
+        parts = [text, voice_id, self.model_id, self.output_format]
+        # The preceding text shapes the intonation, so audio spoken after
+        # different text isn't interchangeable
+        if previous_text:
+            parts.append(previous_text)
+        return self.cache.key(*parts)
+
+    def stream(self, voice_id: str = DEFAULT_VOICE_ID) -> "VoiceStream":
+        return VoiceStream(self, voice_id)
+
+    def stats(self) -> dict:
+        return {
+            "replies": self.replies,
+            "segments": self.segments,
+            "errors": self.errors,
+            "avg_first_audio_ms": (
+                round(self.first_audio_ms / self.replies, 1) if self.replies else 0.0
+            ),
+            "max_first_audio_ms": round(self.max_first_audio_ms, 1),
+            "cache": self.cache.stats(),
+        }
+
+
+class VoiceStream:
     """
-    Generate full audio from text using ElevenLabs SDK (streaming),
-    save it to a temp MP3 file, and return the file path.
+    Turns a reply into speech while it is still being generated. Text is
+    fed in as the LLM streams it; each complete sentence (grouped into
+    chunks of about `chunk_chars`, with a shorter first chunk) starts its own
+    synthesis right away, and finish() joins the MP3 segments in order.
     """
-    stream = elevenlabs.text_to_speech.convert(
-        text=text,
-        voice_id=voice_id,
-        model_id="eleven_multilingual_v2",
-        output_format="mp3_44100_128",
-    )
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-        for chunk in stream:
-            tmp.write(chunk)
-        return tmp.name
+    def __init__(self, synthesizer: SpeechSynthesizer, voice_id: str):
+        self.synthesizer = synthesizer
+        self.voice_id = voice_id
+        self._buffer = ""
+        self._spoken = ""
+        self._segments: list[asyncio.Task] = []
+        self._started_at = time.monotonic()
+        self._first_audio_at: float | None = None
+
+    def feed(self, text: str):
+        """Adds streamed text, starting synthesis for every complete chunk."""
+        self._buffer += text
+        while True:
+            threshold = (
+                self.synthesizer.chunk_chars
+                if self._segments
+                else self.synthesizer.first_chunk_chars
+            )
+            cut = None
+            for match in SENTENCE_END.finditer(self._buffer):
+                cut = match.end()
+                if cut >= threshold:
+                    break
+            if cut is None or cut < threshold:
+                return
+            self._start(self._buffer[:cut])
+            self._buffer = self._buffer[cut:]
 
+    def _start(self, text: str):
+        text = text.strip()
+        if not text:
+            return
+        previous = self._spoken[-CONTEXT_CHARS:] or None
+        self._spoken = f"{self._spoken} {text}".strip()
+        task = asyncio.create_task(
+            self.synthesizer.synthesize(text, self.voice_id, previous_text=previous)
+        )
+        if not self._segments:
+            task.add_done_callback(self._on_first_audio)
+        self._segments.append(task)
 
-def upload_audio_to_whatsapp(file_path: str) -> str:
+    def _on_first_audio(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is None:
+            self._first_audio_at = time.monotonic()
+
+    async def finish(self, fallback: str | None = None) -> bytes:
+        """
+        Synthesizes whatever text is left and returns the whole reply as one
+        MP3. `fallback` is spoken if nothing was fed (e.g. a tool-only reply).
+        """
+        self._start(self._buffer)
+        self._buffer = ""
+        if not self._segments and fallback:
+            self._start(fallback)
+        try:
+            # MP3 frames can be concatenated as-is into one playable file
+            audio = b"".join(await asyncio.gather(*self._segments))
+        except Exception:
+            self.synthesizer.errors += 1
+            self.cancel()
+            raise
+
+        stats = self.synthesizer
+        stats.replies += 1
+        if self._first_audio_at is not None:
+            elapsed = (self._first_audio_at - self._started_at) * 1000
+            stats.first_audio_ms += elapsed
+            stats.max_first_audio_ms = max(stats.max_first_audio_ms, elapsed)
+        return audio
+
+    def cancel(self):
+        for task in self._segments:
+            task.cancel()
+
+
+async def upload_audio_to_whatsapp(audio: bytes, filename: str = "reply.mp3") -> str:
     """
-    Upload an MP3 audio file to WhatsApp via the Meta Graph API and return the media ID.
+    Upload MP3 audio to WhatsApp via the Meta Graph API and return the media ID.
     """
-    url = f"https://graph.facebook.com/v22.0/{config['PHONE_NUMBER_ID']}/media"
-    headers = {"Authorization": f"Bearer {config['WHATSAPP_TOKEN']}"}
+    url = f"/{config['PHONE_NUMBER_ID']}/media"
     files = {
-        "file": (os.path.basename(file_path), open(file_path, "rb"), "audio/mpeg"),
+        "file": (filename, audio, "audio/mpeg"),
     }
     data = {
         "messaging_product": "whatsapp",  # ✅ must be included!
         "type": "audio/mpeg",
     }
 
-    response = requests.post(url, headers=headers, files=files, data=data)
+    response = await graph.post(url, files=files, data=data)
 
     try:
         response.raise_for_status()
-        print("✅ Media upload response:", response.status_code, response.json())
-
-    except requests.exceptions.HTTPError:
-        print("❌ WhatsApp upload failed:", response.status_code, response.text)
+    except httpx.HTTPStatusError:
+        log(
+            "media_upload_failed",
+            logging.ERROR,
+            status=response.status_code,
+            body=response.text,
+        )
         raise
 
     media_id = response.json().get("id")
@@ -59,3 +227,38 @@ def upload_audio_to_whatsapp(file_path: str) -> str:
         raise RuntimeError("No media ID returned by WhatsApp.")
 
     return media_id
+
+
+async def upload_voice_reply(voice: VoiceStream, reply: str) -> str:
+    """
+    Returns a WhatsApp media id for the spoken `reply`. A reply that was
+    uploaded recently is reused as-is, skipping synthesis and upload.
+    """
+    cache = voice.synthesizer.cache
+    key = voice.synthesizer.cache_key(reply, voice.voice_id)
+    media_id = cache.get_media_id(key)
+    if media_id:
+        voice.cancel()
+        return media_id
+
+    with span("tts"):
+        audio = await voice.finish(fallback=reply)
+    with span("upload"):
+        media_id = await upload_audio_to_whatsapp(audio)
+    cache.set_media_id(key, media_id)
+    return media_id
+
+
+speech = SpeechSynthesizer(
+    api_key=config["ELEVENLABS_KEY"],
+    max_concurrency=config["TTS_MAX_CONCURRENCY"],
+    first_chunk_chars=config["TTS_FIRST_CHUNK_CHARS"],
+    chunk_chars=config["TTS_CHUNK_CHARS"],
+    cache=AudioCache(
+        directory=config["TTS_CACHE_DIR"],
+        max_bytes=config["TTS_CACHE_MAX_BYTES"],
+        media_ttl=config["TTS_MEDIA_TTL_SECONDS"],
+        max_media=config["TTS_MEDIA_CACHE_SIZE"],
+    ),
+    base_url=config["ELEVENLABS_BASE_URL"],
+)
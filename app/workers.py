@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+
+from app.config import config
+from app.tracing import log
+
+
+class WorkerPool:
+    """
+    A bounded pool of async workers that runs webhook jobs off the request path.
+    Each worker pulls jobs from a shared queue and runs up to `concurrency` of
+    them at once. When the queue is full, `submit` gives up after
+    `enqueue_timeout` seconds so the webhook can push back instead of piling up.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        concurrency: int,
+        queue_size: int,
+        enqueue_timeout: float,
+    ):
+        self.size = size
+        self.concurrency = concurrency
+        self.enqueue_timeout = enqueue_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._workers: list[asyncio.Task] = []
+
+        # Counters exposed through stats()
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.max_depth = 0
+        self.max_wait = 0.0
+        self._dequeued = 0
+        self._total_wait = 0.0
+
+    async def start(self):
+        if self._workers:
+            return
+        for index in range(self.size):
+            self._workers.append(asyncio.create_task(self._worker(index)))
+        log(
+            "workers_started",
+            workers=self.size,
+            concurrency=self.concurrency,
+            queue=self.queue.maxsize,
+        )
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Waits for queued jobs to finish (up to `drain_timeout`), then stops the workers."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except TimeoutError:
+            log("worker_jobs_dropped", logging.WARNING, jobs=self.queue.qsize())
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, handler, *args, wait: bool = False) -> asyncio.Future | None:
+        """
+        Queues `handler(*args)` for a worker. Returns a future that resolves with
+        the handler's result, or None if the queue stayed full (backpressure).
+        With `wait=True` it blocks until there is room instead of giving up.
+        """
+        future = asyncio.get_running_loop().create_future()
+        job = (handler, args, future, time.monotonic())
+        try:
+            if wait:
+                await self.queue.put(job)
+            elif self.enqueue_timeout > 0:
+                await asyncio.wait_for(
+                    self.queue.put(job), timeout=self.enqueue_timeout
+                )
+            else:
+                self.queue.put_nowait(job)
+        except (TimeoutError, asyncio.QueueFull):
+            self.rejected += 1
+            return None
+
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return future
+
+    async def _worker(self, index: int):
+        slots = asyncio.Semaphore(self.concurrency)
+        running: set[asyncio.Task] = set()
+        while True:
+            await slots.acquire()
+            handler, args, future, queued_at = await self.queue.get()
+
+            wait = time.monotonic() - queued_at
+            self._dequeued += 1
+            self._total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            task = asyncio.create_task(self._run(handler, args, future))
+            running.add(task)
+
+            def done(t, slots=slots, running=running):
+                running.discard(t)
+                slots.release()
+                self.queue.task_done()
+
+            task.add_done_callback(done)
+
+    async def _run(self, handler, args, future: asyncio.Future):
+        self.in_flight += 1
+        try:
+            result = await handler(*args)
+            self.processed += 1
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            self.failed += 1
+            log(
+                "worker_job_failed",
+                logging.ERROR,
+                job=getattr(handler, "__name__", repr(handler)),
+                error=repr(e),
+            )
+            if not future.done():
+                future.set_exception(e)
+                # Nobody is required to await the future, so mark the exception as seen
+                future.exception()
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._workers),
+            "concurrency": self.concurrency,
+            "depth": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "max_depth": self.max_depth,
+            "in_flight": self.in_flight,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": (
+                round(self._total_wait / self._dequeued * 1000, 2)
+                if self._dequeued
+                else 0.0
+            ),
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+
+worker_pool = WorkerPool(
+    size=config["WORKER_POOL_SIZE"],
+    concurrency=config["WORKER_CONCURRENCY"],
+    queue_size=config["WORKER_QUEUE_SIZE"],
+    enqueue_timeout=config["WORKER_ENQUEUE_TIMEOUT"],
+)
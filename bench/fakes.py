@@ -0,0 +1,630 @@
+"""
+In-process stand-ins for the services the app calls: the WhatsApp Graph
+API, OpenAI, ElevenLabs and Supabase's REST API. Each one is a small
+FastAPI app that answers in the shape the real SDKs parse, after a
+configurable delay, and fails a configurable share of requests.
+
+They only implement what app/ uses; anything else is a 404.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+from itertools import count
+from typing import Callable
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class Faults:
+    """
+    Latency and error injection for one fake: every request waits
+    `latency_ms` plus up to `jitter_ms`, then fails with `error_status`
+    with probability `error_rate`.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+        # Counters included in the report
+        self.requests = 0
+        self.errors = 0
+
+    async def inject(self) -> Response | None:
+        """Waits out the latency; returns the error response to send, if any."""
+        self.requests += 1
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return JSONResponse(
+                {"error": {"message": "injected fault", "code": self.error_status}},
+                status_code=self.error_status,
+            )
+        return None
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "errors": self.errors}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeGraph:
+    """
+    The Graph API endpoints for sending messages and uploading and
+    downloading media. Every accepted send is passed to `on_send` as
+    (monotonic time, payload), which is how the load generator sees replies.
+    """
+
+    def __init__(self, faults: Faults, audio_bytes: int = 16_000):
+        self.faults = faults
+        self.audio = bytes(audio_bytes)  # any bytes will do, nobody decodes them
+        self.on_send: Callable[[float, dict], None] | None = None
+        self.sent = 0
+        self.uploads = 0
+        self._ids = count(1)
+        self.app = FastAPI()
+        self._routes()
+
+    def _routes(self):
+        app = self.app
+
+        # Registered first so it isn't taken for /{version}/{media_id}
+        @app.get("/download/{media_id}")
+        async def download(media_id: str):
+            if error := await self.faults.inject():
+                return error
+            return Response(self.audio, media_type="audio/ogg")
+
+        @app.post("/{version}/{phone_number_id}/messages")
+        async def send(version: str, phone_number_id: str, request: Request):
+            if error := await self.faults.inject():
+                return error
+            payload = await request.json()
+            self.sent += 1
+            if self.on_send is not None:
+                self.on_send(time.monotonic(), payload)
+            to = payload.get("to")
+            return {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": to, "wa_id": to}],
+                "messages": [{"id": f"wamid.bench.out.{next(self._ids)}"}],
+            }
+
+        @app.post("/{version}/{phone_number_id}/media")
+        async def upload(version: str, phone_number_id: str, request: Request):
+            if error := await self.faults.inject():
+                return error
+            await request.body()
+            self.uploads += 1
+            return {"id": f"bench-media-{next(self._ids)}"}
+
+        @app.get("/{version}/{media_id}")
+        async def media_url(version: str, media_id: str, request: Request):
+            if error := await self.faults.inject():
+                return error
+            return {
+                "url": f"{str(request.base_url).rstrip('/')}/download/{media_id}",
+                "mime_type": "audio/ogg",
+                "id": media_id,
+            }
+
+    def stats(self) -> dict:
+        return {**self.faults.stats(), "sent": self.sent, "uploads": self.uploads}
+
+
+# Canned replies, long enough to stream a realistic number of chunks
+REPLIES = (
+    "Staying hydrated is a great habit. Aim for about eight glasses a day, "
+    "and a little more when you exercise or it's hot outside.",
+    "That sounds like a good plan! Small consistent steps add up, so start "
+    "with something easy and build on it over the next couple of weeks.",
+    "I hear you. A short walk, a glass of water and an early night usually "
+    "help more than you'd expect. Want me to remind you tomorrow?",
+)
+REMIND = re.compile(r"\bremind\b", re.IGNORECASE)
+
+
+class FakeOpenAI:
+    """
+    Chat completions (plain and streamed, with a usage chunk at the end)
+    and embeddings. `faults` delays the first byte; streamed replies then
+    arrive one word every `token_ms`. Messages asking to be reminded get a
+    create_reminder tool call instead of text, like the real model would.
+
+    Embeddings are pseudo-random vectors seeded by the text, so the same
+    text always gets the same vector and different texts are unrelated.
+    """
+
+    def __init__(self, faults: Faults, token_ms: float = 15.0, dimensions: int = 256):
+        self.faults = faults
+        self.token_ms = token_ms
+        self.dimensions = dimensions
+        self.completions = 0
+        self.embedded = 0
+        self.app = FastAPI()
+        self._routes()
+
+    def _routes(self):
+        app = self.app
+
+        @app.post("/v1/chat/completions")
+        async def completions(request: Request):
+            if error := await self.faults.inject():
+                return error
+            body = await request.json()
+            self.completions += 1
+            model = body.get("model", "gpt-4o")
+            last = body["messages"][-1].get("content") or ""
+            prompt_tokens = sum(
+                len(str(m.get("content") or "")) // 4 for m in body["messages"]
+            )
+            tool_call = None
+            if body.get("tools") and REMIND.search(str(last)):
+                tool_call = {
+                    "name": "create_reminder",
+                    "arguments": json.dumps({"content": "drink water"}),
+                }
+            text = random.choice(REPLIES) if tool_call is None else ""
+            if not body.get("stream"):
+                return self._completion(model, text, prompt_tokens)
+            return StreamingResponse(
+                self._stream(model, text, tool_call, prompt_tokens),
+                media_type="text/event-stream",
+            )
+
+        @app.post("/v1/embeddings")
+        async def embeddings(request: Request):
+            if error := await self.faults.inject():
+                return error
+            body = await request.json()
+            texts = body["input"]
+            texts = [texts] if isinstance(texts, str) else texts
+            self.embedded += len(texts)
+            tokens = sum(len(t) // 4 + 1 for t in texts)
+            return {
+                "object": "list",
+                "model": body.get("model"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": self._vector(t)}
+                    for i, t in enumerate(texts)
+                ],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            }
+
+    def _vector(self, text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [rng.gauss(0, 1) for _ in range(self.dimensions)]
+
+    def _completion(self, model: str, text: str, prompt_tokens: int) -> dict:
+        completion_tokens = len(text) // 4
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    async def _stream(
+        self, model: str, text: str, tool_call: dict | None, prompt_tokens: int
+    ):
+        base = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+        }
+
+        def event(choices: list, usage: dict | None = None) -> str:
+            return (
+                f"data: {json.dumps({**base, 'choices': choices, 'usage': usage})}\n\n"
+            )
+
+        def delta(content: dict, finish: str | None = None) -> list:
+            return [{"index": 0, "delta": content, "finish_reason": finish}]
+
+        yield event(delta({"role": "assistant", "content": ""}))
+        if tool_call is not None:
+            call = {"index": 0, "id": "call_bench", "type": "function"}
+            yield event(delta({"tool_calls": [{**call, "function": tool_call}]}))
+            finish = "tool_calls"
+        else:
+            for word in re.findall(r"\S+\s*", text):
+                await asyncio.sleep(self.token_ms / 1000)
+                yield event(delta({"content": word}))
+            finish = "stop"
+        yield event(delta({}, finish))
+
+        completion_tokens = max(1, len(text) // 4)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        yield event([], usage)
+        yield "data: [DONE]\n\n"
+
+    def stats(self) -> dict:
+        return {
+            **self.faults.stats(),
+            "completions": self.completions,
+            "embedded": self.embedded,
+        }
+
+
+class FakeElevenLabs:
+    """Speech-to-text and text-to-speech, returning a fixed transcript and silence."""
+
+    def __init__(self, faults: Faults, transcript: str, bytes_per_char: int = 100):
+        self.faults = faults
+        self.transcript = transcript
+        self.bytes_per_char = bytes_per_char
+        self.transcribed = 0
+        self.synthesized = 0
+        self.app = FastAPI()
+        self._routes()
+
+    def _routes(self):
+        app = self.app
+
+        @app.post("/v1/speech-to-text")
+        async def speech_to_text(request: Request):
+            await request.body()  # multipart upload, not parsed
+            if error := await self.faults.inject():
+                return error
+            self.transcribed += 1
+            return {
+                "language_code": "eng",
+                "language_probability": 0.99,
+                "text": self.transcript,
+                "words": [],
+            }
+
+        @app.post("/v1/text-to-speech/{voice_id}")
+        async def text_to_speech(voice_id: str, request: Request):
+            if error := await self.faults.inject():
+                return error
+            body = await request.json()
+            self.synthesized += 1
+            size = len(body.get("text", "")) * self.bytes_per_char
+
+            async def audio():
+                for start in range(0, size, 4096):
+                    yield bytes(min(4096, size - start))
+
+            return StreamingResponse(audio(), media_type="audio/mpeg")
+
+    def stats(self) -> dict:
+        return {
+            **self.faults.stats(),
+            "transcribed": self.transcribed,
+            "synthesized": self.synthesized,
+        }
+
+
+# Columns PostgREST would fill from the tables' defaults, and unique keys
+DEFAULTS = {
+    "users": lambda: {"created_at": _now()},
+    "conversations": lambda: {"status": "open", "started_at": _now()},
+    "messages": lambda: {"timestamp": _now()},
+    "tasks": lambda: {"active": True, "created_at": _now(), "updated_at": _now()},
+    "processed_messages": lambda: {"received_at": _now()},
+    "outbox": lambda: {"created_at": _now()},
+}
+UNIQUE = {"users": "phone", "processed_messages": "message_id", "outbox": "id"}
+SERIAL = {"users", "conversations", "messages", "tasks"}
+RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _text(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _compare(value, raw: str) -> int:
+    try:
+        a, b = float(value), float(raw)
+    except (TypeError, ValueError):
+        a, b = _text(value), raw
+    return (a > b) - (a < b)
+
+
+def _matches(row: dict, column: str, condition: str) -> bool:
+    op, _, raw = condition.partition(".")
+    if op == "not":
+        return not _matches(row, column, raw)
+    value = row.get(column)
+    if op == "eq":
+        return _text(value) == raw
+    if op == "neq":
+        return _text(value) != raw
+    if op == "in":
+        options = [v.strip().strip('"') for v in raw.strip("()").split(",")]
+        return _text(value) in options
+    if op == "is":
+        return _text(value) == raw
+    if value is None:
+        return False
+    if op == "gt":
+        return _compare(value, raw) > 0
+    if op == "gte":
+        return _compare(value, raw) >= 0
+    if op == "lt":
+        return _compare(value, raw) < 0
+    if op == "lte":
+        return _compare(value, raw) <= 0
+    raise ValueError(f"unsupported filter {op}")
+
+
+class FakeSupabase:
+    """
+    An in-memory subset of PostgREST under /rest/v1: select with
+    eq/neq/in/is/gt/gte/lt/lte filters (optionally negated with not.), order, limit/offset, insert,
+    upsert (merge or ignore duplicates), update and delete, plus the
+    aura_* functions from db/migrations, reimplemented in Python.
+    """
+
+    def __init__(self, faults: Faults):
+        self.faults = faults
+        self.tables: dict[str, list[dict]] = {name: [] for name in DEFAULTS}
+        self._ids = {name: count(1) for name in SERIAL}
+        self.queries = 0
+        self.rpcs = 0
+        self.app = FastAPI()
+        self._routes()
+
+    def _routes(self):
+        app = self.app
+
+        @app.post("/rest/v1/rpc/{function}")
+        async def rpc(function: str, request: Request):
+            if error := await self.faults.inject():
+                return error
+            handler = getattr(self, f"_rpc_{function}", None)
+            if handler is None:
+                return JSONResponse({"message": f"no function {function}"}, 404)
+            self.rpcs += 1
+            return JSONResponse(handler(**(await request.json())))
+
+        @app.api_route("/rest/v1/{table}", methods=["GET", "POST", "PATCH", "DELETE"])
+        async def rest(table: str, request: Request):
+            if error := await self.faults.inject():
+                return error
+            if table not in self.tables:
+                return JSONResponse({"message": f"no table {table}"}, 404)
+            self.queries += 1
+            return self._query(table, request.method, request, await request.body())
+
+    def _query(self, table: str, method: str, request: Request, body: bytes):
+        params = request.query_params
+        prefer = request.headers.get("prefer", "")
+        filters = [
+            (column, condition)
+            for column, condition in params.multi_items()
+            if column not in RESERVED
+        ]
+        rows = self.tables[table]
+
+        def selected() -> list[dict]:
+            return [r for r in rows if all(_matches(r, c, f) for c, f in filters)]
+
+        if method == "GET":
+            result = self._order(selected(), params.get("order"))
+            offset = int(params.get("offset", 0))
+            limit = params.get("limit")
+            end = offset + int(limit) if limit is not None else None
+            return self._respond(result[offset:end], params.get("select"))
+
+        if method == "POST":
+            data = json.loads(body)
+            data = data if isinstance(data, list) else [data]
+            ignore = "ignore-duplicates" in prefer
+            merge = "merge-duplicates" in prefer
+            key = params.get("on_conflict") or UNIQUE.get(table)
+            written = []
+            for item in data:
+                existing = None
+                if key and (merge or ignore) and item.get(key) is not None:
+                    existing = next((r for r in rows if r.get(key) == item[key]), None)
+                if existing is not None:
+                    if merge:
+                        existing.update(item)
+                        written.append(existing)
+                    continue
+                written.append(self._insert(table, item))
+            return self._respond(written, params.get("select"), status=201)
+
+        if method == "PATCH":
+            result = selected()
+            for row in result:
+                row.update(json.loads(body))
+            return self._respond(result, params.get("select"))
+
+        result = selected()  # DELETE
+        self.tables[table] = [r for r in rows if r not in result]
+        return self._respond(result, params.get("select"))
+
+    def _insert(self, table: str, item: dict) -> dict:
+        row = {**DEFAULTS[table](), **item}
+        if table in SERIAL and row.get("id") is None:
+            row["id"] = next(self._ids[table])
+        self.tables[table].append(row)
+        return row
+
+    @staticmethod
+    def _order(rows: list[dict], order: str | None) -> list[dict]:
+        # Sorts are stable, so the last key is applied first
+        for term in reversed(order.split(",") if order else []):
+            column, _, direction = term.partition(".")
+            rows = sorted(
+                rows,
+                key=lambda r: (r.get(column) is None, r.get(column) or 0),
+                reverse=direction.startswith("desc"),
+            )
+        return rows
+
+    @staticmethod
+    def _respond(rows: list[dict], select: str | None, status: int = 200):
+        if select and select != "*":
+            columns = [c.strip() for c in select.split(",")]
+            rows = [{c: r.get(c) for c in columns} for r in rows]
+        return JSONResponse(rows, status_code=status)
+
+    # --- db/migrations functions ---
+
+    def _open_conversations(self, user_id: int) -> list[dict]:
+        conversations = [
+            c
+            for c in self.tables["conversations"]
+            if c["user_id"] == user_id and c["status"] == "open"
+        ]
+        return sorted(conversations, key=lambda c: c["started_at"], reverse=True)
+
+    def _rpc_aura_begin_turn(self, p_phone, p_name, p_messages, p_history_limit=20):
+        user = next((u for u in self.tables["users"] if u["phone"] == p_phone), None)
+        if user is None:
+            user = self._insert("users", {"phone": p_phone, "name": p_name})
+        open_conversations = self._open_conversations(user["id"])
+        existing = bool(open_conversations)
+        if existing:
+            conversation = open_conversations[0]
+        else:
+            conversation = self._insert(
+                "conversations", {"user_id": user["id"], "topic": "General"}
+            )
+            open_conversations = [conversation]
+        message_ids = [
+            self._insert(
+                "messages",
+                {**m, "user_id": user["id"], "conversation_id": conversation["id"]},
+            )["id"]
+            for m in p_messages
+        ]
+        history = [m for m in self.tables["messages"] if m["user_id"] == user["id"]]
+        history = history[-p_history_limit:] if p_history_limit else []
+
+        def brief(c: dict) -> dict:
+            return {
+                "id": c["id"],
+                "topic": c["topic"],
+                "summary": c.get("summary"),
+                "summary_through": c.get("summary_through"),
+            }
+
+        return {
+            "user": user,
+            "open_conversations": [brief(c) for c in open_conversations],
+            "conversation": brief(conversation),
+            "existing_conversation": existing,
+            "message_ids": message_ids,
+            "history": [
+                {"id": m["id"], "role": m["role"], "message": m["message"]}
+                for m in history
+            ],
+        }
+
+    def _rpc_aura_finish_turn(
+        self,
+        p_user_id,
+        p_conversation_id,
+        p_message_ids,
+        p_topic,
+        p_assistant,
+        p_task=None,
+    ):
+        conversation = next(
+            (c for c in self._open_conversations(p_user_id) if c["topic"] == p_topic),
+            None,
+        )
+        created = conversation is None
+        if created:
+            conversation = self._insert(
+                "conversations", {"user_id": p_user_id, "topic": p_topic}
+            )
+        if conversation["id"] != p_conversation_id:
+            moved = set(p_message_ids)
+            for message in self.tables["messages"]:
+                if message["id"] in moved:
+                    message["conversation_id"] = conversation["id"]
+        task = None
+        if p_task is not None:
+            task = self._insert(
+                "tasks",
+                {**p_task, "user_id": p_user_id, "conversation_id": conversation["id"]},
+            )
+        assistant = self._insert(
+            "messages",
+            {
+                "user_id": p_user_id,
+                "conversation_id": conversation["id"],
+                "role": p_assistant.get("role"),
+                "message": p_assistant.get("message"),
+                "message_type": p_assistant.get("message_type"),
+            },
+        )
+        return {
+            "conversation_id": conversation["id"],
+            "created_conversation": created,
+            "task": task,
+            "assistant_message_id": assistant["id"],
+        }
+
+    def _rpc_aura_claim_reminders(self, p_claims):
+        return {}
+
+    def _rpc_aura_release_reminders(self, p_claims):
+        return 0
+
+    def _rpc_aura_take_outbox(self, p_limit=1000):
+        return []
+
+    def _rpc_aura_renew_outbox(self, p_owner, p_ttl_seconds):
+        return 0
+
+    def _rpc_aura_acquire_lease(self, p_name, p_holder, p_ttl_seconds):
+        # The bench runs one replica, which never needs to lead the reminders
+        return False
+
+    def _rpc_aura_release_lease(self, p_name, p_holder):
+        return None
+
+    def stats(self) -> dict:
+        return {
+            **self.faults.stats(),
+            "queries": self.queries,
+            "rpcs": self.rpcs,
+            "rows": {name: len(rows) for name, rows in self.tables.items()},
+        }
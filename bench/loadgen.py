@@ -0,0 +1,230 @@
+"""
+Open-loop webhook traffic: WhatsApp message notifications posted to the
+app at a target rate whether or not earlier ones have been answered, so
+a slow app builds a backlog instead of quietly slowing the generator.
+"""
+
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+from itertools import count
+
+import httpx
+
+# What users send, roughly in the mix the router sees: acknowledgements,
+# reminder requests, self-contained questions and ordinary chat
+TEXTS = (
+    "thanks!",
+    "ok",
+    "remind me to drink water every afternoon",
+    "can you remind me to stretch before bed",
+    "how much water should an adult drink a day?",
+    "what is a good bedtime routine?",
+    "I slept badly again and feel pretty tired today",
+    "I went for a run this morning and it felt great",
+    "work has been stressful this week, any tips for winding down",
+    "I want to start eating more vegetables but keep forgetting",
+)
+
+
+def text_message(phone: str, message_id: str, body: str) -> dict:
+    return {
+        "from": phone,
+        "id": message_id,
+        "timestamp": str(int(time.time())),
+        "type": "text",
+        "text": {"body": body},
+    }
+
+
+def audio_message(phone: str, message_id: str, media_id: str) -> dict:
+    return {
+        "from": phone,
+        "id": message_id,
+        "timestamp": str(int(time.time())),
+        "type": "audio",
+        "audio": {"id": media_id, "mime_type": "audio/ogg; codecs=opus", "voice": True},
+    }
+
+
+def webhook(phone: str, name: str, message: dict) -> dict:
+    """The notification Meta posts for one incoming message."""
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "bench",
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {
+                                "display_phone_number": "15550000000",
+                                "phone_number_id": "bench-phone",
+                            },
+                            "contacts": [{"profile": {"name": name}, "wa_id": phone}],
+                            "messages": [message],
+                        },
+                    }
+                ],
+            }
+        ],
+    }
+
+
+def percentiles(values: list[float]) -> dict:
+    """Exact nearest-rank percentiles, in the unit of `values`."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 1),
+        "p50": rank(0.5),
+        "p90": rank(0.9),
+        "p99": rank(0.99),
+        "max": round(ordered[-1], 1),
+    }
+
+
+class Sample:
+    """One webhook post and, once it arrives, the reply it produced."""
+
+    __slots__ = ("kind", "phone", "sent_at", "ack_ms", "status", "replied_at")
+
+    def __init__(self, kind: str, phone: str, sent_at: float):
+        self.kind = kind
+        self.phone = phone
+        self.sent_at = sent_at
+        self.ack_ms: float | None = None
+        self.status: int | str | None = None
+        self.replied_at: float | None = None
+
+
+class LoadGenerator:
+    """
+    Posts webhooks to `url` at `rps` for `duration` seconds, `audio_share`
+    of them voice notes. Senders are taken round-robin from `users`
+    phone numbers so the mailbox rarely merges two posts into one turn.
+
+    Arrivals are Poisson by default (bursty, like real traffic), or evenly
+    spaced with `poisson=False`. A post counts as answered when the fake
+    Graph API sees the next message sent to its phone number.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        rps: float,
+        duration: float,
+        audio_share: float,
+        users: int,
+        poisson: bool = True,
+        seed: int | None = None,
+    ):
+        self.url = url
+        self.rps = rps
+        self.duration = duration
+        self.audio_share = audio_share
+        self.users = users
+        self.poisson = poisson
+        self.random = random.Random(seed)
+        self.samples: list[Sample] = []
+        self._pending: dict[str, deque[Sample]] = defaultdict(deque)
+        self._ids = count(1)
+
+    def on_send(self, at: float, payload: dict):
+        """Called by the fake Graph API for every message the app sends."""
+        pending = self._pending.get(payload.get("to"))
+        if pending:
+            pending.popleft().replied_at = at
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+        async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+            posts = []
+            started = time.monotonic()
+            next_at = started
+            while next_at < started + self.duration:
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+                posts.append(asyncio.create_task(self._post(client)))
+                if self.poisson:
+                    next_at += self.random.expovariate(self.rps)
+                else:
+                    next_at += 1 / self.rps
+            await asyncio.gather(*posts)
+
+    async def _post(self, client: httpx.AsyncClient):
+        n = next(self._ids)
+        phone = f"1555{n % self.users:07d}"
+        message_id = f"wamid.bench.in.{n}"
+        if self.random.random() < self.audio_share:
+            kind = "audio"
+            message = audio_message(phone, message_id, f"bench-voice-{n}")
+        else:
+            kind = "text"
+            message = text_message(phone, message_id, self.random.choice(TEXTS))
+
+        sample = Sample(kind, phone, time.monotonic())
+        self.samples.append(sample)
+        self._pending[phone].append(sample)
+        try:
+            response = await client.post(
+                self.url, json=webhook(phone, f"Bench {n % self.users}", message)
+            )
+            sample.status = response.status_code
+        except httpx.HTTPError as e:
+            sample.status = type(e).__name__
+        sample.ack_ms = (time.monotonic() - sample.sent_at) * 1000
+        if sample.status != 200 and sample in self._pending[phone]:
+            self._pending[phone].remove(sample)
+
+    def outstanding(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    async def drain(self, timeout: float):
+        """Waits up to `timeout` seconds for the replies still owed."""
+        deadline = time.monotonic() + timeout
+        while self.outstanding() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+    def report(self, since: float) -> dict:
+        """Summarizes the posts sent at or after `since` (i.e. after warmup)."""
+        samples = [s for s in self.samples if s.sent_at >= since]
+        if not samples:
+            return {"sent": 0}
+        statuses: dict[str, int] = defaultdict(int)
+        for s in samples:
+            statuses[str(s.status)] += 1
+        replied = [s for s in samples if s.replied_at is not None]
+        until = max(s.sent_at for s in samples)
+        window = until - since
+        # Replies landing while traffic was offered, whenever they were asked for
+        delivered = sum(
+            1
+            for s in self.samples
+            if s.replied_at is not None and since <= s.replied_at <= until
+        )
+
+        by_kind = {}
+        for kind in ("text", "audio"):
+            e2e = [(s.replied_at - s.sent_at) * 1000 for s in replied if s.kind == kind]
+            by_kind[kind] = percentiles(e2e)
+
+        return {
+            "sent": len(samples),
+            "offered_rps": round(len(samples) / window, 2) if window else 0.0,
+            "throughput_rps": round(delivered / window, 2) if window else 0.0,
+            "acks": dict(statuses),
+            "replied": len(replied),
+            "unanswered": len(samples) - len(replied),
+            "ack_ms": percentiles([s.ack_ms for s in samples if s.ack_ms is not None]),
+            "e2e_ms": percentiles([(s.replied_at - s.sent_at) * 1000 for s in replied]),
+            "e2e_ms_by_kind": by_kind,
+        }
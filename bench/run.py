@@ -0,0 +1,497 @@
+"""
+Runs app.service:app against the fakes in bench/fakes.py under generated
+webhook traffic, and writes a JSON report:
+
+    python -m bench.run --rps 20 --duration 60
+    python -m bench.run --rps 80 --shards 4
+    python -m bench.run --compare bench/results/<baseline>.json
+
+With --compare the run fails (exit 1) if throughput dropped, or p99
+acknowledgement or end-to-end latency grew, by more than --tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+from bench.fakes import FakeElevenLabs, FakeGraph, FakeOpenAI, FakeSupabase, Faults
+from bench.loadgen import LoadGenerator
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS = ROOT / "bench" / "results"
+
+SERIES = re.compile(r"^(\w+)(?:\{(.*)\})? (\S+)$")
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+# (report path, True if higher is better) checked by --compare
+CHECKS = (
+    ("load.throughput_rps", True),
+    ("load.ack_ms.p99", False),
+    ("load.e2e_ms.p99", False),
+)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    load = parser.add_argument_group("load")
+    load.add_argument("--rps", type=float, default=10.0)
+    load.add_argument("--duration", type=float, default=30.0, help="seconds measured")
+    load.add_argument("--warmup", type=float, default=5.0, help="seconds not measured")
+    load.add_argument("--drain", type=float, default=30.0, help="wait for late replies")
+    load.add_argument("--audio-share", type=float, default=0.2)
+    load.add_argument("--users", type=int, default=1000)
+    load.add_argument("--uniform", action="store_true", help="evenly spaced arrivals")
+    load.add_argument("--seed", type=int, default=None)
+
+    fakes = parser.add_argument_group("fake services (latencies in ms)")
+    fakes.add_argument("--graph-latency", type=float, default=60.0)
+    fakes.add_argument("--openai-latency", type=float, default=400.0)
+    fakes.add_argument("--openai-token", type=float, default=15.0)
+    fakes.add_argument("--elevenlabs-latency", type=float, default=250.0)
+    fakes.add_argument("--supabase-latency", type=float, default=10.0)
+    fakes.add_argument(
+        "--jitter", type=float, default=0.5, help="extra random latency, as a fraction"
+    )
+    fakes.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of upstream calls failing"
+    )
+
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="run the app as this many app.cluster workers instead of one uvicorn",
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="app setting for this run (repeatable)",
+    )
+    parser.add_argument("--output", type=Path, help="report path")
+    parser.add_argument("--app-log", type=Path, help="where the app's output goes")
+    parser.add_argument("--compare", type=Path, help="baseline report")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    return parser.parse_args(argv)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git(*args: str) -> str:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def serve(app, port: int) -> tuple[uvicorn.Server, asyncio.Task]:
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"
+        )
+    )
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+def proc_stat(pid: int) -> list[str] | None:
+    """The fields of /proc/<pid>/stat after the command name."""
+    try:
+        return Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+
+
+class ResourceSampler:
+    """
+    CPU time and memory of the app process and its children (the shard
+    workers under app.cluster), read from /proc once a second.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.cpu_percent: list[float] = []
+        self.rss_mb: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    def pids(self) -> list[int]:
+        children = [
+            int(entry.name)
+            for entry in Path("/proc").iterdir()
+            if entry.name.isdigit()
+            and (proc_stat(int(entry.name)) or [None, None])[1] == str(self.pid)
+        ]
+        return [self.pid, *children]
+
+    def cpu_seconds(self) -> float | None:
+        if proc_stat(self.pid) is None:
+            return None
+        total = 0
+        for pid in self.pids():
+            fields = proc_stat(pid)
+            if fields:
+                total += int(fields[11]) + int(fields[12])  # utime + stime
+        return total / self.tick
+
+    def status(self) -> dict:
+        """VmRSS and VmHWM (kB) and Threads, summed over the processes."""
+        totals: dict[str, int] = {}
+        for pid in self.pids():
+            try:
+                lines = Path(f"/proc/{pid}/status").read_text().splitlines()
+            except OSError:
+                continue
+            values = dict(line.split(":", 1) for line in lines if ":" in line)
+            for k in ("VmRSS", "VmHWM", "Threads"):
+                if k in values:
+                    totals[k] = totals.get(k, 0) + int(values[k].split()[0])
+        return totals
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        last, at = self.cpu_seconds(), time.monotonic()
+        while last is not None:
+            await asyncio.sleep(1.0)
+            cpu, now = self.cpu_seconds(), time.monotonic()
+            if cpu is None:
+                return
+            self.cpu_percent.append(100 * (cpu - last) / (now - at))
+            self.rss_mb.append(int(self.status().get("VmRSS", 0)) / 1024)
+            last, at = cpu, now
+
+    async def stop(self) -> dict:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        status = self.status()
+        if not status:
+            return {"available": False}
+        return {
+            "cpu_seconds": self.cpu_seconds(),
+            "cpu_percent_avg": round(sum(self.cpu_percent) / len(self.cpu_percent), 1)
+            if self.cpu_percent
+            else 0.0,
+            "cpu_percent_max": round(max(self.cpu_percent, default=0.0), 1),
+            "rss_mb": round(int(status.get("VmRSS", 0)) / 1024, 1),
+            "peak_rss_mb": round(int(status.get("VmHWM", 0)) / 1024, 1),
+            "threads": int(status.get("Threads", 0)),
+        }
+
+
+def app_env(urls: dict[str, str], overrides: list[str]) -> dict[str, str]:
+    env = {
+        **os.environ,
+        "DOTENV_PATH": "",  # a developer's .env must not point the app at real services
+        "WHATSAPP_TOKEN": "bench",
+        "WEBHOOK_VERIFICATION_TOKEN": "bench",
+        "PHONE_NUMBER_ID": "bench-phone",
+        "OPENAI_KEY": "bench",
+        "ELEVENLABS_KEY": "bench",
+        "SUPABASE_KEY": "bench",
+        "GRAPH_API_URL": urls["graph"],
+        "OPENAI_BASE_URL": urls["openai"] + "/v1",
+        "ELEVENLABS_BASE_URL": urls["elevenlabs"],
+        "SUPABASE_URL": urls["supabase"],
+        "SUPABASE_REALTIME": "false",
+        "TTS_CACHE_DIR": "",
+        "TOKENIZER": "estimate",  # the tiktoken encoding would be downloaded
+        "LOG_LEVEL": "warning",
+    }
+    for item in overrides:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+def parse_metrics(text: str) -> dict[tuple[str, tuple], float]:
+    """Prometheus text format as {(series, labels): value}."""
+    series = {}
+    for line in text.splitlines():
+        match = SERIES.match(line)
+        if match and not line.startswith("#"):
+            labels = tuple(LABEL.findall(match[2] or ""))
+            series[(match[1], labels)] = float(match[3])
+    return series
+
+
+async def scrape(client: httpx.AsyncClient, urls: list[str]) -> dict:
+    """/metrics of every app process, summed series by series."""
+    total: dict[tuple[str, tuple], float] = defaultdict(float)
+    for url in urls:
+        for key, value in parse_metrics(
+            (await client.get(f"{url}/metrics")).text
+        ).items():
+            total[key] += value
+    return dict(total)
+
+
+def histogram_delta(before: dict, after: dict, name: str, label: str = "") -> dict:
+    """
+    The observations histogram `name` gained between two scrapes, so the
+    report covers the measured window only, not startup and warmup.
+    Quantiles are bucket upper bounds, as in app/metrics.py.
+    """
+    buckets: dict[str, list[tuple[float, float]]] = defaultdict(list)
+    sums: dict[str, float] = {}
+    for key, value in after.items():
+        series, labels = key
+        tags = dict(labels)
+        gained = value - before.get(key, 0.0)
+        if series == f"{name}_bucket":
+            bound = float(tags.pop("le"))
+            buckets[tags.get(label, "")].append((bound, gained))
+        elif series == f"{name}_sum":
+            sums[tags.get(label, "")] = gained
+
+    result = {}
+    for value, pairs in sorted(buckets.items()):
+        pairs.sort()
+        count = pairs[-1][1]  # the +Inf bucket
+        if not count:
+            continue
+        finite = [bound for bound, _ in pairs if bound != float("inf")]
+
+        def quantile(q: float) -> float:
+            bound = next(b for b, cumulative in pairs if cumulative >= q * count)
+            return min(bound, finite[-1])
+
+        result[value] = {
+            "count": int(count),
+            "avg": round(sums.get(value, 0.0) / count, 1),
+            "p50": quantile(0.5),
+            "p95": quantile(0.95),
+            "p99": quantile(0.99),
+        }
+    return result
+
+
+async def wait_healthy(url: str, app: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if app.poll() is not None:
+                raise RuntimeError(f"the app exited during startup ({app.returncode})")
+            try:
+                if (await client.get(f"{url}/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("the app did not become healthy in time")
+
+
+async def run(args: argparse.Namespace) -> dict:
+    jitter = args.jitter
+    graph = FakeGraph(
+        Faults(args.graph_latency, args.graph_latency * jitter, args.error_rate)
+    )
+    openai = FakeOpenAI(
+        Faults(args.openai_latency, args.openai_latency * jitter, args.error_rate),
+        token_ms=args.openai_token,
+    )
+    elevenlabs = FakeElevenLabs(
+        Faults(
+            args.elevenlabs_latency, args.elevenlabs_latency * jitter, args.error_rate
+        ),
+        transcript="remind me to take my vitamins in the morning",
+    )
+    supabase = FakeSupabase(
+        Faults(args.supabase_latency, args.supabase_latency * jitter, args.error_rate)
+    )
+    fakes = {
+        "graph": graph,
+        "openai": openai,
+        "elevenlabs": elevenlabs,
+        "supabase": supabase,
+    }
+
+    servers, urls = [], {}
+    for name, fake in fakes.items():
+        port = free_port()
+        servers.append(await serve(fake.app, port))
+        urls[name] = f"http://127.0.0.1:{port}"
+
+    app_port = free_port()
+    app_url = f"http://127.0.0.1:{app_port}"
+    env = app_env(urls, args.env)
+    if args.shards > 1:
+        # Shard i also answers on its private port, which is how each one's
+        # /metrics and /stats are read
+        base_port = free_port()
+        env["SHARD_BASE_PORT"] = str(base_port)
+        command = ["app.cluster", "--shards", str(args.shards)]
+        shard_urls = [f"http://127.0.0.1:{base_port + i}" for i in range(args.shards)]
+    else:
+        command = ["uvicorn", "app.service:app"]
+        shard_urls = [app_url]
+    log = open(args.app_log, "w") if args.app_log else subprocess.DEVNULL
+    app = subprocess.Popen(
+        [sys.executable, "-m", *command, "--host", "127.0.0.1"]
+        + ["--port", str(app_port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    try:
+        for url in shard_urls:
+            await wait_healthy(url, app)
+        resources = ResourceSampler(app.pid)
+        load = LoadGenerator(
+            f"{app_url}/webhook",
+            rps=args.rps,
+            duration=args.warmup + args.duration,
+            audio_share=args.audio_share,
+            users=args.users,
+            poisson=not args.uniform,
+            seed=args.seed,
+        )
+        graph.on_send = load.on_send
+
+        async with httpx.AsyncClient() as client:
+            measured_from = time.monotonic() + args.warmup
+            sending = asyncio.create_task(load.run())
+            await asyncio.sleep(args.warmup)
+            resources.start()
+            before = await scrape(client, shard_urls)
+            await sending
+            await load.drain(args.drain)
+            usage = await resources.stop()
+            after = await scrape(client, shard_urls)
+            stats = [(await client.get(f"{url}/stats")).json() for url in shard_urls]
+    finally:
+        app.send_signal(signal.SIGINT)
+        try:
+            app.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            app.kill()
+        if log is not subprocess.DEVNULL:
+            log.close()
+        for server, task in servers:
+            server.should_exit = True
+            await task
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "args": {
+            k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()
+        },
+        "load": load.report(measured_from),
+        "event_loop": {
+            **histogram_delta(before, after, "aura_event_loop_lag_ms").get("", {}),
+            "max_ms_since_start": max(s["event_loop"]["max_ms"] for s in stats),
+        },
+        "stages": histogram_delta(before, after, "aura_stage_latency_ms", "stage"),
+        "resources": usage,
+        "fakes": {name: fake.stats() for name, fake in fakes.items()},
+        # One process's /stats, or a list with one per shard
+        "app": stats[0] if len(stats) == 1 else stats,
+    }
+
+
+def lookup(report: dict, path: str) -> float | None:
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """The checks that regressed by more than `tolerance`, as printable lines."""
+    regressions = []
+    for path, higher_is_better in CHECKS:
+        now, before = lookup(report, path), lookup(baseline, path)
+        if not now or not before:
+            continue
+        change = (now - before) / before
+        worse = -change if higher_is_better else change
+        line = f"{path}: {before} -> {now} ({change:+.1%})"
+        print(("❌ " if worse > tolerance else "   ") + line)
+        if worse > tolerance:
+            regressions.append(line)
+    return regressions
+
+
+def summary(report: dict):
+    load = report["load"]
+    e2e, ack = load.get("e2e_ms", {}), load.get("ack_ms", {})
+    lag, usage = report["event_loop"], report["resources"]
+    print(f"commit {report['commit']}{' (dirty)' if report['dirty'] else ''}")
+    print(
+        f"sent {load['sent']} at {load.get('offered_rps')} rps, "
+        f"replied {load.get('replied')} ({load.get('throughput_rps')} rps), "
+        f"unanswered {load.get('unanswered')}, acks {load.get('acks')}"
+    )
+    for name, p in (("ack", ack), ("e2e", e2e)):
+        if p.get("count"):
+            print(
+                f"{name} ms  p50 {p['p50']}  p90 {p['p90']}  p99 {p['p99']}  max {p['max']}"
+            )
+    print(
+        f"event loop lag ms  p50 <= {lag.get('p50')}  p99 <= {lag.get('p99')}  "
+        f"max since start {lag.get('max_ms_since_start')}"
+    )
+    if usage.get("available", True):
+        print(
+            f"cpu {usage.get('cpu_percent_avg')}% avg, {usage.get('cpu_percent_max')}% max; "
+            f"rss {usage.get('rss_mb')} MB, peak {usage.get('peak_rss_mb')} MB"
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = RESULTS / f"{stamp}-{report['commit'] or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    summary(report)
+    print(f"report written to {output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        print(f"compared with {args.compare} ({baseline.get('commit')}):")
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+-- WhatsApp message ids that have already been accepted by a replica.
+-- Used by app/dedup.py to drop Meta webhook redeliveries.
+create table if not exists public.processed_messages (
+    message_id text primary key,
+    received_at timestamptz not null default now()
+);
+
+create index if not exists processed_messages_received_at_idx
+    on public.processed_messages (received_at);
@@ -0,0 +1,125 @@
+-- Server-side functions that persist one webhook turn in two round trips.
+-- Called from Repository.begin_turn / Repository.finish_turn in app/db.py.
+
+-- begin_turn upserts the user by phone number
+create unique index if not exists users_phone_key on public.users (phone);
+
+create or replace function public.aura_begin_turn(
+    p_phone text,
+    p_name text,
+    p_messages jsonb,
+    p_history_limit integer default 20
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_user public.users;
+    v_conversation public.conversations;
+    v_existing boolean := true;
+    v_message_ids bigint[];
+    v_history jsonb;
+begin
+    insert into public.users (phone, name)
+    values (p_phone, p_name)
+    on conflict (phone) do nothing;
+
+    select * into v_user from public.users where phone = p_phone;
+
+    select * into v_conversation
+    from public.conversations
+    where user_id = v_user.id and status = 'open'
+    order by started_at desc
+    limit 1;
+
+    if v_conversation.id is null then
+        v_existing := false;
+        insert into public.conversations (user_id, topic, status)
+        values (v_user.id, 'General', 'open')
+        returning * into v_conversation;
+    end if;
+
+    with inserted as (
+        insert into public.messages
+            (user_id, conversation_id, role, message, message_type, audio_id, message_id)
+        select v_user.id, v_conversation.id, m.role, m.message, m.message_type, m.audio_id, m.message_id
+        from jsonb_to_recordset(p_messages)
+            as m(role text, message text, message_type text, audio_id text, message_id text)
+        returning id
+    )
+    select coalesce(array_agg(id), '{}') into v_message_ids from inserted;
+
+    select coalesce(jsonb_agg(jsonb_build_object('role', h.role, 'message', h.message) order by h.timestamp, h.id), '[]'::jsonb)
+    into v_history
+    from (
+        select id, role, message, timestamp
+        from public.messages
+        where user_id = v_user.id
+        order by timestamp desc, id desc
+        limit p_history_limit
+    ) h;
+
+    return jsonb_build_object(
+        'user', to_jsonb(v_user),
+        'conversation', jsonb_build_object('id', v_conversation.id, 'topic', v_conversation.topic),
+        'existing_conversation', v_existing,
+        'message_ids', to_jsonb(v_message_ids),
+        'history', v_history
+    );
+end;
+$$;
+
+create or replace function public.aura_finish_turn(
+    p_user_id bigint,
+    p_conversation_id bigint,
+    p_message_ids bigint[],
+    p_topic text,
+    p_assistant jsonb,
+    p_task jsonb default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_conversation_id bigint;
+    v_created boolean := false;
+    v_task_id bigint;
+    v_task jsonb;
+begin
+    select id into v_conversation_id
+    from public.conversations
+    where user_id = p_user_id and status = 'open' and topic = p_topic
+    order by started_at desc
+    limit 1;
+
+    if v_conversation_id is null then
+        v_created := true;
+        insert into public.conversations (user_id, topic, status)
+        values (p_user_id, p_topic, 'open')
+        returning id into v_conversation_id;
+    end if;
+
+    if v_conversation_id <> p_conversation_id then
+        update public.messages
+        set conversation_id = v_conversation_id
+        where id = any(p_message_ids);
+    end if;
+
+    if p_task is not null then
+        insert into public.tasks (user_id, conversation_id, type, active, freq, content)
+        select p_user_id, v_conversation_id, t.type, t.active, t.freq, t.content
+        from jsonb_to_record(p_task) as t(type text, active boolean, freq numeric, content text)
+        returning id into v_task_id;
+
+        select to_jsonb(t) into v_task from public.tasks t where t.id = v_task_id;
+    end if;
+
+    insert into public.messages (user_id, conversation_id, role, message, message_type)
+    select p_user_id, v_conversation_id, a.role, a.message, a.message_type
+    from jsonb_to_record(p_assistant) as a(role text, message text, message_type text);
+
+    return jsonb_build_object(
+        'conversation_id', v_conversation_id,
+        'created_conversation', v_created,
+        'task', v_task
+    );
+end;
+$$;
@@ -0,0 +1,74 @@
+-- aura_begin_turn also returns the user's open conversations so the
+-- repository can warm its conversation cache (app/cache.py) and serve the
+-- next turn from memory.
+
+create or replace function public.aura_begin_turn(
+    p_phone text,
+    p_name text,
+    p_messages jsonb,
+    p_history_limit integer default 20
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_user public.users;
+    v_conversation public.conversations;
+    v_existing boolean := true;
+    v_message_ids bigint[];
+    v_history jsonb;
+    v_open_conversations jsonb;
+begin
+    insert into public.users (phone, name)
+    values (p_phone, p_name)
+    on conflict (phone) do nothing;
+
+    select * into v_user from public.users where phone = p_phone;
+
+    select * into v_conversation
+    from public.conversations
+    where user_id = v_user.id and status = 'open'
+    order by started_at desc
+    limit 1;
+
+    if v_conversation.id is null then
+        v_existing := false;
+        insert into public.conversations (user_id, topic, status)
+        values (v_user.id, 'General', 'open')
+        returning * into v_conversation;
+    end if;
+
+    with inserted as (
+        insert into public.messages
+            (user_id, conversation_id, role, message, message_type, audio_id, message_id)
+        select v_user.id, v_conversation.id, m.role, m.message, m.message_type, m.audio_id, m.message_id
+        from jsonb_to_recordset(p_messages)
+            as m(role text, message text, message_type text, audio_id text, message_id text)
+        returning id
+    )
+    select coalesce(array_agg(id), '{}') into v_message_ids from inserted;
+
+    select coalesce(jsonb_agg(jsonb_build_object('role', h.role, 'message', h.message) order by h.timestamp, h.id), '[]'::jsonb)
+    into v_history
+    from (
+        select id, role, message, timestamp
+        from public.messages
+        where user_id = v_user.id
+        order by timestamp desc, id desc
+        limit p_history_limit
+    ) h;
+
+    select coalesce(jsonb_agg(jsonb_build_object('id', c.id, 'topic', c.topic) order by c.started_at desc), '[]'::jsonb)
+    into v_open_conversations
+    from public.conversations c
+    where c.user_id = v_user.id and c.status = 'open';
+
+    return jsonb_build_object(
+        'user', to_jsonb(v_user),
+        'open_conversations', v_open_conversations,
+        'conversation', jsonb_build_object('id', v_conversation.id, 'topic', v_conversation.topic),
+        'existing_conversation', v_existing,
+        'message_ids', to_jsonb(v_message_ids),
+        'history', v_history
+    );
+end;
+$$;
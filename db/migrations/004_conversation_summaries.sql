@@ -0,0 +1,151 @@
+-- Rolling per-conversation summaries for the context builder (app/context.py).
+-- `summary` condenses every message up to and including `summary_through`;
+-- newer messages are sent to the model verbatim.
+
+alter table public.conversations
+    add column if not exists summary text,
+    add column if not exists summary_through bigint;
+
+-- aura_begin_turn returns message ids with the history and the summary with
+-- each conversation, and aura_finish_turn returns the assistant message id,
+-- so the in-process history window can tell what is already summarized.
+
+create or replace function public.aura_begin_turn(
+    p_phone text,
+    p_name text,
+    p_messages jsonb,
+    p_history_limit integer default 20
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_user public.users;
+    v_conversation public.conversations;
+    v_existing boolean := true;
+    v_message_ids bigint[];
+    v_history jsonb;
+    v_open_conversations jsonb;
+begin
+    insert into public.users (phone, name)
+    values (p_phone, p_name)
+    on conflict (phone) do nothing;
+
+    select * into v_user from public.users where phone = p_phone;
+
+    select * into v_conversation
+    from public.conversations
+    where user_id = v_user.id and status = 'open'
+    order by started_at desc
+    limit 1;
+
+    if v_conversation.id is null then
+        v_existing := false;
+        insert into public.conversations (user_id, topic, status)
+        values (v_user.id, 'General', 'open')
+        returning * into v_conversation;
+    end if;
+
+    with inserted as (
+        insert into public.messages
+            (user_id, conversation_id, role, message, message_type, audio_id, message_id)
+        select v_user.id, v_conversation.id, m.role, m.message, m.message_type, m.audio_id, m.message_id
+        from jsonb_to_recordset(p_messages)
+            as m(role text, message text, message_type text, audio_id text, message_id text)
+        returning id
+    )
+    select coalesce(array_agg(id), '{}') into v_message_ids from inserted;
+
+    select coalesce(jsonb_agg(jsonb_build_object('id', h.id, 'role', h.role, 'message', h.message) order by h.timestamp, h.id), '[]'::jsonb)
+    into v_history
+    from (
+        select id, role, message, timestamp
+        from public.messages
+        where user_id = v_user.id
+        order by timestamp desc, id desc
+        limit p_history_limit
+    ) h;
+
+    select coalesce(jsonb_agg(jsonb_build_object(
+        'id', c.id,
+        'topic', c.topic,
+        'summary', c.summary,
+        'summary_through', c.summary_through
+    ) order by c.started_at desc), '[]'::jsonb)
+    into v_open_conversations
+    from public.conversations c
+    where c.user_id = v_user.id and c.status = 'open';
+
+    return jsonb_build_object(
+        'user', to_jsonb(v_user),
+        'open_conversations', v_open_conversations,
+        'conversation', jsonb_build_object(
+            'id', v_conversation.id,
+            'topic', v_conversation.topic,
+            'summary', v_conversation.summary,
+            'summary_through', v_conversation.summary_through
+        ),
+        'existing_conversation', v_existing,
+        'message_ids', to_jsonb(v_message_ids),
+        'history', v_history
+    );
+end;
+$$;
+
+create or replace function public.aura_finish_turn(
+    p_user_id bigint,
+    p_conversation_id bigint,
+    p_message_ids bigint[],
+    p_topic text,
+    p_assistant jsonb,
+    p_task jsonb default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_conversation_id bigint;
+    v_created boolean := false;
+    v_task_id bigint;
+    v_task jsonb;
+    v_assistant_id bigint;
+begin
+    select id into v_conversation_id
+    from public.conversations
+    where user_id = p_user_id and status = 'open' and topic = p_topic
+    order by started_at desc
+    limit 1;
+
+    if v_conversation_id is null then
+        v_created := true;
+        insert into public.conversations (user_id, topic, status)
+        values (p_user_id, p_topic, 'open')
+        returning id into v_conversation_id;
+    end if;
+
+    if v_conversation_id <> p_conversation_id then
+        update public.messages
+        set conversation_id = v_conversation_id
+        where id = any(p_message_ids);
+    end if;
+
+    if p_task is not null then
+        insert into public.tasks (user_id, conversation_id, type, active, freq, content)
+        select p_user_id, v_conversation_id, t.type, t.active, t.freq, t.content
+        from jsonb_to_record(p_task) as t(type text, active boolean, freq numeric, content text)
+        returning id into v_task_id;
+
+        select to_jsonb(t) into v_task from public.tasks t where t.id = v_task_id;
+    end if;
+
+    insert into public.messages (user_id, conversation_id, role, message, message_type)
+    select p_user_id, v_conversation_id, a.role, a.message, a.message_type
+    from jsonb_to_record(p_assistant) as a(role text, message text, message_type text)
+    returning id into v_assistant_id;
+
+    return jsonb_build_object(
+        'conversation_id', v_conversation_id,
+        'created_conversation', v_created,
+        'task', v_task,
+        'assistant_message_id', v_assistant_id
+    );
+end;
+$$;
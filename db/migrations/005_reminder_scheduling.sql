@@ -0,0 +1,62 @@
+-- Reminder scheduling across replicas (app/scheduler.py).
+--
+-- One replica at a time holds the "reminders" lease and runs the scheduler;
+-- the others keep trying to take it over when it expires. Each firing is
+-- additionally claimed by advancing tasks.last_fired_at, so a reminder slot
+-- is sent once even while the lease changes hands.
+
+alter table public.tasks
+    add column if not exists last_fired_at timestamptz;
+
+create table if not exists public.scheduler_leases (
+    name text primary key,
+    holder text not null,
+    expires_at timestamptz not null
+);
+
+create or replace function public.aura_acquire_lease(
+    p_name text,
+    p_holder text,
+    p_ttl_seconds integer
+) returns boolean
+language plpgsql
+as $$
+declare
+    v_holder text;
+begin
+    insert into public.scheduler_leases as l (name, holder, expires_at)
+    values (p_name, p_holder, now() + make_interval(secs => p_ttl_seconds))
+    on conflict (name) do update
+        set holder = excluded.holder, expires_at = excluded.expires_at
+        where l.holder = excluded.holder or l.expires_at < now()
+    returning holder into v_holder;
+
+    return v_holder is not null;
+end;
+$$;
+
+create or replace function public.aura_release_lease(
+    p_name text,
+    p_holder text
+) returns void
+language sql
+as $$
+    delete from public.scheduler_leases where name = p_name and holder = p_holder;
+$$;
+
+create or replace function public.aura_claim_reminder(
+    p_task_id bigint,
+    p_fire_at timestamptz
+) returns boolean
+language plpgsql
+as $$
+begin
+    update public.tasks
+    set last_fired_at = p_fire_at
+    where id = p_task_id
+      and active
+      and (last_fired_at is null or last_fired_at < p_fire_at);
+
+    return found;
+end;
+$$;
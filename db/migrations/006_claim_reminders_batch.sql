@@ -0,0 +1,24 @@
+-- Claims every reminder due in one dispatcher tick with a single request
+-- (app/scheduler.py). Same rule as aura_claim_reminder: a firing is won
+-- only if it advances the task's last_fired_at.
+
+create or replace function public.aura_claim_reminders(
+    p_claims jsonb
+) returns bigint[]
+language sql
+as $$
+    with claims as (
+        select c.task_id, max(c.fire_at) as fire_at
+        from jsonb_to_recordset(p_claims) as c(task_id bigint, fire_at timestamptz)
+        group by c.task_id
+    ), claimed as (
+        update public.tasks t
+        set last_fired_at = c.fire_at
+        from claims c
+        where t.id = c.task_id
+          and t.active
+          and (t.last_fired_at is null or t.last_fired_at < c.fire_at)
+        returning t.id
+    )
+    select coalesce(array_agg(id), '{}') from claimed;
+$$;
@@ -0,0 +1,32 @@
+-- tasks.updated_at is the watermark the task sync (app/task_sync.py) uses to
+-- catch up on changes missed while its Realtime connection was down.
+
+alter table public.tasks
+    add column if not exists updated_at timestamptz;
+
+update public.tasks set updated_at = created_at where updated_at is null;
+
+alter table public.tasks
+    alter column updated_at set default now(),
+    alter column updated_at set not null;
+
+create index if not exists tasks_updated_at_idx on public.tasks (updated_at);
+
+-- Bump updated_at on real edits only; claiming a reminder (last_fired_at)
+-- isn't a change to the schedule.
+create or replace function public.aura_touch_task() returns trigger
+language plpgsql
+as $$
+begin
+    if (to_jsonb(new) - 'last_fired_at' - 'updated_at')
+        is distinct from (to_jsonb(old) - 'last_fired_at' - 'updated_at') then
+        new.updated_at := now();
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists tasks_touch_updated_at on public.tasks;
+create trigger tasks_touch_updated_at
+    before update on public.tasks
+    for each row execute function public.aura_touch_task();
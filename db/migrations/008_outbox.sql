@@ -0,0 +1,33 @@
+-- Outbound WhatsApp messages that could not be delivered right away
+-- (app/outbox.py): rows are written when a send is deferred for a retry or
+-- still queued at shutdown, and taken back by the next process to start.
+
+create table if not exists public.outbox (
+    id uuid primary key,
+    phone_number_id text not null,
+    payload jsonb not null,
+    priority smallint not null,
+    attempts integer not null default 0,
+    next_attempt_at timestamptz not null default now(),
+    created_at timestamptz not null default now()
+);
+
+create index if not exists outbox_priority_next_attempt_idx
+    on public.outbox (priority, next_attempt_at);
+
+-- Hands a batch of rows to one replica by deleting them as it returns them
+create or replace function public.aura_take_outbox(
+    p_limit integer default 1000
+) returns setof public.outbox
+language sql
+as $$
+    delete from public.outbox
+    where id in (
+        select id
+        from public.outbox
+        order by priority, next_attempt_at
+        limit p_limit
+        for update skip locked
+    )
+    returning *;
+$$;
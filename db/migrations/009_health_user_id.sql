@@ -0,0 +1,6 @@
+-- Links an app user to their rows in the wearable, biomarker and assessment
+-- exports under data/ (the datasets' userId), read by app/health_data.py to
+-- personalize replies. Null for users without health data.
+
+alter table public.users
+    add column if not exists health_user_id bigint;
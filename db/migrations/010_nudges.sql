@@ -0,0 +1,10 @@
+-- Proactive nudges (app/nudges.py): when each user was last nudged, so the
+-- per-user cooldown holds across restarts and replicas, and an index over
+-- the users linked to the health datasets, which every nudge run reads.
+
+alter table public.users
+    add column if not exists last_nudged_at timestamptz;
+
+create index if not exists users_health_user_id_idx
+    on public.users (id)
+    where health_user_id is not null;
@@ -0,0 +1,46 @@
+-- Deferred outbox rows belong to the replica that still holds them in
+-- memory (app/outbox.py). It writes its holder id and a lease with each
+-- row and keeps renewing the lease while it runs; other replicas only take
+-- rows saved at shutdown (no owner) or whose owner's lease has lapsed, so a
+-- live replica's retries are never sent twice.
+
+alter table public.outbox
+    add column if not exists owner text,
+    add column if not exists lease_expires_at timestamptz;
+
+create index if not exists outbox_owner_idx
+    on public.outbox (owner)
+    where owner is not null;
+
+create or replace function public.aura_take_outbox(
+    p_limit integer default 1000
+) returns setof public.outbox
+language sql
+as $$
+    delete from public.outbox
+    where id in (
+        select id
+        from public.outbox
+        where owner is null or lease_expires_at < now()
+        order by priority, next_attempt_at
+        limit p_limit
+        for update skip locked
+    )
+    returning *;
+$$;
+
+-- Extends the lease on every row the holder owns; returns how many it renewed
+create or replace function public.aura_renew_outbox(
+    p_owner text,
+    p_ttl_seconds integer
+) returns integer
+language sql
+as $$
+    with renewed as (
+        update public.outbox
+        set lease_expires_at = now() + make_interval(secs => p_ttl_seconds)
+        where owner = p_owner
+        returning 1
+    )
+    select count(*)::integer from renewed;
+$$;
@@ -0,0 +1,47 @@
+-- A claimed reminder whose send fails is released again (app/scheduler.py),
+-- so the slot is retried or caught up instead of counting as sent. Claiming
+-- now also returns each won task's previous last_fired_at, which the
+-- release puts back.
+
+drop function if exists public.aura_claim_reminders(jsonb);
+
+create or replace function public.aura_claim_reminders(
+    p_claims jsonb
+) returns jsonb
+language sql
+as $$
+    with claims as (
+        select c.task_id, max(c.fire_at) as fire_at
+        from jsonb_to_recordset(p_claims) as c(task_id bigint, fire_at timestamptz)
+        group by c.task_id
+    ), claimed as (
+        update public.tasks t
+        set last_fired_at = c.fire_at
+        from claims c, public.tasks previous
+        where t.id = c.task_id
+          and previous.id = t.id
+          and t.active
+          and (t.last_fired_at is null or t.last_fired_at < c.fire_at)
+        returning t.id, previous.last_fired_at
+    )
+    select coalesce(jsonb_object_agg(id, last_fired_at), '{}') from claimed;
+$$;
+
+-- Undoes claims ({task_id, fire_at, previous}) that are still the latest;
+-- returns how many it released
+create or replace function public.aura_release_reminders(
+    p_claims jsonb
+) returns integer
+language sql
+as $$
+    with released as (
+        update public.tasks t
+        set last_fired_at = c.previous
+        from jsonb_to_recordset(p_claims)
+            as c(task_id bigint, fire_at timestamptz, previous timestamptz)
+        where t.id = c.task_id
+          and t.last_fired_at = c.fire_at
+        returning 1
+    )
+    select count(*)::integer from released;
+$$;